@@ -0,0 +1,145 @@
+"""Daily usage rollups per compound and per operator.
+
+``usage_rollups`` holds one document per (dimension, key, day), where
+dimension is "compound" (key: compound id) or "operator" (key: prepared_by)
+and day is the Istanbul calendar day. Each document counts weighings and sums
+the weighed and actual mass and the deviation. ``create_weighing`` applies
+every new usage with an upserted ``$inc``; ``rebuild`` regenerates everything
+from ``usages`` with one ``$group`` pipeline per dimension.
+
+Reports read only the rollups. For a year-long range that is at most 365
+documents per compound or operator, however many weighings there were.
+"""
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+ROLLUPS_COLLECTION = "usage_rollups"
+TIMEZONE = "Europe/Istanbul"
+DIMENSIONS = {"compound": "compound_id", "operator": "prepared_by"}  # dimension -> usage field
+SORT_FIELDS = ("weighed_mg", "actual_mass_mg", "count")
+BATCH_SIZE = 1000
+
+def day_key(value: datetime, tz) -> str:
+    return value.astimezone(tz).strftime("%Y-%m-%d")
+
+async def ensure_indexes(db):
+    await db[ROLLUPS_COLLECTION].create_index([("dim", 1), ("key", 1), ("day", 1)], unique=True)
+    await db[ROLLUPS_COLLECTION].create_index([("dim", 1), ("day", 1)])
+
+def rollup_update(dim: str, usage: Dict[str, Any], day: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(filter, update) folding one usage into a rollup document."""
+    deviation = usage.get("deviation") or 0.0
+    key = usage[DIMENSIONS[dim]]
+    return (
+        {"dim": dim, "key": key, "day": day},
+        {
+            "$inc": {
+                "count": 1,
+                "weighed_mg": usage.get("weighed_amount") or 0.0,
+                "actual_mass_mg": usage.get("actual_mass") or 0.0,
+                "deviation_sum": deviation,
+                "abs_deviation_sum": abs(deviation),
+            },
+            "$max": {"max_abs_deviation": abs(deviation)},
+            "$set": {"label": usage.get("compound_name") if dim == "compound" else key},
+        },
+    )
+
+async def record_usage(db, usage: Dict[str, Any], tz):
+    """Fold one new usage into its compound and operator rollups."""
+    day = day_key(usage["created_at"], tz)
+    for dim in DIMENSIONS:
+        selector, update = rollup_update(dim, usage, day)
+        await db[ROLLUPS_COLLECTION].update_one(selector, update, upsert=True)
+
+def group_pipeline(dim: str) -> List[Dict[str, Any]]:
+    field = f"${DIMENSIONS[dim]}"
+    return [
+        {"$group": {
+            "_id": {"key": field, "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at", "timezone": TIMEZONE}}},
+            "label": {"$last": "$compound_name" if dim == "compound" else field},
+            "count": {"$sum": 1},
+            "weighed_mg": {"$sum": "$weighed_amount"},
+            "actual_mass_mg": {"$sum": "$actual_mass"},
+            "deviation_sum": {"$sum": "$deviation"},
+            "abs_deviation_sum": {"$sum": {"$abs": "$deviation"}},
+            "max_abs_deviation": {"$max": {"$abs": "$deviation"}},
+        }},
+    ]
+
+async def rebuild(db, dry_run: bool = False) -> Dict[str, int]:
+    """Recompute every rollup from usages."""
+    report = {}
+    if not dry_run:
+        await db[ROLLUPS_COLLECTION].delete_many({})
+    for dim in DIMENSIONS:
+        written = 0
+        batch: List[Dict[str, Any]] = []
+        async for group in db.usages.aggregate(group_pipeline(dim), allowDiskUse=True):
+            written += 1
+            key = group.pop("_id")
+            batch.append({"dim": dim, "key": key["key"], "day": key["day"], **group})
+            if len(batch) >= BATCH_SIZE:
+                if not dry_run:
+                    await db[ROLLUPS_COLLECTION].insert_many(batch)
+                batch = []
+        if batch and not dry_run:
+            await db[ROLLUPS_COLLECTION].insert_many(batch)
+        report[dim] = written
+    return report
+
+def summarize(row: Dict[str, Any]) -> Dict[str, Any]:
+    count = row["count"]
+    return {
+        "count": count,
+        "weighed_mg": round(row["weighed_mg"], 3),
+        "actual_mass_mg": round(row["actual_mass_mg"], 3),
+        "avg_deviation": round(row["deviation_sum"] / count, 3) if count else None,
+        "avg_abs_deviation": round(row["abs_deviation_sum"] / count, 3) if count else None,
+        "max_abs_deviation": row.get("max_abs_deviation"),
+    }
+
+async def totals(db, dim: str, date_from: date, date_to: date, sort: str = "weighed_mg", limit: int = 100) -> List[Dict[str, Any]]:
+    """Per-key totals over whole days, largest ``sort`` first."""
+    pipeline = [
+        {"$match": {"dim": dim, "day": {"$gte": date_from.isoformat(), "$lte": date_to.isoformat()}}},
+        {"$group": {
+            "_id": "$key",
+            "label": {"$last": "$label"},
+            "count": {"$sum": "$count"},
+            "weighed_mg": {"$sum": "$weighed_mg"},
+            "actual_mass_mg": {"$sum": "$actual_mass_mg"},
+            "deviation_sum": {"$sum": "$deviation_sum"},
+            "abs_deviation_sum": {"$sum": "$abs_deviation_sum"},
+            "max_abs_deviation": {"$max": "$max_abs_deviation"},
+        }},
+        {"$sort": {sort: -1, "_id": 1}},
+        {"$limit": limit},
+    ]
+    rows = await db[ROLLUPS_COLLECTION].aggregate(pipeline).to_list(None)
+    return [{"key": row["_id"], "label": row["label"], **summarize(row)} for row in rows]
+
+def period_start(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+async def timeseries(db, dim: str, key: Optional[str], date_from: date, date_to: date, granularity: str = "day") -> List[Dict[str, Any]]:
+    """Totals per day, ISO week (starting Monday) or month, for one key or all of them."""
+    match: Dict[str, Any] = {"dim": dim, "day": {"$gte": date_from.isoformat(), "$lte": date_to.isoformat()}}
+    if key is not None:
+        match["key"] = key
+    buckets: Dict[date, Dict[str, Any]] = {}
+    cursor = db[ROLLUPS_COLLECTION].find(match, {"_id": 0}).sort("day", 1)
+    async for row in cursor:
+        start = period_start(date.fromisoformat(row["day"]), granularity)
+        bucket = buckets.setdefault(start, {
+            "count": 0, "weighed_mg": 0.0, "actual_mass_mg": 0.0,
+            "deviation_sum": 0.0, "abs_deviation_sum": 0.0, "max_abs_deviation": 0.0,
+        })
+        for field in ("count", "weighed_mg", "actual_mass_mg", "deviation_sum", "abs_deviation_sum"):
+            bucket[field] += row[field]
+        bucket["max_abs_deviation"] = max(bucket["max_abs_deviation"], row.get("max_abs_deviation") or 0.0)
+    return [{"period": start.isoformat(), **summarize(bucket)} for start, bucket in sorted(buckets.items())]
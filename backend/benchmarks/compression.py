@@ -0,0 +1,110 @@
+"""Bytes on the wire and CPU cost of response compression per payload and encoding.
+
+Runs in-process with no database. Each payload is served as a fixed response
+through CompressionMiddleware, so the numbers cover only compression and
+not the queries behind the real endpoints.
+
+    cd backend && python -m benchmarks.compression --docs 10000 --requests 10
+
+Payloads: the compound list, a search result with full usage documents,
+labels, and a weighing response with its base64 QR and barcode PNGs. Levels
+can be compared with COMPRESSION_GZIP_LEVEL / COMPRESSION_BROTLI_QUALITY.
+Brotli rows appear only when the ``brotli`` package is installed.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import time
+from typing import Dict, List, Tuple
+
+from fastapi import FastAPI
+
+import compression
+from benchmarks.data import synthetic_compounds, synthetic_history
+from label_assets import render_label_assets
+from server import FastJSONResponse
+
+def payloads(docs: int) -> Dict[str, object]:
+    compounds = synthetic_compounds(docs)
+    usages, labels = synthetic_history(compounds, min(docs, 2000))
+    assets = render_label_assets("LBL|code=TET-0001|name=Tetramethrin|cas=7696-12-0|c=1000 ppm|dt=2025-01-01|by=Bench", "TET-0001")
+    return {
+        "compounds": compounds,
+        "search": {"compounds": compounds[:50], "usages": usages[:100]},
+        "labels": labels,
+        "weighing": {
+            "usage": usages[0],
+            "label": labels[0],
+            "qr_code": base64.b64encode(assets["qr_png"]).decode(),
+            "barcode": base64.b64encode(assets["barcode_png"]).decode(),
+        },
+    }
+
+def build_app(data: Dict[str, object]) -> FastAPI:
+    bench = FastAPI()
+    for name, payload in data.items():
+        async def route(payload=payload):
+            return FastJSONResponse(payload)
+        bench.add_api_route(f"/{name}", route, methods=["GET"])
+    bench.add_middleware(compression.CompressionMiddleware)
+    return bench
+
+async def asgi_get(app: FastAPI, path: str, accept_encoding: str) -> Tuple[bytes, Dict[str, str]]:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "client": ("bench", 0), "server": ("bench", 80),
+        "headers": [(b"accept-encoding", accept_encoding.encode())],
+    }
+    body: List[bytes] = []
+    headers: Dict[str, str] = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            headers.update({k.decode(): v.decode() for k, v in message["headers"]})
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body), headers
+
+def compression_cpu(encoding: str) -> float:
+    return compression.COMPRESSION_SECONDS.get((encoding,))
+
+async def measure(app: FastAPI, path: str, encoding: str, requests: int) -> dict:
+    await asgi_get(app, path, encoding)  # warm-up
+    compress_start = compression_cpu(encoding)
+    cpu_start = time.process_time()
+    for _ in range(requests):
+        body, headers = await asgi_get(app, path, encoding)
+    cpu = time.process_time() - cpu_start
+    return {
+        "bytes": len(body),
+        "content_encoding": headers.get("content-encoding", "identity"),
+        "cpu_ms_per_request": round(cpu / requests * 1000, 2),
+        "compress_cpu_ms_per_request": round((compression_cpu(encoding) - compress_start) / requests * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=10)
+    args = parser.parse_args()
+
+    app = build_app(payloads(args.docs))
+    encodings = ["identity"] + compression.available_encodings("gzip,br")
+    results = {"docs": args.docs, "payloads": {}}
+    for path in ("compounds", "search", "labels", "weighing"):
+        rows = {encoding: asyncio.run(measure(app, f"/{path}", encoding, args.requests)) for encoding in encodings}
+        raw = rows["identity"]["bytes"]
+        for row in rows.values():
+            row["ratio"] = round(row["bytes"] / raw, 3) if raw else None
+        results["payloads"][path] = rows
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
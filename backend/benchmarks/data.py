@@ -0,0 +1,74 @@
+"""Synthetic catalogue and usage history shared by the benchmarks."""
+import random
+import uuid
+from datetime import timedelta
+from typing import Dict, List, Tuple
+
+import units
+from server import Label, Usage, normalize_compound_name, now_istanbul
+
+SOLVENTS = ["Acetonitrile", "Methanol", "Acetone", "Toluene", "Ethyl Acetate", "Hexane"]
+SYLLABLES = ["imi", "da", "clo", "prid", "tetra", "meth", "rin", "pyr", "eth", "oid", "cyp", "azo", "fen", "thi", "on"]
+
+def compound_name(rng: random.Random, i: int) -> str:
+    stem = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    return f"{stem.capitalize()} {i}"
+
+def synthetic_compounds(n: int, seed: int = 42) -> List[Dict]:
+    rng = random.Random(seed)
+    now = now_istanbul()
+    compounds = []
+    for i in range(n):
+        stock = float(rng.randint(50, 5000))
+        compounds.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "name": compound_name(rng, i),
+            "cas_number": f"{100000 + i}-{i % 100:02d}-{i % 10}",
+            "solvent": rng.choice(SOLVENTS),
+            "stock_value": stock,
+            "stock_unit": "mg",
+            "critical_value": 100.0,
+            "critical_unit": "mg",
+            **units.stock_fields(stock, "mg", 100.0, "mg"),
+            "last_serial": 0,
+            "notes": None,
+            "created_at": now,
+            "updated_at": now,
+        })
+    return compounds
+
+def synthetic_history(compounds: List[Dict], n: int, seed: int = 42) -> Tuple[List[Dict], List[Dict]]:
+    """Usages and their labels spread over the last year."""
+    rng = random.Random(seed)
+    now = now_istanbul()
+    usages, labels = [], []
+    serials: Dict[str, int] = {}  # compounds can share a code prefix; codes are unique like in create_weighing
+    for i in range(n):
+        compound = rng.choice(compounds)
+        created_at = now - timedelta(minutes=rng.randint(0, 525600))
+        prefix = normalize_compound_name(compound["name"])
+        serials[prefix] = max(serials.get(prefix, 0), compound["last_serial"]) + 1
+        compound["last_serial"] = serials[prefix]
+        code = f"{prefix}-{compound['last_serial']:04d}"
+        deviation = round(rng.gauss(0, 1.5), 2)
+        usage = Usage(
+            compound_id=compound["id"], compound_name=compound["name"], cas_number=compound["cas_number"],
+            weighed_amount=10.0, purity=99.0, actual_mass=9.9, target_concentration=1000.0,
+            concentration_mode="mg/L", required_volume=9.9, required_solvent_mass=7.8,
+            actual_concentration=1000.0 * (1 + deviation / 100), deviation=deviation,
+            solvent=compound["solvent"], temperature_c=25.0, solvent_density=0.7846,
+            remaining_stock=compound["stock_value"], remaining_stock_unit="mg",
+            prepared_by=f"Operator {rng.randint(1, 12)}", mix_code=None,
+            label_code_used=code, created_at=created_at,
+        )
+        date_str = created_at.strftime("%Y-%m-%d")
+        label = Label(
+            compound_id=compound["id"], usage_id=usage.id, label_code=code,
+            compound_name=compound["name"], cas_number=compound["cas_number"],
+            concentration="1000.0 ppm", prepared_by=usage.prepared_by, date=date_str,
+            qr_data=f"LBL|code={code}|name={compound['name']}|cas={compound['cas_number']}|c=1000.0 ppm|dt={date_str}|by={usage.prepared_by}",
+            created_at=created_at,
+        )
+        usages.append(usage.model_dump())
+        labels.append(label.model_dump())
+    return usages, labels
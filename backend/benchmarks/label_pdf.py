@@ -0,0 +1,52 @@
+"""PDF label rendering throughput: PNG symbols vs vector QR/Code128 paths.
+
+Runs in-process with no database; both paths render the same synthetic labels
+with the same sheet profile, so the numbers isolate symbol rendering and PDF
+assembly.
+
+    cd backend && python -m benchmarks.label_pdf --labels 500 --profile Single_70x25
+"""
+import argparse
+import json
+import time
+
+from benchmarks.data import synthetic_compounds, synthetic_history
+from label_pdf import render_labels_pdf
+from label_profiles import SHEET_PROFILES, DEFAULT_SHEET_PROFILE_ID
+
+def measure(labels, profile, copies: int, vector: bool, rounds: int) -> dict:
+    render_labels_pdf(labels[:5], profile, copies, vector)  # warm-up: imports, font metrics
+    pages = -(-len(labels) * copies // profile.per_page)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        size = len(render_labels_pdf(labels, profile, copies, vector).getvalue())
+    elapsed = (time.perf_counter() - started) / rounds
+    return {
+        "pages": pages,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(pages / elapsed, 1),
+        "bytes": size,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--labels", type=int, default=500)
+    parser.add_argument("--profile", default=DEFAULT_SHEET_PROFILE_ID, choices=sorted(SHEET_PROFILES))
+    parser.add_argument("--copies", type=int, default=1)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    _, labels = synthetic_history(synthetic_compounds(max(1, args.labels // 5)), args.labels)
+    profile = SHEET_PROFILES[args.profile]
+    results = {
+        "labels": args.labels,
+        "profile": args.profile,
+        "copies": args.copies,
+        "raster": measure(labels, profile, args.copies, False, args.rounds),
+        "vector": measure(labels, profile, args.copies, True, args.rounds),
+    }
+    results["speedup"] = round(results["vector"]["pages_per_second"] / results["raster"]["pages_per_second"], 2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Load test: drive the app in-process against a local Mongo or a mongomock stand-in.
+
+For each catalogue size the database is reseeded with synthetic compounds and
+usage/label history, then every workload is run with a fixed concurrency and
+its p50/p95/p99 latency, throughput, error count and peak RSS are reported.
+
+    pip install httpx mongomock-motor
+    cd backend && python -m benchmarks.load --sizes 1000,10000 --output baseline.json
+    cd backend && python -m benchmarks.load --sizes 1000,10000 --compare baseline.json
+
+Pass --mongo-url (or BENCH_MONGO_URL) to run against a real local mongod; the
+benchmark database is dropped and recreated for every size.
+
+--login-burst N runs every workload a second time (as "<name>+login_burst")
+while N clients log in as distinct users in a loop, the way a shift change
+looks. Compare the p99 of the two runs to see what password hashing costs
+the rest of the API.
+
+    cd backend && python -m benchmarks.load --sizes 1000 --login-burst 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+import passwords
+import server
+from benchmarks.data import synthetic_compounds, synthetic_history
+
+BENCH_DB_NAME = "pestilab_bench"
+BURST_PASSWORD = "bench-password"
+
+Workload = Callable[[httpx.AsyncClient, random.Random, List[Dict]], Awaitable[httpx.Response]]
+
+async def weighing(client, rng, compounds):
+    compound = rng.choice(compounds)
+    return await client.post("/api/weighing", json={
+        "compound_id": compound["id"], "weighed_amount": round(rng.uniform(5, 25), 2), "purity": 99.0,
+        "target_concentration": 1000, "concentration_mode": "mg/L", "temperature_c": 25.0,
+        "prepared_by": "Bench", "label_code_source": "auto",
+    })
+
+async def fuzzy_search(client, rng, compounds):
+    query = rng.choice(compounds)["name"][:rng.randint(3, 6)]
+    return await client.get("/api/search/fuzzy", params={"q": query, "limit": 20})
+
+async def dashboard(client, rng, compounds):
+    return await client.get("/api/dashboard")
+
+def export(path: str) -> Workload:
+    async def run(client, rng, compounds):
+        return await client.get(path)
+    return run
+
+WORKLOADS: Dict[str, Workload] = {
+    "weighing": weighing,
+    "fuzzy_search": fuzzy_search,
+    "dashboard": dashboard,
+    "export_weighings_xlsx": export("/api/weighings/export.xlsx"),
+    "export_labels_pdf": export("/api/labels/export.pdf"),
+    "export_labels_docx": export("/api/labels/export.docx"),
+    "export_labels_docx_zip": export("/api/labels/export-docx.zip"),
+}
+EXPORT_WORKLOADS = {name for name in WORKLOADS if name.startswith("export_")}
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def connect(mongo_url: Optional[str]):
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(mongo_url, tz_aware=True, tzinfo=server.ISTANBUL_TZ)
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("mongomock-motor is not installed; pip install mongomock-motor or pass --mongo-url")
+    patch_mongomock_bulk()
+    return AsyncMongoMockClient(tz_aware=True, tzinfo=server.ISTANBUL_TZ)
+
+def patch_mongomock_bulk():
+    # pymongo >= 4.11 passes ``sort`` to bulk update builders, which mongomock 4.x does not accept
+    import mongomock.collection
+
+    builder = mongomock.collection.BulkOperationBuilder
+    if getattr(builder.add_update, "_accepts_sort", False):
+        return
+    original = builder.add_update
+
+    def add_update(self, selector, doc, multi=False, upsert=False, collation=None, array_filters=None, hint=None, sort=None):
+        return original(self, selector, doc, multi, upsert, collation=collation, array_filters=array_filters, hint=hint)
+
+    add_update._accepts_sort = True
+    builder.add_update = add_update
+
+async def seed(db, size: int, history: int) -> List[Dict]:
+    compounds = synthetic_compounds(size)
+    usages, labels = synthetic_history(compounds, history)
+    for name, docs in (("compounds", compounds), ("usages", usages), ("labels", labels)):
+        for start in range(0, len(docs), 5000):
+            # insert_many adds _id to the dicts; keep the caller's copies clean
+            await db[name].insert_many([dict(d) for d in docs[start:start + 5000]])
+    return compounds
+
+async def seed_burst_users(db, count: int) -> List[str]:
+    hashed = await passwords.hash_password(BURST_PASSWORD)
+    usernames = [f"bench-user-{i}" for i in range(count)]
+    await db.users.insert_many([
+        {"id": name, "username": name, "email": f"{name}@bench", "role": "analyst", "password": hashed}
+        for name in usernames
+    ])
+    return usernames
+
+async def login_burst(client: httpx.AsyncClient, usernames: List[str], stop: asyncio.Event) -> Dict:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+
+    async def user_loop(username: str):
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = await client.post("/api/auth/login", json={"username": username, "password": BURST_PASSWORD})
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+            if response.status_code in (429, 503):
+                await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+    await asyncio.gather(*(user_loop(name) for name in usernames))
+    latencies.sort()
+    return {
+        "logins": statuses[200],
+        "rejected": statuses[429] + statuses[503],
+        "login_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+async def run_workload(client: httpx.AsyncClient, workload: Workload, compounds: List[Dict],
+                       requests: int, concurrency: int, seed: int) -> Dict:
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in pending:
+            started = time.perf_counter()
+            response = await workload(client, rng, compounds)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+async def bench_size(args, size: int) -> Dict:
+    mongo = connect(args.mongo_url)
+    await mongo.drop_database(BENCH_DB_NAME)
+    server.client = mongo
+    server.db = mongo[BENCH_DB_NAME]
+    await server.initialize_defaults()
+    compounds = await seed(server.db, size, args.history)
+    burst_users = await seed_burst_users(server.db, args.login_burst) if args.login_burst else []
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        login = await client.post("/api/auth/login", json={"username": "admin", "password": "admin123"})
+        login.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {login.json()['access_token']}"
+
+        results = {}
+        for name in args.workloads:
+            requests = args.export_requests if name in EXPORT_WORKLOADS else args.requests
+            results[name] = await run_workload(client, WORKLOADS[name], compounds, requests, args.concurrency, args.seed)
+            print(f"[{size}] {name}: {results[name]}", file=sys.stderr)
+            if burst_users:
+                stop = asyncio.Event()
+                burst = asyncio.create_task(login_burst(client, burst_users, stop))
+                stats = await run_workload(client, WORKLOADS[name], compounds, requests, args.concurrency, args.seed)
+                stop.set()
+                stats.update(await burst)
+                results[f"{name}+login_burst"] = stats
+                print(f"[{size}] {name}+login_burst: {stats}", file=sys.stderr)
+    await mongo.drop_database(BENCH_DB_NAME)
+    return results
+
+def compare(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    for size, workloads in current["results"].items():
+        for name, stats in workloads.items():
+            before = baseline.get("results", {}).get(size, {}).get(name)
+            if not before or not before["p95_ms"]:
+                continue
+            change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"]
+            if change > tolerance:
+                regressions.append(f"{size}/{name}: p95 {before['p95_ms']} -> {stats['p95_ms']} ms (+{change:.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="PestiLab in-process load test")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated catalogue sizes")
+    parser.add_argument("--history", type=int, default=2000, help="usages/labels seeded per size")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="comma-separated workload names")
+    parser.add_argument("--requests", type=int, default=200, help="requests per JSON workload")
+    parser.add_argument("--export-requests", type=int, default=5, help="requests per export workload")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--login-burst", type=int, default=0, help="concurrent login clients to run alongside each workload")
+    parser.add_argument("--mongo-url", default=os.getenv("BENCH_MONGO_URL"))
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON to compare p95 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 regression (0.2 = 20%%)")
+    args = parser.parse_args()
+    args.workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {sorted(unknown)}")
+
+    report = {
+        "backend": "mongodb" if args.mongo_url else "mongomock",
+        "concurrency": args.concurrency,
+        "history": args.history,
+        "results": {},
+    }
+    for size in (int(s) for s in args.sizes.split(",")):
+        report["results"][str(size)] = asyncio.run(bench_size(args, size))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output + "\n")
+    print(output)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            regressions = compare(json.load(fh), report, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
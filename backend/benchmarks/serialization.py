@@ -0,0 +1,85 @@
+"""Per-request CPU of the list endpoints: Pydantic re-validation vs lean pass-through.
+
+Runs entirely in-process with no database: both routes return the same
+pre-built documents, so the numbers isolate model construction, response_model
+validation and JSON rendering.
+
+    cd backend && python -m benchmarks.serialization --docs 10000 --requests 20
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+
+from fastapi import FastAPI
+
+from benchmarks.data import synthetic_compounds
+from server import Compound, FastJSONResponse
+
+def build_app(docs: List[dict]) -> FastAPI:
+    bench = FastAPI()
+
+    @bench.get("/pydantic", response_model=List[Compound])
+    async def pydantic_path():
+        return [Compound(**c) for c in docs]
+
+    @bench.get("/lean", response_model=List[Compound])
+    async def lean_path():
+        return FastJSONResponse(docs)
+
+    return bench
+
+async def asgi_get(app: FastAPI, path: str) -> bytes:
+    """Drive one GET through the ASGI app directly, without an HTTP client."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "headers": [], "client": ("bench", 0),
+        "server": ("bench", 80),
+    }
+    body: List[bytes] = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+async def measure(app: FastAPI, path: str, requests: int) -> dict:
+    await asgi_get(app, path)  # warm-up
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    size = 0
+    for _ in range(requests):
+        size = len(await asgi_get(app, path))
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    return {
+        "cpu_ms_per_request": round(cpu / requests * 1000, 2),
+        "wall_ms_per_request": round(wall / requests * 1000, 2),
+        "bytes": size,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    app = build_app(synthetic_compounds(args.docs))
+    results = {
+        "docs": args.docs,
+        "pydantic": asyncio.run(measure(app, "/pydantic", args.requests)),
+        "lean": asyncio.run(measure(app, "/lean", args.requests)),
+    }
+    results["cpu_speedup"] = round(
+        results["pydantic"]["cpu_ms_per_request"] / max(results["lean"]["cpu_ms_per_request"], 0.01), 2
+    )
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
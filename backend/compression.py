@@ -0,0 +1,224 @@
+"""Negotiated gzip/Brotli response compression.
+
+A plain ASGI middleware, so streamed responses stay streamed. Whether a
+response is compressed depends on its content type and size:
+
+    POLICY                       content type -> minimum body size in bytes (None: never)
+    COMPRESSION_MIN_SIZE         threshold for JSON and text (default 1024)
+    COMPRESSION_ENCODINGS        server preference order (default "br,gzip"); "" disables
+    COMPRESSION_GZIP_LEVEL       default 6
+    COMPRESSION_BROTLI_QUALITY   default 4 (quality 11 is far too slow for dynamic responses)
+
+XLSX, DOCX and ZIP exports are already deflate-compressed, and PDF, PNG and
+other binary types are not listed, so they pass through as they are. Server-sent
+events (``text/event-stream``) are never compressed, because every event must
+reach the client as soon as it is sent.
+
+A response that arrives in one piece (``more_body`` false) is compressed in one
+go. Bodies over THREAD_MIN_SIZE are compressed on a worker thread, so a 10k
+compound list does not hold up the event loop. A streamed response, such as a
+thermal print job, is compressed chunk by chunk with a sync flush after each
+chunk, so the client still gets data as it is produced. Brotli is used only if
+the ``brotli`` package is installed.
+
+A compressed response gets a weak ETag (``W/"..."``), since its bytes differ
+from the identity encoding. ``versions.matches`` accepts both forms.
+"""
+import asyncio
+import logging
+import os
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from metrics import Gauge
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+THREAD_MIN_SIZE = 256 * 1024
+
+POLICY: Dict[str, Optional[int]] = {
+    "application/json": COMPRESSION_MIN_SIZE,
+    "application/javascript": COMPRESSION_MIN_SIZE,
+    "application/xml": COMPRESSION_MIN_SIZE,
+    "image/svg+xml": COMPRESSION_MIN_SIZE,
+    "text/plain": COMPRESSION_MIN_SIZE,
+    "text/csv": COMPRESSION_MIN_SIZE,
+    "text/html": COMPRESSION_MIN_SIZE,
+    "text/xml": COMPRESSION_MIN_SIZE,
+    "text/event-stream": None,
+}
+
+BODY_BYTES = Gauge(
+    "pestilab_response_body_bytes_total", "Response body bytes before (raw) and after (sent) compression.",
+    ("encoding", "stage"), kind="counter",
+)
+COMPRESSION_SECONDS = Gauge(
+    "pestilab_compression_cpu_seconds_total", "CPU time spent compressing responses.", ("encoding",), kind="counter",
+)
+
+def available_encodings(requested: str) -> List[str]:
+    encodings = []
+    for name in (e.strip() for e in requested.split(",") if e.strip()):
+        if name == "br" and brotli is None:
+            logger.info("Brotli compression needs the 'brotli' package; using gzip only")
+            continue
+        if name not in ("br", "gzip"):
+            logger.warning(f"Unknown response encoding {name!r} ignored")
+            continue
+        encodings.append(name)
+    return encodings
+
+def negotiate(accept_encoding: str, encodings: List[str]) -> Optional[str]:
+    """The encoding to use: highest client q-value, server preference breaking ties."""
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            weights[name] = q
+    best, best_q = None, 0.0
+    for name in encodings:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+def minimum_size(content_type: Optional[str]) -> Optional[int]:
+    if not content_type:
+        return None
+    return POLICY.get(content_type.split(";")[0].strip().lower())
+
+class Compressor:
+    """One response's compression stream."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._gz = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def _timed(self, work) -> bytes:
+        start = time.thread_time()
+        out = work()
+        COMPRESSION_SECONDS.inc((self.encoding,), time.thread_time() - start)
+        return out
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress and flush, so everything so far can be decoded by the client."""
+        if self.encoding == "br":
+            return self._timed(lambda: self._br.process(data) + self._br.flush())
+        return self._timed(lambda: self._gz.compress(data) + self._gz.flush(zlib.Z_SYNC_FLUSH))
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._timed(lambda: self._br.process(data) + self._br.finish())
+        return self._timed(lambda: self._gz.compress(data) + self._gz.flush())
+
+class CompressionMiddleware:
+    def __init__(self, app, encodings: Optional[List[str]] = None):
+        self.app = app
+        self.encodings = available_encodings(os.getenv("COMPRESSION_ENCODINGS", "br,gzip")) if encodings is None else encodings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        await self.app(scope, receive, Responder(send, encoding).send)
+
+class Responder:
+    """Holds back ``http.response.start`` until the first body chunk shows how to send it.
+
+    The ``@app.middleware`` layers re-stream every body in chunks, so
+    ``more_body`` does not say whether a response is really streamed. The
+    Content-Length set by the inner response does: with one, the body is
+    buffered to its end and compressed in one go; without one (a
+    StreamingResponse), it is compressed chunk by chunk.
+    """
+
+    def __init__(self, send, encoding: Optional[str]):
+        self._send = send
+        self.encoding = encoding
+        self.start: Optional[dict] = None
+        self.mode: Optional[str] = None  # "pass", "buffer" or "stream" once the first body chunk arrives
+        self.compressor: Optional[Compressor] = None
+        self.buffered: List[bytes] = []
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if self.mode is None:
+            self.mode = self.choose_mode(message)
+            if self.mode != "buffer":
+                await self._send(self.start)
+        if message["type"] != "http.response.body" or self.mode == "pass":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.mode == "stream":
+            out = self.compressor.chunk(body) if more_body else self.compressor.finish(body)
+            self._count(len(body), len(out))
+            await self._send({"type": "http.response.body", "body": out, "more_body": more_body})
+            return
+
+        self.buffered.append(body)
+        if more_body:
+            return
+        body = b"".join(self.buffered)
+        if len(body) >= THREAD_MIN_SIZE:
+            compressed = await asyncio.to_thread(self.compressor.finish, body)
+        else:
+            compressed = self.compressor.finish(body)
+        self._count(len(body), len(compressed))
+        MutableHeaders(raw=self.start["headers"])["Content-Length"] = str(len(compressed))
+        await self._send(self.start)
+        await self._send({"type": "http.response.body", "body": compressed})
+
+    def choose_mode(self, message) -> str:
+        if message["type"] != "http.response.body":
+            return "pass"
+        headers = MutableHeaders(raw=self.start["headers"])
+        threshold = minimum_size(headers.get("content-type"))
+        if threshold is None or self.start["status"] in (204, 206, 304) or "content-encoding" in headers:
+            return "pass"
+        headers.add_vary_header("Accept-Encoding")
+        length = headers.get("content-length")
+        if self.encoding is None or (length is not None and int(length) < threshold):
+            return "pass"
+
+        self.compressor = Compressor(self.encoding)
+        headers["Content-Encoding"] = self.encoding
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        if length is None:
+            return "stream"
+        del headers["Content-Length"]  # set again once the compressed size is known
+        return "buffer"
+
+    def _count(self, raw: int, sent: int):
+        BODY_BYTES.inc((self.encoding, "raw"), raw)
+        BODY_BYTES.inc((self.encoding, "sent"), sent)
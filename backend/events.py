@@ -0,0 +1,132 @@
+"""Live change feed for stock levels, new usages and new labels.
+
+When the database supports change streams (replica sets, Atlas), one watcher
+task per API process turns inserts and stock updates into events. A
+standalone mongod has no change streams, so there the write endpoints publish
+their own events through ``publish_local``. Those only reach clients of the
+same process.
+
+Either way, events fan out to the SSE subscribers of this process through an
+in-process bus.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+WATCHED = ("compounds", "usages", "labels")
+STOCK_FIELDS = {"stock_value", "stock_unit", "critical_value", "critical_unit"}
+QUEUE_SIZE = 256  # per subscriber; the oldest events are dropped for clients that fall behind
+HEARTBEAT = 15.0  # seconds between SSE keep-alive comments
+
+class EventBus:
+    def __init__(self):
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event: Dict[str, Any]):
+        for queue in list(self._subscribers):
+            if queue.full():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(event)
+
+bus = EventBus()
+change_streams = False  # True while the watcher is delivering events
+_watcher: Optional[asyncio.Task] = None
+
+def compound_event(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "compound.stock",
+        "topic": "compounds",
+        "compound": {
+            "id": doc["id"],
+            "name": doc.get("name"),
+            "stock_value": doc.get("stock_value"),
+            "stock_unit": doc.get("stock_unit"),
+            "critical_value": doc.get("critical_value"),
+            "critical_unit": doc.get("critical_unit"),
+            "stock_mg": doc.get("stock_mg"),
+            "stock_ratio": doc.get("stock_ratio"),
+            "is_critical": doc.get("is_critical", False),
+        },
+    }
+
+def usage_event(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {"type": "usage.created", "topic": "usages", "usage": {k: v for k, v in doc.items() if k != "_id"}}
+
+def label_event(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {"type": "label.created", "topic": "labels", "label": {k: v for k, v in doc.items() if k not in ("_id", "assets")}}
+
+def change_to_event(change: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    collection = change["ns"]["coll"]
+    operation = change["operationType"]
+    doc = change.get("fullDocument")
+    if not doc:
+        return None
+    if collection == "compounds":
+        if operation == "update":
+            updated = set(change.get("updateDescription", {}).get("updatedFields", {}))
+            if not updated & STOCK_FIELDS:
+                return None
+        return compound_event(doc)
+    if operation != "insert":
+        return None
+    if collection == "usages":
+        return usage_event(doc)
+    if collection == "labels":
+        return label_event(doc)
+    return None
+
+def publish_local(*events: Dict[str, Any]):
+    """Publish from a write endpoint; skipped while change streams deliver the same writes."""
+    if change_streams:
+        return
+    for event in events:
+        bus.publish(event)
+
+async def watch(db):
+    global change_streams
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": list(WATCHED)},
+        "operationType": {"$in": ["insert", "update", "replace"]},
+    }}]
+    try:
+        async with db.watch(pipeline, full_document="updateLookup") as stream:
+            change_streams = True
+            logger.info("Live events: using MongoDB change streams")
+            async for change in stream:
+                event = change_to_event(change)
+                if event:
+                    bus.publish(event)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.info(f"Live events: change streams unavailable ({e}); publishing in-process")
+    finally:
+        change_streams = False
+
+def start(db):
+    global _watcher
+    if _watcher is None or _watcher.done():
+        _watcher = asyncio.create_task(watch(db))
+
+async def stop():
+    global _watcher
+    if _watcher is not None:
+        _watcher.cancel()
+        try:
+            await _watcher
+        except (asyncio.CancelledError, Exception):
+            pass
+        _watcher = None
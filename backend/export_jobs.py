@@ -0,0 +1,200 @@
+"""Background export jobs: a local process pool, progress in Mongo, files cached on disk.
+
+``enqueue`` records a job in ``export_jobs`` and starts it on the event loop.
+The job loads its documents in this process (the database stays here) and
+hands them to an exports.py builder in a worker process. Builders report
+progress through a shared dict that the job copies into its document, where
+``GET /exports/{id}`` and the SSE stream read it.
+
+Finished files are kept in EXPORT_CACHE_DIR for EXPORT_CACHE_TTL seconds under
+the job's cache key, a hash of the kind, parameters and a fingerprint of the
+matched data. Repeating a query returns the finished job (or the one still
+running) instead of building the file again.
+
+A job belongs to the user who queued it, and only that user can see it or
+download its file. When another user repeats the query, they get a job of
+their own. It is already done if the cached file is there.
+"""
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import orjson
+
+from exports import EXPORT_KINDS
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CACHE_DIR = Path(os.getenv("EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pestilab-exports")))
+EXPORT_CACHE_TTL = int(os.getenv("EXPORT_CACHE_TTL", "3600"))   # seconds
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+PROGRESS_INTERVAL = 0.5  # seconds between progress writes
+JOBS_COLLECTION = "export_jobs"
+
+_pool: Optional[ProcessPoolExecutor] = None
+_manager = None
+_progress = None
+_tasks = set()  # keep running job tasks referenced
+
+def pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs an event loop and driver threads is unsafe
+        _pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def progress_board():
+    global _manager, _progress
+    if _progress is None:
+        _manager = multiprocessing.get_context("spawn").Manager()
+        _progress = _manager.dict()
+    return _progress
+
+def shutdown():
+    global _pool, _manager, _progress
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = _progress = None
+
+def run_builder(kind: str, args: Tuple, job_id: str, board) -> bytes:
+    """Worker-process entry point."""
+    last = [0.0]
+
+    def report(done: int, total: int):
+        now = time.monotonic()
+        if done == total or now - last[0] >= PROGRESS_INTERVAL:
+            last[0] = now
+            board[job_id] = (done, total)
+
+    return EXPORT_KINDS[kind].build(*args, progress=report)
+
+def cache_key(kind: str, params: Dict[str, Any], fingerprint: Any) -> str:
+    payload = orjson.dumps({"kind": kind, "params": params, "data": fingerprint}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+def cache_path(job: Dict) -> Path:
+    return EXPORT_CACHE_DIR / f"{job['cache_key']}.{EXPORT_KINDS[job['kind']].extension}"
+
+def sweep_cache():
+    """Delete cached files older than the TTL."""
+    if not EXPORT_CACHE_DIR.is_dir():
+        return
+    cutoff = time.time() - EXPORT_CACHE_TTL
+    for path in EXPORT_CACHE_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
+
+def job_view(job: Dict) -> Dict[str, Any]:
+    view = {k: job.get(k) for k in (
+        "id", "kind", "params", "status", "stage", "done", "total", "progress",
+        "filename", "size", "error", "cached", "created_by", "created_at", "finished_at", "expires_at",
+    )}
+    if job.get("status") == "done":
+        view["download_url"] = f"/api/exports/{job['id']}/download"
+    return view
+
+async def ensure_indexes(db):
+    await db[JOBS_COLLECTION].create_index("id", unique=True)
+    await db[JOBS_COLLECTION].create_index([("cache_key", 1), ("created_at", -1)])
+    await db[JOBS_COLLECTION].create_index("expires_at", expireAfterSeconds=0)
+
+async def enqueue(db, kind: str, params: Dict[str, Any], fingerprint: Any, user: str, filename: str,
+                  load: Callable[[], Awaitable[Tuple]]) -> Dict:
+    """Start an export job, or return a finished or running job for the same query."""
+    now = datetime.now(timezone.utc)
+    key = cache_key(kind, params, fingerprint)
+    await asyncio.to_thread(sweep_cache)
+    existing = await db[JOBS_COLLECTION].find_one(
+        {"cache_key": key, "created_by": user, "status": {"$in": ["queued", "running", "done"]}, "expires_at": {"$gt": now}},
+        {"_id": 0}, sort=[("created_at", -1)]
+    )
+    if existing and (existing["status"] != "done" or cache_path(existing).exists()):
+        existing["cached"] = True
+        return existing
+    # another user's finished file for the same query: a done job of this user's own pointing at it
+    shared = await db[JOBS_COLLECTION].find_one(
+        {"cache_key": key, "status": "done", "expires_at": {"$gt": now}}, {"_id": 0}, sort=[("created_at", -1)]
+    )
+    if shared and not cache_path(shared).exists():
+        shared = None
+
+    job = {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "params": params,
+        "cache_key": key,
+        "status": "queued",
+        "stage": None,
+        "done": 0,
+        "total": None,
+        "progress": 0.0,
+        "filename": filename,
+        "media_type": EXPORT_KINDS[kind].media_type,
+        "size": None,
+        "error": None,
+        "cached": False,
+        "created_by": user,
+        "created_at": now,
+        "finished_at": None,
+        "expires_at": now + timedelta(seconds=EXPORT_CACHE_TTL),
+    }
+    if shared:
+        job.update(
+            status="done", progress=1.0, done=shared["done"], total=shared["total"], size=shared["size"],
+            cached=True, finished_at=now, expires_at=shared["expires_at"],
+        )
+        await db[JOBS_COLLECTION].insert_one(dict(job))
+        return job
+    await db[JOBS_COLLECTION].insert_one(dict(job))
+    task = asyncio.create_task(run_job(db, job, load))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job
+
+async def update_job(db, job_id: str, **fields):
+    await db[JOBS_COLLECTION].update_one({"id": job_id}, {"$set": fields})
+
+async def run_job(db, job: Dict, load: Callable[[], Awaitable[Tuple]]):
+    job_id = job["id"]
+    board = await asyncio.to_thread(progress_board)
+    try:
+        await update_job(db, job_id, status="running", stage="loading")
+        args = await load()
+        await update_job(db, job_id, stage="rendering")
+
+        future = asyncio.get_running_loop().run_in_executor(pool(), run_builder, job["kind"], args, job_id, board)
+        while not future.done():
+            await asyncio.wait({future}, timeout=PROGRESS_INTERVAL)
+            done, total = board.get(job_id, (0, None))
+            if total:
+                await update_job(db, job_id, done=done, total=total, progress=round(done / total, 3))
+        content = future.result()
+
+        path = cache_path(job)
+        await asyncio.to_thread(EXPORT_CACHE_DIR.mkdir, parents=True, exist_ok=True)
+        await asyncio.to_thread(path.write_bytes, content)
+        finished = datetime.now(timezone.utc)
+        await update_job(
+            db, job_id, status="done", stage=None, progress=1.0, size=len(content),
+            finished_at=finished, expires_at=finished + timedelta(seconds=EXPORT_CACHE_TTL)
+        )
+    except Exception as e:
+        logger.error(f"Export job {job_id} ({job['kind']}) failed: {e}")
+        await update_job(db, job_id, status="failed", stage=None, error=str(e), finished_at=datetime.now(timezone.utc))
+    finally:
+        board.pop(job_id, None)
@@ -0,0 +1,118 @@
+"""Export file builders.
+
+Plain documents in, file bytes out. The synchronous export endpoints call them
+inline and the export job queue (export_jobs.py) runs them in worker
+processes, so this module must not import server or touch the database.
+"""
+import zipfile
+from io import BytesIO
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from label_pdf import render_labels_pdf
+from label_profiles import get_sheet_profile
+
+# progress(done, total); called from inside the builder, possibly in a worker process
+Progress = Optional[Callable[[int, int], None]]
+
+WEIGHING_HEADERS = ["Date","Compound","CAS Number","Weighed (mg)","Purity (%)","Target (ppm)","Req. Volume (mL)","Actual (ppm)","Deviation (%)","Temperature (°C)","Density (g/mL)","Prepared By","Mix Code","Label Code"]
+
+def build_weighings_xlsx(rows: List[List[Any]], progress: Progress = None) -> bytes:
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment
+
+    wb = Workbook()
+    wb.remove(wb.active)
+    ws = wb.create_sheet("Weighing Records 1" if rows else "Weighing Records")
+    ws.append(WEIGHING_HEADERS)
+    for cell in ws[1]:
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal="center")
+    if not rows:
+        ws.append(["No weighing records found matching the criteria."])
+    for i, row in enumerate(rows, start=1):
+        ws.append(row)
+        if progress:
+            progress(i, len(rows))
+
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+def build_labels_pdf(labels: List[Dict], profile_id: Optional[str] = None, copies: int = 1,
+                     qr_matrices: Optional[Dict[str, List[List[bool]]]] = None, progress: Progress = None) -> bytes:
+    profile = get_sheet_profile(profile_id)
+    return render_labels_pdf(labels, profile, copies, qr_matrices=qr_matrices, progress=progress).getvalue()
+
+def add_label_paragraphs(doc, label: Dict, usage: Optional[Dict], detailed: bool):
+    doc.add_paragraph(f"Compound: {label['compound_name']}")
+    doc.add_paragraph(f"CAS Number: {label['cas_number']}")
+    doc.add_paragraph(f"Concentration: {label['concentration']}")
+    doc.add_paragraph(f"Label Code: {label['label_code']}")
+    if usage:
+        doc.add_paragraph(f"Weighed Amount: {usage.get('weighed_amount', 0):.3f} mg")
+        doc.add_paragraph(f"Purity: {usage.get('purity', 0):.1f}%")
+        if detailed:
+            doc.add_paragraph(f"Required Volume: {usage.get('required_volume', 0):.3f} mL")
+            doc.add_paragraph(f"Temperature: {usage.get('temperature_c', 0):.1f}°C")
+            doc.add_paragraph(f"Solvent Density: {usage.get('solvent_density', 0):.4f} g/mL")
+        if usage.get("mix_code"):
+            doc.add_paragraph(f"Mix Code: {usage['mix_code']}")
+    doc.add_paragraph(f"Prepared By: {label['prepared_by']}")
+    doc.add_paragraph(f"Date: {label['date']}")
+
+def build_labels_docx(labels: List[Dict], usages: Dict[str, Dict], progress: Progress = None) -> bytes:
+    """One document, one page per label; ``usages`` maps usage id to usage."""
+    from docx import Document as DocxDocument
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    doc = DocxDocument()
+    if not labels:
+        title = doc.add_heading("PestiLab – Weighing Labels", 0)
+        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        doc.add_paragraph("No labels found matching the criteria.")
+    for idx, label in enumerate(labels):
+        title = doc.add_heading("PestiLab – Weighing Label", 0)
+        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        add_label_paragraphs(doc, label, usages.get(label["usage_id"]), detailed=True)
+        if idx < len(labels) - 1:
+            doc.add_page_break()
+        if progress:
+            progress(idx + 1, len(labels))
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def build_labels_docx_zip(labels: List[Dict], usages: Dict[str, Dict], progress: Progress = None) -> bytes:
+    """A ZIP with one document per label."""
+    from docx import Document as DocxDocument
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        if not labels:
+            zip_file.writestr("no_labels_found.txt", "No labels found matching the criteria.")
+        for idx, label in enumerate(labels):
+            doc = DocxDocument()
+            title = doc.add_heading("PestiLab – Weighing Label", 0)
+            title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            add_label_paragraphs(doc, label, usages.get(label["usage_id"]), detailed=False)
+            doc_buffer = BytesIO()
+            doc.save(doc_buffer)
+            zip_file.writestr(f"Label_{label['label_code'].replace('/', '_')}.docx", doc_buffer.getvalue())
+            if progress:
+                progress(idx + 1, len(labels))
+    return buffer.getvalue()
+
+class ExportKind(NamedTuple):
+    build: Callable[..., bytes]
+    filename_prefix: str
+    extension: str
+    media_type: str
+
+EXPORT_KINDS: Dict[str, ExportKind] = {
+    "weighings_xlsx": ExportKind(build_weighings_xlsx, "WeighingRecords", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "labels_pdf": ExportKind(build_labels_pdf, "Labels", "pdf", "application/pdf"),
+    "labels_docx": ExportKind(build_labels_docx, "Labels", "docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "labels_docx_zip": ExportKind(build_labels_docx_zip, "Labels", "zip", "application/zip"),
+}
@@ -0,0 +1,197 @@
+"""Stock depletion forecasts and the reorder list.
+
+Each compound's consumption rate is an exponentially weighted mean of its
+daily consumption over the last FORECAST_WINDOW_DAYS. Days with no weighing
+count as zero, and a day FORECAST_HALF_LIFE_DAYS old weighs half as much as
+today. The daily figures come from the per-compound usage rollups (see
+analytics.py), so a full refresh is one pass over at most window x catalogue
+rollup documents and never reads ``usages``.
+
+From the rate and the current stock, the forecast gives the days (and dates)
+until stock reaches its critical level and until it runs out. The result is
+stored on the compound as ``forecast``:
+
+    refresh(db, tz, [id])  after a weighing or a stock change, for that compound only
+    refresh(db, tz)        the whole catalogue in one batch pass, every FORECAST_REFRESH_HOURS
+                           (rates decay as days go by without weighings)
+
+Only forecasts whose values changed are written. Within a day a full pass
+changes nothing, so it neither writes nor bumps the compounds version (and
+with it every compound ETag).
+
+The periodic pass runs in whichever worker claims it: each worker checks
+every FORECAST_CHECK_SECONDS, and the ``forecast_state`` document lets one
+claim per FORECAST_REFRESH_HOURS through. A cold start therefore does not
+refresh unless a pass is due. Set FORECAST_REFRESH_IN_APP=false (serverless
+deployments) and run ``manage.py forecast-stock`` from cron instead.
+
+The reorder list reads the stored forecasts through the ``forecast.critical_on`` index.
+"""
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import units
+import versions
+from analytics import ROLLUPS_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+FORECAST_WINDOW_DAYS = int(os.getenv("FORECAST_WINDOW_DAYS", "90"))
+FORECAST_HALF_LIFE_DAYS = float(os.getenv("FORECAST_HALF_LIFE_DAYS", "14"))
+FORECAST_REFRESH_HOURS = float(os.getenv("FORECAST_REFRESH_HOURS", "6"))
+REORDER_HORIZON_DAYS = int(os.getenv("REORDER_HORIZON_DAYS", "30"))
+FORECAST_REFRESH_IN_APP = os.getenv("FORECAST_REFRESH_IN_APP", "true").lower() in ("1", "true", "yes")
+FORECAST_CHECK_SECONDS = 600
+BATCH_SIZE = 1000
+STATE_COLLECTION = "forecast_state"
+
+COMPOUND_FIELDS = {
+    "_id": 0, "id": 1, "stock_value": 1, "stock_unit": 1, "critical_value": 1, "critical_unit": 1,
+    "created_at": 1, "forecast": 1,
+}
+
+_refresher: Optional[asyncio.Task] = None
+
+def decay(age_days: int) -> float:
+    return 0.5 ** (age_days / FORECAST_HALF_LIFE_DAYS)
+
+def weight_total(days: int) -> float:
+    """Sum of the weights of the most recent ``days`` days (ages 0..days-1)."""
+    r = decay(1)
+    return (1 - r ** days) / (1 - r)
+
+def forecast_for(compound: Dict[str, Any], weighted_mg: float, today: date, tz) -> Optional[Dict[str, Any]]:
+    """Forecast from the decay-weighted sum of a compound's daily consumption (mg)."""
+    try:
+        critical_base, dimension = units.to_base(compound.get("critical_value", 100.0), compound.get("critical_unit", "mg"))
+        unit_base, stock_dimension = units.to_base(1.0, compound.get("stock_unit", "mg"))
+    except units.UnitError:
+        return None
+    if dimension != stock_dimension:
+        return None
+    critical = critical_base / unit_base  # in the stock unit
+    stock = compound["stock_value"]
+
+    created = compound.get("created_at")
+    age = (today - created.astimezone(tz).date()).days + 1 if isinstance(created, datetime) else FORECAST_WINDOW_DAYS
+    days_observed = max(1, min(FORECAST_WINDOW_DAYS, age))
+    rate_mg = weighted_mg / weight_total(days_observed)
+    rate = units.weighed_in_stock_unit(rate_mg, compound.get("stock_unit", "mg"))
+
+    if rate > 0:
+        days_to_critical = round(max(stock - critical, 0.0) / rate, 1)
+        days_to_empty = round(max(stock, 0.0) / rate, 1)
+    else:
+        days_to_critical = 0.0 if stock <= critical else None
+        days_to_empty = 0.0 if stock <= 0 else None
+    return {
+        "rate_per_day": round(rate, 6),
+        "days_to_critical": days_to_critical,
+        "days_to_empty": days_to_empty,
+        "critical_on": (today + timedelta(days=int(days_to_critical))).isoformat() if days_to_critical is not None else None,
+        "empty_on": (today + timedelta(days=int(days_to_empty))).isoformat() if days_to_empty is not None else None,
+    }
+
+async def ensure_indexes(db):
+    await db.compounds.create_index("forecast.critical_on", sparse=True)
+
+def unchanged(stored: Optional[Dict[str, Any]], result: Dict[str, Any]) -> bool:
+    return stored is not None and all(stored.get(key) == value for key, value in result.items())
+
+async def refresh(db, tz, compound_ids: Optional[Iterable[str]] = None) -> int:
+    """Recompute forecasts for the given compounds, or the whole catalogue in one pass; returns how many changed."""
+    now = datetime.now(tz)
+    today = now.date()
+    start = (today - timedelta(days=FORECAST_WINDOW_DAYS - 1)).isoformat()
+    ids = list(compound_ids) if compound_ids is not None else None
+
+    rollup_query: Dict[str, Any] = {"dim": "compound", "day": {"$gte": start}}
+    compound_query: Dict[str, Any] = {}
+    if ids is not None:
+        rollup_query["key"] = {"$in": ids}
+        compound_query["id"] = {"$in": ids}
+
+    weighted: Dict[str, float] = {}
+    cursor = db[ROLLUPS_COLLECTION].find(rollup_query, {"_id": 0, "key": 1, "day": 1, "weighed_mg": 1})
+    async for row in cursor:
+        age = (today - date.fromisoformat(row["day"])).days
+        weighted[row["key"]] = weighted.get(row["key"], 0.0) + row["weighed_mg"] * decay(age)
+
+    updated = 0
+    ops: List[UpdateOne] = []
+    async for compound in db.compounds.find(compound_query, COMPOUND_FIELDS):
+        result = forecast_for(compound, weighted.get(compound["id"], 0.0), today, tz)
+        if result is None or unchanged(compound.get("forecast"), result):
+            continue
+        updated += 1
+        ops.append(UpdateOne({"id": compound["id"]}, {"$set": {"forecast": {**result, "computed_at": now}}}))
+        if len(ops) >= BATCH_SIZE:
+            await db.compounds.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.compounds.bulk_write(ops, ordered=False)
+    return updated
+
+async def reorder_list(db, tz, horizon_days: int = REORDER_HORIZON_DAYS, limit: int = 100) -> List[Dict[str, Any]]:
+    """Compounds that are critical now or are forecast to be within the horizon, soonest first."""
+    horizon = (datetime.now(tz).date() + timedelta(days=horizon_days)).isoformat()
+    query = {"$or": [{"forecast.critical_on": {"$lte": horizon}}, {"is_critical": True}]}
+    projection = {
+        "_id": 0, "id": 1, "name": 1, "cas_number": 1, "stock_value": 1, "stock_unit": 1,
+        "critical_value": 1, "critical_unit": 1, "is_critical": 1, "forecast": 1,
+    }
+    return await db.compounds.find(query, projection).sort([("forecast.critical_on", 1), ("name", 1)]).to_list(limit)
+
+async def claim(db, now: datetime) -> bool:
+    """Claim the next full pass if one is due; only one worker wins per FORECAST_REFRESH_HOURS."""
+    try:
+        await db[STATE_COLLECTION].find_one_and_update(
+            {"_id": "refresh", "due_at": {"$lte": now}},
+            {"$set": {"due_at": now + timedelta(hours=FORECAST_REFRESH_HOURS)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:  # the document exists and the pass is not due yet
+        return False
+    return True
+
+async def refresh_all(db, tz) -> int:
+    """The full pass; bumps the compounds version only if some forecast changed."""
+    count = await refresh(db, tz)
+    if count:
+        await versions.bump(db, "compounds")
+    return count
+
+async def _refresh_loop(db, tz):
+    while True:
+        try:
+            if await claim(db, datetime.now(tz)):
+                count = await refresh_all(db, tz)
+                logger.info(f"Stock forecasts refreshed: {count} changed")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Stock forecast refresh failed: {e}")
+        await asyncio.sleep(min(FORECAST_CHECK_SECONDS, FORECAST_REFRESH_HOURS * 3600))
+
+def start(db, tz):
+    global _refresher
+    if not FORECAST_REFRESH_IN_APP:
+        return
+    if _refresher is None or _refresher.done():
+        _refresher = asyncio.create_task(_refresh_loop(db, tz))
+
+async def stop():
+    global _refresher
+    if _refresher is not None:
+        _refresher.cancel()
+        try:
+            await _refresher
+        except (asyncio.CancelledError, Exception):
+            pass
+        _refresher = None
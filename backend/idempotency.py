@@ -0,0 +1,128 @@
+"""Idempotency keys for POSTs that must not run twice.
+
+A client that resends ``POST /weighing`` or ``POST /compounds/import`` after a
+dropped connection sends the same ``Idempotency-Key`` header. The first
+request with a key claims it with an ``in_progress`` record in
+``idempotency_keys``. When it finishes, the record holds its response (status,
+media type and body), and any retry gets that response replayed with
+``Idempotent-Replayed: true`` instead of weighing or importing again.
+
+A duplicate that arrives while the first request is still running waits for
+its result. Within one process it awaits the same future. From another
+worker it polls the record every POLL_INTERVAL seconds, for up to
+IDEMPOTENCY_WAIT_SECONDS, and then gets 409.
+
+Keys are scoped to the user and the endpoint. Reusing a key with a different
+request body is a client bug and gets 422. If the first request fails with an
+exception (including HTTPException), its claim is released so the retry runs
+normally. Records expire after IDEMPOTENCY_TTL_HOURS through a TTL index.
+"""
+import asyncio
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from pymongo.errors import DuplicateKeyError
+
+KEYS_COLLECTION = "idempotency_keys"
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+POLL_INTERVAL = 0.1  # seconds
+MAX_KEY_LENGTH = 255
+
+_inflight: Dict[str, Tuple[str, asyncio.Future]] = {}  # record id -> (fingerprint, the running request's response)
+
+async def ensure_indexes(db):
+    await db[KEYS_COLLECTION].create_index("expires_at", expireAfterSeconds=0)
+
+def fingerprint(*parts: Any) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else orjson.dumps(part, option=orjson.OPT_SORT_KEYS))
+    return digest.hexdigest()
+
+def to_response(result: Any) -> Response:
+    if isinstance(result, Response):
+        return result
+    return Response(orjson.dumps(jsonable_encoder(result)), media_type="application/json")
+
+def replay(body: bytes, status_code: int, media_type: Optional[str]) -> Response:
+    return Response(body, status_code=status_code, media_type=media_type, headers={"Idempotent-Replayed": "true"})
+
+def replay_record(record: Dict[str, Any]) -> Response:
+    return replay(record["body"], record["status_code"], record["media_type"])
+
+def mismatch() -> HTTPException:
+    return HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+
+def failed() -> HTTPException:
+    return HTTPException(status_code=409, detail="The original request with this Idempotency-Key failed; retry it")
+
+async def wait_for(db, record_id: str) -> Response:
+    """Wait for another worker's request with the same key to finish."""
+    deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_SECONDS
+    while asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        record = await db[KEYS_COLLECTION].find_one({"_id": record_id})
+        if record is None:
+            raise failed()
+        if record["status"] == "done":
+            return replay_record(record)
+    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+async def run(db, key: Optional[str], user: str, endpoint: str, request_fingerprint: str,
+              handler: Callable[[], Awaitable[Any]]) -> Any:
+    """Run ``handler`` once per (user, endpoint, key); without a key just run it."""
+    if key is None:
+        return await handler()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+    record_id = f"{user}:{endpoint}:{key}"
+
+    if record_id in _inflight:
+        running_fingerprint, running = _inflight[record_id]
+        if running_fingerprint != request_fingerprint:
+            raise mismatch()
+        # shield: a duplicate that disconnects must not cancel the original's future
+        response = await asyncio.shield(running)
+        if response is None:
+            raise failed()
+        return replay(response.body, response.status_code, response.media_type)
+
+    now = datetime.now(timezone.utc)
+    try:
+        await db[KEYS_COLLECTION].insert_one({
+            "_id": record_id, "user": user, "endpoint": endpoint, "fingerprint": request_fingerprint,
+            "status": "in_progress", "created_at": now, "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+        })
+    except DuplicateKeyError:
+        record = await db[KEYS_COLLECTION].find_one({"_id": record_id})
+        if record is None:  # expired or released in between
+            return await run(db, key, user, endpoint, request_fingerprint, handler)
+        if record["fingerprint"] != request_fingerprint:
+            raise mismatch()
+        if record["status"] == "done":
+            return replay_record(record)
+        return await wait_for(db, record_id)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[record_id] = (request_fingerprint, future)
+    try:
+        response = to_response(await handler())
+    except BaseException:
+        await db[KEYS_COLLECTION].delete_one({"_id": record_id})
+        future.set_result(None)
+        raise
+    finally:
+        _inflight.pop(record_id, None)
+    await db[KEYS_COLLECTION].update_one({"_id": record_id}, {"$set": {
+        "status": "done", "status_code": response.status_code,
+        "media_type": response.media_type, "body": response.body,
+    }})
+    future.set_result(response)
+    return response
@@ -0,0 +1,94 @@
+"""Pre-rendered label artifacts in a content-addressed collection.
+
+Each blob (QR PNG, barcode PNG, packed QR module matrix) is stored once in
+``label_assets`` under the SHA-256 of its bytes, and a label references its
+blobs by digest in ``labels.assets``. Blobs are ~1 KB, so a plain collection
+keeps batch reads to one ``$in`` query, unlike GridFS's two documents per file.
+"""
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+import versions
+from label_pdf import barcode_png, qr_code, qr_png
+
+ASSETS_COLLECTION = "label_assets"
+CONTENT_TYPES = {
+    "qr_png": "image/png",
+    "barcode_png": "image/png",
+    "qr_matrix": "application/octet-stream",
+}
+
+def pack_matrix(matrix: List[List[bool]]) -> bytes:
+    """Side length (2 bytes) followed by the modules as bits, row by row."""
+    bits = "".join("1" if cell else "0" for row in matrix for cell in row)
+    packed = int(bits, 2).to_bytes((len(bits) + 7) // 8, "big") if bits else b""
+    return len(matrix).to_bytes(2, "big") + packed
+
+def unpack_matrix(blob: bytes) -> List[List[bool]]:
+    size = int.from_bytes(blob[:2], "big")
+    bits = bin(int.from_bytes(blob[2:], "big"))[2:].zfill(len(blob[2:]) * 8)[-size * size:] if size else ""
+    return [[bit == "1" for bit in bits[row * size:(row + 1) * size]] for row in range(size)]
+
+def render_label_assets(qr_data: str, label_code: str) -> Dict[str, bytes]:
+    qr = qr_code(qr_data)
+    return {
+        "qr_png": qr_png(qr_data, qr),
+        "barcode_png": barcode_png(label_code),
+        "qr_matrix": pack_matrix(qr.get_matrix()),
+    }
+
+def digest(blob: bytes) -> str:
+    return hashlib.sha256(blob).hexdigest()
+
+def asset_refs(assets: Dict[str, bytes]) -> Dict[str, str]:
+    return {kind: digest(blob) for kind, blob in assets.items()}
+
+async def store_blobs(db, assets: Dict[str, bytes]):
+    for kind, blob in assets.items():
+        await db[ASSETS_COLLECTION].update_one(
+            {"_id": digest(blob)},
+            {"$setOnInsert": {"kind": kind, "content_type": CONTENT_TYPES[kind], "data": blob}},
+            upsert=True,
+        )
+
+async def load_blobs(db, digests: Iterable[str]) -> Dict[str, bytes]:
+    wanted = list(set(digests))
+    if not wanted:
+        return {}
+    cursor = db[ASSETS_COLLECTION].find({"_id": {"$in": wanted}}, {"data": 1})
+    return {doc["_id"]: bytes(doc["data"]) async for doc in cursor}
+
+async def get_blob(db, asset_digest: str) -> Optional[Dict]:
+    return await db[ASSETS_COLLECTION].find_one({"_id": asset_digest})
+
+async def delete_unreferenced(db, digests: Iterable[str]) -> int:
+    """Delete the blobs no label (or archived label) refers to any more."""
+    wanted = list(set(digests))
+    if not wanted:
+        return 0
+    referenced = {"$or": [{f"assets.{kind}": {"$in": wanted}} for kind in CONTENT_TYPES]}
+    kept = set()
+    for collection in ("labels", "labels_archive"):
+        async for label in db[collection].find(referenced, {"_id": 0, "assets": 1}):
+            kept.update(label["assets"].values())
+    result = await db[ASSETS_COLLECTION].delete_many({"_id": {"$in": [d for d in wanted if d not in kept]}})
+    return result.deleted_count
+
+async def label_assets(db, label: Dict) -> Dict[str, bytes]:
+    """Stored assets of a label, rendering and storing them if any are missing."""
+    refs = label.get("assets") or {}
+    blobs = await load_blobs(db, refs.values())
+    assets = {kind: blobs[ref] for kind, ref in refs.items() if ref in blobs}
+    if all(kind in assets for kind in CONTENT_TYPES):
+        return assets
+    assets = render_label_assets(label["qr_data"], label["label_code"])
+    await store_blobs(db, assets)
+    await db.labels.update_one({"id": label["id"]}, {"$set": {"assets": asset_refs(assets)}})
+    await versions.bump(db, "labels")  # GET /labels returns assets, so cached lists are stale now
+    return assets
+
+async def qr_matrices(db, labels: List[Dict]) -> Dict[str, List[List[bool]]]:
+    """qr_data -> stored module matrix for the labels that have one."""
+    refs = {label["qr_data"]: label["assets"]["qr_matrix"] for label in labels if (label.get("assets") or {}).get("qr_matrix")}
+    blobs = await load_blobs(db, refs.values())
+    return {qr_data: unpack_matrix(blobs[ref]) for qr_data, ref in refs.items() if ref in blobs}
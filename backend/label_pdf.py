@@ -0,0 +1,212 @@
+"""PDF label sheets: grid imposition of labels onto pages of a sheet profile.
+
+Each cell follows the layout of frontend/src/labels/LabelCard.jsx (three text
+lines, QR and barcode row, code line). The QR code and barcode of a label are
+rendered once per job and stored as PDF form XObjects, so copies and repeated
+codes only add a reference to the page instead of another embedded image.
+Symbols are drawn as vector paths by default; the PNG path is kept for the
+JSON label previews and for comparison in benchmarks/label_pdf.py.
+"""
+from io import BytesIO
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from label_profiles import SheetProfile
+from metrics import phase
+from thermal import label_lines
+
+PT_PER_MM = 72 / 25.4
+PADDING = 1.5     # mm inside each cell
+ROW_GAP = 1.0     # mm between the text block, the QR/barcode row and the code line
+
+def qr_code(data: str):
+    import qrcode
+    qr = qrcode.QRCode(version=1, box_size=10, border=1)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+def qr_png(data: str, qr=None) -> bytes:
+    img = (qr or qr_code(data)).make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def barcode_png(code: str) -> bytes:
+    import barcode
+    from barcode.writer import ImageWriter
+    buffer = BytesIO()
+    code128 = barcode.get("code128", code, writer=ImageWriter())
+    code128.write(buffer, {"write_text": False, "module_height": 8, "module_width": 0.2})
+    return buffer.getvalue()
+
+# ==== SYMBOL DRAWING ====
+# each draws one symbol filling (0, 0)-(width, height) of the current form
+def draw_qr_raster(canvas, data: str, width: float, height: float):
+    from reportlab.lib.utils import ImageReader
+    canvas.drawImage(ImageReader(BytesIO(qr_png(data))), 0, 0, width=width, height=height)
+
+def draw_barcode_raster(canvas, code: str, width: float, height: float):
+    from reportlab.lib.utils import ImageReader
+    canvas.drawImage(ImageReader(BytesIO(barcode_png(code))), 0, 0, width=width, height=height)
+
+def draw_qr_vector(canvas, data: str, width: float, height: float):
+    draw_qr_matrix(canvas, qr_code(data).get_matrix(), width, height)
+
+def draw_qr_matrix(canvas, matrix: List[List[bool]], width: float, height: float):
+    module_w, module_h = width / len(matrix), height / len(matrix)
+    path = canvas.beginPath()
+    for row, cells in enumerate(matrix):
+        y = height - (row + 1) * module_h
+        col = 0
+        while col < len(cells):
+            if not cells[col]:
+                col += 1
+                continue
+            # one rectangle per horizontal run of dark modules
+            start = col
+            while col < len(cells) and cells[col]:
+                col += 1
+            path.rect(start * module_w, y, (col - start) * module_w, module_h)
+    canvas.drawPath(path, stroke=0, fill=1)
+
+def draw_barcode_vector(canvas, code: str, width: float, height: float):
+    from reportlab.graphics.barcode.code128 import Code128
+    probe = Code128(code, barWidth=1, barHeight=height, quiet=0)
+    Code128(code, barWidth=width / probe.width, barHeight=height, quiet=0).drawOn(canvas, 0, 0)
+
+class CellLayout(NamedTuple):
+    """Positions in points, relative to the bottom-left corner of a cell."""
+    left: float
+    width: float
+    name_y: float
+    name_size: float
+    line2_y: float
+    line3_y: float
+    line_size: float
+    row_y: float
+    qr_size: float
+    barcode_x: float
+    barcode_width: float
+    barcode_height: float
+    code_y: float
+    code_size: float
+
+def compute_cell_layout(profile: SheetProfile) -> CellLayout:
+    w, h = profile.label_width * PT_PER_MM, profile.label_height * PT_PER_MM
+    pad, gap = PADDING * PT_PER_MM, ROW_GAP * PT_PER_MM
+    # font sizes in points, tuned for the 38.1 mm sheet label and scaled with the cell height
+    scale = min(1.4, max(0.75, profile.label_height / 38.1))
+    name_size, line_size, code_size = 9 * scale, 7 * scale, 7 * scale
+
+    name_y = h - pad - name_size * 0.8
+    line2_y = name_y - line_size * 1.25
+    line3_y = line2_y - line_size * 1.25
+    code_y = pad + code_size * 0.2
+    row_top = line3_y - line_size * 0.3 - gap
+    row_bottom = code_y + code_size * 0.8 + gap
+    row_h = max(1.0, row_top - row_bottom)
+
+    qr_size = min(profile.qr_size * PT_PER_MM, row_h, (w - 2 * pad) / 2)
+    barcode_x = pad + qr_size + 2 * PT_PER_MM
+    barcode_height = min(profile.barcode_height * PT_PER_MM, row_h)
+    return CellLayout(
+        left=pad, width=w - 2 * pad, name_y=name_y, name_size=name_size, line2_y=line2_y, line3_y=line3_y,
+        line_size=line_size, row_y=row_top - qr_size, qr_size=qr_size, barcode_x=barcode_x,
+        barcode_width=max(1.0, w - pad - barcode_x), barcode_height=barcode_height, code_y=code_y, code_size=code_size,
+    )
+
+def fit_text(text: str, font: str, size: float, max_width: float) -> str:
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    if stringWidth(text, font, size) <= max_width:
+        return text
+    while text and stringWidth(text + "…", font, size) > max_width:
+        text = text[:-1]
+    return text + "…"
+
+class FormCache:
+    """One form XObject per distinct image for the whole document."""
+
+    def __init__(self, canvas, prefix: str, draw, width: float, height: float):
+        self.canvas = canvas
+        self.prefix = prefix
+        self.draw = draw
+        self.width = width
+        self.height = height
+        self.names: Dict[str, str] = {}
+
+    def get(self, key: str) -> str:
+        name = self.names.get(key)
+        if name is None:
+            name = self.names[key] = f"{self.prefix}{len(self.names)}"
+            self.canvas.beginForm(name, 0, 0, self.width, self.height)
+            self.draw(self.canvas, key, self.width, self.height)
+            self.canvas.endForm()
+        return name
+
+def place_form(canvas, name: str, x: float, y: float):
+    canvas.saveState()
+    canvas.translate(x, y)
+    canvas.doForm(name)
+    canvas.restoreState()
+
+def impose(labels: Iterable[Dict], profile: SheetProfile, copies: int = 1) -> Iterable[tuple]:
+    """Yield (page_index, cell_x, cell_y, label) in points, filling each page row by row."""
+    origins = [(x * PT_PER_MM, y * PT_PER_MM) for x, y in profile.cell_origins()]
+    slot = 0
+    for label in labels:
+        for _ in range(copies):
+            page, cell = divmod(slot, len(origins))
+            yield page, origins[cell][0], origins[cell][1], label
+            slot += 1
+
+def render_labels_pdf(labels: List[Dict], profile: SheetProfile, copies: int = 1, vector: bool = True,
+                      qr_matrices: Optional[Dict[str, List[List[bool]]]] = None, progress=None) -> BytesIO:
+    """Lay out a PDF label job; ``qr_matrices`` maps qr_data to stored QR modules, skipping encoding."""
+    from reportlab.pdfgen import canvas as pdf_canvas
+
+    buffer = BytesIO()
+    if not labels:
+        from reportlab.lib.pagesizes import A4
+        c = pdf_canvas.Canvas(buffer, pagesize=A4)
+        c.setFont("Helvetica", 12)
+        c.drawString(100, 750, "No labels found matching the criteria.")
+        c.save()
+        buffer.seek(0)
+        return buffer
+
+    c = pdf_canvas.Canvas(buffer, pagesize=(profile.page_width * PT_PER_MM, profile.page_height * PT_PER_MM))
+    lay = compute_cell_layout(profile)
+    draw_qr, draw_barcode = (draw_qr_vector, draw_barcode_vector) if vector else (draw_qr_raster, draw_barcode_raster)
+    if vector and qr_matrices:
+        def draw_qr(canvas, data, width, height):
+            matrix = qr_matrices.get(data)
+            if matrix is None:
+                matrix = qr_code(data).get_matrix()
+            draw_qr_matrix(canvas, matrix, width, height)
+    qr_forms = FormCache(c, "qr", draw_qr, lay.qr_size, lay.qr_size)
+    barcode_forms = FormCache(c, "bc", draw_barcode, lay.barcode_width, lay.barcode_height)
+    current_page = 0
+    total = len(labels) * copies
+    for slot, (page, x, y, label) in enumerate(impose(labels, profile, copies), start=1):
+        if page != current_page:
+            c.showPage()
+            current_page = page
+        with phase("render"):
+            qr = qr_forms.get(label.get("qr_data", ""))
+            bc = barcode_forms.get(label.get("label_code", ""))
+
+        lines = label_lines(label)
+        c.setFont("Helvetica-Bold", lay.name_size)
+        c.drawString(x + lay.left, y + lay.name_y, fit_text(lines["name"], "Helvetica-Bold", lay.name_size, lay.width))
+        c.setFont("Helvetica", lay.line_size)
+        c.drawString(x + lay.left, y + lay.line2_y, fit_text(lines["line2"], "Helvetica", lay.line_size, lay.width))
+        c.drawString(x + lay.left, y + lay.line3_y, fit_text(lines["line3"], "Helvetica", lay.line_size, lay.width))
+        place_form(c, qr, x + lay.left, y + lay.row_y)
+        place_form(c, bc, x + lay.barcode_x, y + lay.row_y + (lay.qr_size - lay.barcode_height) / 2)
+        c.setFont("Helvetica-Bold", lay.code_size)
+        c.drawString(x + lay.left, y + lay.code_y, fit_text(lines["code"], "Helvetica-Bold", lay.code_size, lay.width))
+        if progress:
+            progress(slot, total)
+    c.save()
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,113 @@
+"""Server-side label geometry, mirroring frontend/src/labels/labelProfiles.js."""
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+class Margin(BaseModel):
+    top: float = 0.0
+    right: float = 0.0
+    bottom: float = 0.0
+    left: float = 0.0
+
+class LabelProfile(BaseModel):
+    id: str
+    display_name: str
+    width: float                 # mm
+    height: float                # mm
+    margin: Margin = Margin()
+    density: int = 203           # dpi
+    scale: float = 1.0           # fine calibration (1.02 = +2%)
+    qr_size: float = 24.0        # mm, upper bound; shrunk to fit the label
+    barcode_height: float = 12.0 # mm, upper bound
+    language: str = "zpl"        # native printer language for thermal profiles
+    gap: float = 2.0             # mm between labels on the roll (TSPL GAP)
+
+    def dots(self, mm: float) -> int:
+        return round(mm / 25.4 * self.density * self.scale)
+
+def _thermal(id: str, display_name: str, width: float, height: float, margin: float, density: int,
+             language: str, **overrides) -> LabelProfile:
+    return LabelProfile(
+        id=id, display_name=display_name, width=width, height=height,
+        margin=Margin(top=margin, right=margin, bottom=margin, left=margin),
+        density=density, language=language, **overrides
+    )
+
+THERMAL_PROFILES: Dict[str, LabelProfile] = {p.id: p for p in [
+    _thermal("Zebra_40x20_203", "Zebra 40×20 mm (203dpi)", 40, 20, 1, 203, "zpl"),
+    _thermal("Zebra_50x25_203", "Zebra 50×25 mm (203dpi)", 50, 25, 1, 203, "zpl"),
+    _thermal("Zebra_58x40_300", "Zebra 58×40 mm (300dpi)", 58, 40, 1.5, 300, "zpl", qr_size=26, barcode_height=14),
+    _thermal("TSC_40x30_203", "TSC 40×30 mm (203dpi)", 40, 30, 1, 203, "tspl"),
+    # GoDEX printers accept ZPL through their built-in emulation
+    _thermal("Godex_60x40_203", "Godex 60×40 mm (203dpi)", 60, 40, 2, 203, "zpl", qr_size=28, barcode_height=16),
+    _thermal("Generic_70x50_300", "Generic 70×50 mm (300dpi)", 70, 50, 2, 300, "zpl", qr_size=30, barcode_height=18),
+    _thermal("Zebra_50x25_203_cal102", "Zebra 50×25 mm (203dpi, +2% scale)", 50, 25, 1, 203, "zpl", scale=1.02),
+]}
+
+DEFAULT_THERMAL_PROFILE_ID = "Zebra_50x25_203"
+
+def get_thermal_profile(profile_id: Optional[str]) -> Optional[LabelProfile]:
+    return THERMAL_PROFILES.get(profile_id or DEFAULT_THERMAL_PROFILE_ID)
+
+class SheetGrid(BaseModel):
+    rows: int
+    cols: int
+    gutter_x: float = 0.0        # mm
+    gutter_y: float = 0.0        # mm
+
+class SheetProfile(BaseModel):
+    id: str
+    display_name: str
+    page_width: float = 210.0    # mm
+    page_height: float = 297.0   # mm
+    grid: SheetGrid
+    label_width: float           # mm
+    label_height: float          # mm
+    margin_left: Optional[float] = None  # mm; None centres the grid on the page
+    margin_top: Optional[float] = None
+    qr_size: float = 24.0
+    barcode_height: float = 12.0
+
+    @property
+    def per_page(self) -> int:
+        return self.grid.rows * self.grid.cols
+
+    def cell_origins(self) -> List[Tuple[float, float]]:
+        """Bottom-left corner (mm, PDF coordinates) of every cell, row by row from the top left."""
+        g = self.grid
+        grid_w = g.cols * self.label_width + (g.cols - 1) * g.gutter_x
+        grid_h = g.rows * self.label_height + (g.rows - 1) * g.gutter_y
+        left = self.margin_left if self.margin_left is not None else (self.page_width - grid_w) / 2
+        top = self.margin_top if self.margin_top is not None else (self.page_height - grid_h) / 2
+        origins = []
+        for row in range(g.rows):
+            y = self.page_height - top - (row + 1) * self.label_height - row * g.gutter_y
+            for col in range(g.cols):
+                origins.append((left + col * (self.label_width + g.gutter_x), y))
+        return origins
+
+# The ids match labelProfiles.js; the row counts are those of the physical sheets
+# (L7160 / L7165 layouts) since 8 x 38.1 mm and 7 x 67.7 mm do not fit on A4.
+SHEET_PROFILES: Dict[str, SheetProfile] = {p.id: p for p in [
+    SheetProfile(
+        id="A4_3x8_63.5x38.1", display_name="A4 3×7 (63.5×38.1 mm)",
+        grid=SheetGrid(rows=7, cols=3, gutter_x=2.5), label_width=63.5, label_height=38.1,
+        margin_left=7.2, margin_top=15.15, qr_size=22, barcode_height=14
+    ),
+    SheetProfile(
+        id="A4_2x7_99.1x67.7", display_name="A4 2×4 (99.1×67.7 mm)",
+        grid=SheetGrid(rows=4, cols=2, gutter_x=2.5), label_width=99.1, label_height=67.7,
+        margin_left=4.65, margin_top=13.1, qr_size=26, barcode_height=16
+    ),
+    # one label per page, the historical /labels/export.pdf format
+    SheetProfile(
+        id="Single_70x25", display_name="Single label 70×25 mm",
+        page_width=70, page_height=25, grid=SheetGrid(rows=1, cols=1), label_width=70, label_height=25,
+        qr_size=12, barcode_height=8
+    ),
+]}
+
+DEFAULT_SHEET_PROFILE_ID = "Single_70x25"
+
+def get_sheet_profile(profile_id: Optional[str]) -> Optional[SheetProfile]:
+    return SHEET_PROFILES.get(profile_id or DEFAULT_SHEET_PROFILE_ID)
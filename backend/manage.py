@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""One-off maintenance commands for the PestiLab database.
+
+Usage:
+    python manage.py migrate-datetimes [--dry-run]
+    python manage.py backfill-label-assets [--dry-run]
+    python manage.py rebuild-stock-ledger [--dry-run] [--compound-id ID]
+    python manage.py rebuild-analytics [--dry-run]
+    python manage.py normalize-stock-units [--dry-run]
+    python manage.py forecast-stock
+    python manage.py backfill-sync [--dry-run]
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+import analytics
+import forecast
+import label_assets
+import server
+import stock_ledger
+import sync
+import units
+import versions
+from server import ISTANBUL_TZ, logger
+
+BATCH_SIZE = 1000
+
+# collection -> fields that used to be written as datetime.now(ISTANBUL_TZ).isoformat()
+DATETIME_FIELDS: Dict[str, List[str]] = {
+    "users": ["created_at"],
+    "compounds": ["created_at", "updated_at"],
+    "solvent_densities": ["created_at"],
+    "usages": ["created_at"],
+    "labels": ["created_at"],
+    "audit_logs": ["timestamp"],
+}
+
+async def write_updates(db, collection_name: str, updates: List[Tuple[Dict[str, Any], Dict[str, Any]]]):
+    """``$set`` each (selector, fields) in one bulk write; documents of synced collections
+    also get a sync stamp, so weighing stations pick the change up."""
+    if collection_name in sync.COLLECTIONS:
+        stamps = await sync.stamp_many(db, len(updates), datetime.now(ISTANBUL_TZ))
+        updates = [(selector, {**fields, **stamp}) for (selector, fields), stamp in zip(updates, stamps)]
+    await db[collection_name].bulk_write([UpdateOne(selector, {"$set": fields}) for selector, fields in updates], ordered=False)
+
+def parse_iso(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=ISTANBUL_TZ)
+    return parsed
+
+async def migrate_datetimes(db, dry_run: bool = False) -> Dict[str, Any]:
+    """Convert legacy ISO-string timestamps into native BSON dates."""
+    report: Dict[str, Any] = {}
+    for collection_name, fields in DATETIME_FIELDS.items():
+        collection = db[collection_name]
+        for field in fields:
+            converted = failed = 0
+            updates: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+            cursor = collection.find({field: {"$type": "string"}}, {"_id": 1, field: 1})
+            async for doc in cursor:
+                try:
+                    value = parse_iso(doc[field])
+                except ValueError:
+                    failed += 1
+                    continue
+                converted += 1
+                updates.append(({"_id": doc["_id"]}, {field: value}))
+                if len(updates) >= BATCH_SIZE:
+                    if not dry_run:
+                        await write_updates(db, collection_name, updates)
+                    updates = []
+            if updates and not dry_run:
+                await write_updates(db, collection_name, updates)
+            report[f"{collection_name}.{field}"] = {"converted": converted, "failed": failed}
+            logger.info(f"{collection_name}.{field}: converted={converted} failed={failed}")
+    if not dry_run:
+        await versions.bump(db, *DATETIME_FIELDS)
+        await server.ensure_indexes()
+    return report
+
+async def backfill_label_assets(db, dry_run: bool = False) -> Dict[str, int]:
+    """Render and store QR/barcode assets for labels created before they were persisted."""
+    rendered = 0
+    updates: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    cursor = db.labels.find({"assets": None}, {"_id": 1, "qr_data": 1, "label_code": 1})
+    async for label in cursor:
+        rendered += 1
+        if dry_run:
+            continue
+        assets = label_assets.render_label_assets(label["qr_data"], label["label_code"])
+        await label_assets.store_blobs(db, assets)
+        updates.append(({"_id": label["_id"]}, {"assets": label_assets.asset_refs(assets)}))
+        if len(updates) >= BATCH_SIZE:
+            await write_updates(db, "labels", updates)
+            updates = []
+    if updates:
+        await write_updates(db, "labels", updates)
+    if rendered and not dry_run:
+        await versions.bump(db, "labels")
+    logger.info(f"labels.assets: rendered={rendered}")
+    return {"rendered": rendered}
+
+async def rebuild_stock_ledger(db, dry_run: bool = False, compound_id: Optional[str] = None) -> Dict[str, int]:
+    """Rebuild stock movements and snapshots from existing usages."""
+    query = {"id": compound_id} if compound_id else {}
+    compounds = movements = 0
+    cursor = db.compounds.find(query, {"_id": 0, "id": 1, "stock_value": 1, "stock_unit": 1, "created_at": 1, "updated_at": 1})
+    async for compound in cursor:
+        compounds += 1
+        movements += await stock_ledger.rebuild(db, compound, dry_run=dry_run)
+    logger.info(f"stock ledger: compounds={compounds} movements={movements}")
+    return {"compounds": compounds, "movements": movements}
+
+async def normalize_stock_units(db, dry_run: bool = False) -> Dict[str, Any]:
+    """Fill stock_mg/critical_mg/stock_ratio/is_critical on every compound."""
+    updated = critical = 0
+    invalid: List[str] = []
+    updates: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    projection = {"_id": 1, "id": 1, "name": 1, "stock_value": 1, "stock_unit": 1, "critical_value": 1, "critical_unit": 1}
+    async for compound in db.compounds.find({}, projection):
+        try:
+            fields = units.compound_stock_fields(compound)
+        except units.UnitError as e:
+            invalid.append(f"{compound.get('name')} ({compound.get('id')}): {e}")
+            continue
+        updated += 1
+        critical += fields["is_critical"]
+        updates.append(({"_id": compound["_id"]}, fields))
+        if len(updates) >= BATCH_SIZE:
+            if not dry_run:
+                await write_updates(db, "compounds", updates)
+            updates = []
+    if updates and not dry_run:
+        await write_updates(db, "compounds", updates)
+    if updated and not dry_run:
+        await versions.bump(db, "compounds")
+        await server.ensure_indexes()
+    logger.info(f"compounds: normalized={updated} critical={critical} invalid={len(invalid)}")
+    return {"updated": updated, "critical": critical, "invalid": invalid}
+
+async def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="PestiLab maintenance commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("migrate-datetimes", help="store created_at/updated_at/timestamp as BSON dates")
+    p.add_argument("--dry-run", action="store_true", help="only count documents that would change")
+    p = sub.add_parser("backfill-label-assets", help="pre-render QR/barcode assets for existing labels")
+    p.add_argument("--dry-run", action="store_true", help="only count labels without assets")
+    p = sub.add_parser("rebuild-stock-ledger", help="rebuild stock movements and snapshots from usages")
+    p.add_argument("--dry-run", action="store_true", help="only count the movements that would be written")
+    p.add_argument("--compound-id", help="rebuild a single compound")
+    p = sub.add_parser("rebuild-analytics", help="recompute the daily usage rollups from usages")
+    p.add_argument("--dry-run", action="store_true", help="only count the rollup documents")
+    p = sub.add_parser("normalize-stock-units", help="store canonical mg amounts and the is_critical flag on compounds")
+    p.add_argument("--dry-run", action="store_true", help="only report what would change")
+    sub.add_parser("forecast-stock", help="recompute every compound's depletion forecast")
+    p = sub.add_parser("backfill-sync", help="stamp compounds, densities and labels for delta sync")
+    p.add_argument("--dry-run", action="store_true", help="only count unstamped documents")
+    args = parser.parse_args(argv)
+
+    if server.db is None:
+        logger.error("MONGO_URL is not configured")
+        return 1
+
+    if args.command == "migrate-datetimes":
+        report = await migrate_datetimes(server.db, dry_run=args.dry_run)
+        for key, counts in report.items():
+            print(f"{key}: {counts['converted']} converted, {counts['failed']} failed")
+    elif args.command == "backfill-label-assets":
+        report = await backfill_label_assets(server.db, dry_run=args.dry_run)
+        print(f"labels: {report['rendered']} {'to render' if args.dry_run else 'rendered'}")
+    elif args.command == "rebuild-stock-ledger":
+        report = await rebuild_stock_ledger(server.db, dry_run=args.dry_run, compound_id=args.compound_id)
+        print(f"compounds: {report['compounds']}, movements: {report['movements']}{' (dry run)' if args.dry_run else ''}")
+    elif args.command == "rebuild-analytics":
+        report = await analytics.rebuild(server.db, dry_run=args.dry_run)
+        print(", ".join(f"{dim}: {count} daily rollups" for dim, count in report.items()) + (" (dry run)" if args.dry_run else ""))
+    elif args.command == "normalize-stock-units":
+        report = await normalize_stock_units(server.db, dry_run=args.dry_run)
+        print(f"compounds: {report['updated']} normalized, {report['critical']} critical, {len(report['invalid'])} need fixing")
+        for line in report["invalid"]:
+            print(f"  {line}")
+    elif args.command == "forecast-stock":
+        count = await forecast.refresh_all(server.db, ISTANBUL_TZ)
+        print(f"compounds: {count} forecasts changed")
+    elif args.command == "backfill-sync":
+        report = await sync.backfill(server.db, datetime.now(ISTANBUL_TZ), dry_run=args.dry_run)
+        print(", ".join(f"{name}: {count}" for name, count in report.items()) + (" (dry run)" if args.dry_run else " stamped"))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
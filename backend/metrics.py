@@ -0,0 +1,149 @@
+"""In-process latency histograms with Prometheus text exposition.
+
+Request latency is recorded by the HTTP middleware in server.py; handlers wrap
+the interesting parts of their work in ``phase("db")``, ``phase("render")`` and
+so on, which are attributed to the route that is currently being served.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+REGISTRY: List = []  # every metric, in exposition order
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, labels: Tuple[str, ...], seconds: float):
+        with self._lock:
+            # per series: one counter per bucket, then sum, then count
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+            sep = "," if base else ""
+            for bound, count in zip(self.buckets, series):
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {int(count)}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {int(series[-1])}")
+        return lines
+
+class Gauge:
+    """A value per label set; ``kind="counter"`` for values that only go up."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], kind: str = "gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.kind = kind
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def set(self, labels: Tuple[str, ...], value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, labels: Tuple[str, ...]) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for labels, value in sorted(snapshot.items()):
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+            lines.append(f"{self.name}{{{base}}} {value:g}" if base else f"{self.name} {value:g}")
+        return lines
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+REQUEST_LATENCY = Histogram(
+    "pestilab_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status")
+)
+PHASE_LATENCY = Histogram(
+    "pestilab_phase_duration_seconds", "Time spent per phase (db, density, render, assemble, audit) by route.", ("route", "phase")
+)
+
+class RequestTimings:
+    """Phase breakdown of the request currently being served."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        # time spent in nested phases, per open phase, so each phase records exclusive time
+        self.open_phases: List[float] = []
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def summary(self) -> str:
+        return " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in sorted(self.phases.items()))
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("pestilab_request_timings", default=None)
+
+def start_request() -> RequestTimings:
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+@contextmanager
+def phase(name: str):
+    """Time a block of handler work; a no-op outside a request.
+
+    Phases may nest (e.g. "render" inside "assemble"); the outer phase is
+    credited only with the time not spent in inner ones.
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    timings.open_phases.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        nested = timings.open_phases.pop()
+        timings.add(name, elapsed - nested)
+        if timings.open_phases:
+            timings.open_phases[-1] += elapsed
+
+def record_request(method: str, route: str, status: int, timings: RequestTimings) -> float:
+    elapsed = time.perf_counter() - timings.started
+    REQUEST_LATENCY.observe((method, route, str(status)), elapsed)
+    for name, seconds in timings.phases.items():
+        PHASE_LATENCY.observe((route, name), seconds)
+    return elapsed
+
+def render_prometheus() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
@@ -0,0 +1,155 @@
+"""Motor client construction: pool sizing, timeouts, compression and pool metrics.
+
+All settings come from the environment and default to the driver's own:
+
+    MONGO_MAX_POOL_SIZE                 connections per server (driver default 100)
+    MONGO_MIN_POOL_SIZE                 connections kept warm (default 0)
+    MONGO_MAX_IDLE_TIME_MS              close connections idle this long
+    MONGO_WAIT_QUEUE_TIMEOUT_MS         fail a checkout after waiting this long for a free connection
+    MONGO_SERVER_SELECTION_TIMEOUT_MS   (driver default 30000)
+    MONGO_CONNECT_TIMEOUT_MS
+    MONGO_COMPRESSORS                   e.g. "zstd,snappy,zlib"; zstd needs `zstandard`, snappy `python-snappy`
+    MONGO_REPORT_READ_PREFERENCE        read preference for exports and search, e.g. "secondaryPreferred"
+
+The driver opens connections lazily on first use, and the client is module
+level, so a warm serverless instance reuses its pool across invocations.
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReadPreference, monitoring
+
+from metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+# compressor -> module it needs
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+POOL_CONNECTIONS = Gauge("pestilab_mongo_pool_connections", "Open connections per MongoDB server.", ("address",))
+POOL_CHECKED_OUT = Gauge("pestilab_mongo_pool_checked_out", "Connections currently in use per MongoDB server.", ("address",))
+POOL_MAX_SIZE = Gauge("pestilab_mongo_pool_max_size", "Configured maximum pool size.", ())
+POOL_CHECKOUT_FAILURES = Gauge(
+    "pestilab_mongo_pool_checkout_failures_total", "Failed connection checkouts by reason.", ("address", "reason"), kind="counter"
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "pestilab_mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", ("address",),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, float("inf")),
+)
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Feeds the pool gauges; callbacks run on the driver's threads."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = _address(event)
+        POOL_CONNECTIONS.set((address,), 0)
+        POOL_CHECKED_OUT.set((address,), 0)
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS.inc((_address(event),))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS.inc((_address(event),), -1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        address = _address(event)
+        POOL_CHECKOUT_FAILURES.inc((address, str(event.reason)))
+        self._observe_wait(address)
+
+    def connection_checked_out(self, event):
+        address = _address(event)
+        POOL_CHECKED_OUT.inc((address,))
+        self._observe_wait(address)
+
+    def connection_checked_in(self, event):
+        POOL_CHECKED_OUT.inc((_address(event),), -1)
+
+    def _observe_wait(self, address: str):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            POOL_CHECKOUT_WAIT.observe((address,), time.perf_counter() - started)
+            self._local.started = None
+
+def _address(event) -> str:
+    host, port = event.address
+    return f"{host}:{port}"
+
+def _int_env(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+def compressors(requested: str) -> List[str]:
+    """The requested compressors whose libraries are installed."""
+    available = []
+    for name in (c.strip() for c in requested.split(",") if c.strip()):
+        module = COMPRESSOR_MODULES.get(name)
+        if module is None:
+            logger.warning(f"Unknown MongoDB compressor {name!r} ignored")
+            continue
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            logger.warning(f"MongoDB compressor {name!r} needs the {module!r} package; skipped")
+            continue
+        available.append(name)
+    return available
+
+def client_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {}
+    for option, env in (
+        ("maxPoolSize", "MONGO_MAX_POOL_SIZE"),
+        ("minPoolSize", "MONGO_MIN_POOL_SIZE"),
+        ("maxIdleTimeMS", "MONGO_MAX_IDLE_TIME_MS"),
+        ("waitQueueTimeoutMS", "MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        ("serverSelectionTimeoutMS", "MONGO_SERVER_SELECTION_TIMEOUT_MS"),
+        ("connectTimeoutMS", "MONGO_CONNECT_TIMEOUT_MS"),
+    ):
+        value = _int_env(env)
+        if value is not None:
+            options[option] = value
+    enabled = compressors(os.getenv("MONGO_COMPRESSORS", ""))
+    if enabled:
+        options["compressors"] = ",".join(enabled)
+    return options
+
+def create_client(url: str, tzinfo):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    options = client_options()
+    POOL_MAX_SIZE.set((), options.get("maxPoolSize", 100))
+    return AsyncIOMotorClient(url, tz_aware=True, tzinfo=tzinfo, event_listeners=[PoolMetrics()], **options)
+
+def report_read_preference():
+    name = os.getenv("MONGO_REPORT_READ_PREFERENCE", "primary")
+    if name not in READ_PREFERENCES:
+        logger.warning(f"Unknown MONGO_REPORT_READ_PREFERENCE {name!r}; using primary")
+        name = "primary"
+    return READ_PREFERENCES[name]
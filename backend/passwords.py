@@ -0,0 +1,104 @@
+"""bcrypt off the event loop, with admission control for logins.
+
+A bcrypt hash or check costs 100-300 ms of CPU at the default cost. Run inline
+in an ``async def``, it stalls every other request for that long. Here the
+work runs on a small dedicated thread pool (bcrypt releases the GIL while
+hashing). Admission is bounded in three ways, and anything over a limit is
+turned away at once instead of queueing:
+
+    PASSWORD_WORKERS             threads doing bcrypt work (default: CPUs, at most 4)
+    PASSWORD_QUEUE_LIMIT         hashes/checks admitted at once, running or waiting (default 32)
+    LOGIN_MAX_INFLIGHT_PER_USER  concurrent login attempts per username (default 1)
+    LOGIN_MAX_INFLIGHT_PER_IP    concurrent login attempts per client IP (default 10)
+    BCRYPT_ROUNDS                cost factor for new hashes (default 12)
+
+Stored hashes keep their own cost. After a successful login, a hash with a
+different cost is re-hashed (see ``needs_rehash``), so changing BCRYPT_ROUNDS
+takes effect as users log in.
+"""
+import asyncio
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "32"))
+LOGIN_MAX_INFLIGHT_PER_USER = int(os.getenv("LOGIN_MAX_INFLIGHT_PER_USER", "1"))
+LOGIN_MAX_INFLIGHT_PER_IP = int(os.getenv("LOGIN_MAX_INFLIGHT_PER_IP", "10"))
+
+class Busy(Exception):
+    """Password work was not admitted; ``scope`` names the limit that was hit."""
+
+    def __init__(self, scope: str):
+        super().__init__(f"Too many concurrent password operations ({scope})")
+        self.scope = scope
+
+_executor: Optional[ThreadPoolExecutor] = None
+_pending = 0
+_inflight: Counter = Counter()  # ("user", name) / ("ip", address) -> login attempts in progress
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def _run(func, *args):
+    global _pending
+    if _pending >= PASSWORD_QUEUE_LIMIT:
+        raise Busy("queue")
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor(), func, *args)
+    finally:
+        _pending -= 1
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+def _check(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+async def hash_password(password: str, rounds: Optional[int] = None) -> str:
+    return await _run(_hash, password, rounds or BCRYPT_ROUNDS)
+
+async def check_password(password: str, hashed: str) -> bool:
+    return await _run(_check, password, hashed)
+
+def needs_rehash(hashed: str) -> bool:
+    # "$2b$12$..." -> 12
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+@contextmanager
+def login_slot(username: str, ip: Optional[str]) -> Iterator[None]:
+    """Hold a login slot for the username and the client IP, or raise Busy."""
+    keys = [("user", username)]
+    if ip:
+        keys.append(("ip", ip))
+    limits = {"user": LOGIN_MAX_INFLIGHT_PER_USER, "ip": LOGIN_MAX_INFLIGHT_PER_IP}
+    for scope, key in keys:
+        if _inflight[(scope, key)] >= limits[scope]:
+            raise Busy(scope)
+    for key in keys:
+        _inflight[key] += 1
+    try:
+        yield
+    finally:
+        for key in keys:
+            _inflight[key] -= 1
+            if not _inflight[key]:
+                del _inflight[key]
@@ -0,0 +1,172 @@
+"""QC control charts for weighing deviation.
+
+Every usage stores ``deviation``: the actual concentration's percentage
+deviation from the target. This module charts those values per compound,
+operator or balance and flags Westgard rule violations.
+
+Usages are read with one streaming cursor that walks the matching
+(key, created_at) index. Each point goes through ``ControlChart``, which
+costs O(1) per point, and only one cursor batch is held at a time, so a
+year of weighings does not have to fit in memory.
+
+Each point is judged against the mean and SD of the ``window`` points before
+it. No limits are set until at least ``min_points`` earlier points exist.
+Because the limits follow the data, a slow drift is partly absorbed. A wider
+window makes drifts easier to catch.
+
+Rules (z is the point's distance from the rolling mean, in SDs):
+
+    1_2s  |z| > 2                                                 warning
+    1_3s  |z| > 3                                                 reject
+    2_2s  two consecutive points beyond 2 SD on the same side     reject
+    R_4s  consecutive points > 4 SD apart, on opposite sides      reject
+    4_1s  four consecutive points beyond 1 SD on the same side    reject
+    10_x  ten consecutive points on the same side of the mean     reject
+"""
+import math
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+DIMENSIONS = {"compound": "compound_id", "operator": "prepared_by", "balance": "balance_id"}  # dimension -> usage field
+RULES = ("1_2s", "1_3s", "2_2s", "R_4s", "4_1s", "10_x")
+WARNING_RULES = {"1_2s"}
+FIELDS = {"_id": 0, "id": 1, "compound_id": 1, "compound_name": 1, "prepared_by": 1, "balance_id": 1, "deviation": 1, "label_code_used": 1, "created_at": 1}
+
+async def ensure_indexes(db):
+    # compound_id and prepared_by already have (field, created_at) indexes
+    await db.usages.create_index([("balance_id", 1), ("created_at", -1)])
+
+class ControlChart:
+    """Rolling mean/SD over the previous ``window`` points plus the Westgard rules."""
+
+    def __init__(self, window: int = 20, min_points: int = 10):
+        self.window = window
+        self.min_points = max(2, min(min_points, window))
+        self.values: deque = deque()
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.recent_z: deque = deque(maxlen=10)  # z of the latest judged points, oldest first
+
+    def limits(self):
+        n = len(self.values)
+        if n < self.min_points:
+            return None, None
+        mean = self.total / n
+        variance = max(self.total_sq - n * mean * mean, 0.0) / (n - 1)
+        return mean, math.sqrt(variance)
+
+    def violations(self, z: float) -> List[str]:
+        hits = []
+        if abs(z) > 2:
+            hits.append("1_2s")
+        if abs(z) > 3:
+            hits.append("1_3s")
+        previous = self.recent_z[-1] if self.recent_z else None
+        if previous is not None:
+            if abs(z) > 2 and abs(previous) > 2 and (z > 0) == (previous > 0):
+                hits.append("2_2s")
+            if abs(z - previous) > 4 and (z > 0) != (previous > 0):
+                hits.append("R_4s")
+        last = list(self.recent_z)
+        if len(last) >= 3 and all(abs(v) > 1 and (v > 0) == (z > 0) for v in last[-3:]) and abs(z) > 1:
+            hits.append("4_1s")
+        if len(last) >= 9 and z != 0 and all(v != 0 and (v > 0) == (z > 0) for v in last[-9:]):
+            hits.append("10_x")
+        return hits
+
+    def add(self, value: float) -> Dict[str, Any]:
+        """Judge ``value`` against the current limits, then add it to the window."""
+        mean, sd = self.limits()
+        z = None
+        hits: List[str] = []
+        if sd:
+            z = (value - mean) / sd
+            hits = self.violations(z)
+            self.recent_z.append(z)
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+        if len(self.values) > self.window:
+            dropped = self.values.popleft()
+            self.total -= dropped
+            self.total_sq -= dropped * dropped
+        return {
+            "mean": round(mean, 4) if mean is not None else None,
+            "sd": round(sd, 4) if sd is not None else None,
+            "z": round(z, 3) if z is not None else None,
+            "violations": hits,
+            "status": status(hits),
+        }
+
+def status(violations: List[str]) -> str:
+    if any(rule not in WARNING_RULES for rule in violations):
+        return "reject"
+    return "warning" if violations else "ok"
+
+async def chart(db, dimension: str, key: str, created_at: Dict[str, Any], window: int, min_points: int,
+                violations_only: bool = False) -> Dict[str, Any]:
+    """One key's control chart, oldest point first."""
+    field = DIMENSIONS[dimension]
+    engine = ControlChart(window, min_points)
+    points: List[Dict[str, Any]] = []
+    counts = {rule: 0 for rule in RULES}
+    total = 0
+    cursor = db.usages.find({field: key, "created_at": created_at}, FIELDS).sort("created_at", 1)
+    async for usage in cursor:
+        total += 1
+        point = engine.add(usage["deviation"])
+        for rule in point["violations"]:
+            counts[rule] += 1
+        if violations_only and not point["violations"]:
+            continue
+        points.append({
+            "id": usage["id"],
+            "created_at": usage["created_at"],
+            "label_code": usage.get("label_code_used"),
+            "deviation": usage["deviation"],
+            **point,
+        })
+    return {"count": total, "violations": counts, "points": points}
+
+async def summary(db, dimension: str, created_at: Dict[str, Any], window: int, min_points: int, limit: int = 100) -> List[Dict[str, Any]]:
+    """Per-key point counts, overall mean/SD and violation counts; most rejects first."""
+    field = DIMENSIONS[dimension]
+    rows: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    engine: Optional[ControlChart] = None
+
+    def finish(row):
+        n = row.pop("n")
+        mean = row.pop("sum") / n
+        variance = max(row.pop("sum_sq") - n * mean * mean, 0.0) / (n - 1) if n > 1 else 0.0
+        row.update({"count": n, "mean": round(mean, 4), "sd": round(math.sqrt(variance), 4)})
+        rows.append(row)
+
+    query = {field: {"$ne": None}, "created_at": created_at}
+    # keys descending, time ascending: the (field 1, created_at -1) index walked backwards
+    cursor = db.usages.find(query, FIELDS).sort([(field, -1), ("created_at", 1)])
+    async for usage in cursor:
+        key = usage[field]
+        if current is None or current["key"] != key:
+            if current is not None:
+                finish(current)
+            current = {
+                "key": key, "label": usage.get("compound_name") if dimension == "compound" else key,
+                "n": 0, "sum": 0.0, "sum_sq": 0.0, "rejects": 0, "warnings": 0,
+                "violations": {rule: 0 for rule in RULES}, "last_violation_at": None,
+            }
+            engine = ControlChart(window, min_points)
+        value = usage["deviation"]
+        current["n"] += 1
+        current["sum"] += value
+        current["sum_sq"] += value * value
+        point = engine.add(value)
+        for rule in point["violations"]:
+            current["violations"][rule] += 1
+        if point["status"] != "ok":
+            current["rejects" if point["status"] == "reject" else "warnings"] += 1
+            current["last_violation_at"] = usage["created_at"]
+    if current is not None:
+        finish(current)
+    rows.sort(key=lambda row: (-row["rejects"], -row["warnings"], str(row["key"])))
+    return rows[:limit]
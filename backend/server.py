@@ -1,53 +1,93 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Query, Request, BackgroundTasks, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response, PlainTextResponse, FileResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any, Tuple
+from pydantic import BaseModel, Field, ConfigDict, AfterValidator
+from typing import List, Optional, Dict, Any, Tuple, Annotated
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, date, time, timezone, timedelta
 import jwt
-import bcrypt
-from openpyxl import load_workbook, Workbook
 import io
-import qrcode
-import barcode
-from barcode.writer import ImageWriter
-from reportlab.lib.pagesizes import A4, mm
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-import pytz
+from zoneinfo import ZoneInfo
 from io import BytesIO
 import base64
 import re
-from openpyxl.styles import Font, Alignment, PatternFill
-from PyPDF2 import PdfMerger  # kept for compatibility
-from docx import Document as DocxDocument
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-import zipfile
+import orjson
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from metrics import phase, start_request, record_request, render_prometheus
+import mongo
+from label_profiles import (
+    THERMAL_PROFILES, DEFAULT_THERMAL_PROFILE_ID, get_thermal_profile,
+    SHEET_PROFILES, DEFAULT_SHEET_PROFILE_ID, get_sheet_profile,
+)
+import analytics
+import compression
+import label_assets
+import passwords
+import qc
+import stock_ledger
+import sync
+import units
+import versions
+import events
+import export_jobs
+import forecast
+import idempotency
+from exports import EXPORT_KINDS, build_weighings_xlsx, build_labels_pdf, build_labels_docx, build_labels_docx_zip
+from thermal import RENDERERS as THERMAL_RENDERERS
+# openpyxl, qrcode, python-barcode (PIL), reportlab and python-docx are imported
+# inside the import/export/render functions that use them, so cold starts that
+# only serve JSON endpoints never pay for loading them.
 
 # ==== INIT ====
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / ".env")
 
-# MongoDB
+# TZ
+ISTANBUL_TZ = ZoneInfo("Europe/Istanbul")
+
+def now_istanbul() -> datetime:
+    return datetime.now(ISTANBUL_TZ)
+
+def to_istanbul(value: datetime) -> datetime:
+    # naive values coming back from BSON are UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(ISTANBUL_TZ)
+
+# Stored as a BSON date, serialized for the API as ISO 8601 with the Istanbul offset
+IstanbulDatetime = Annotated[datetime, AfterValidator(to_istanbul)]
+
+# MongoDB (dates are stored as BSON dates and read back localized to Istanbul);
+# pool, timeout and compression settings are read from the environment, see mongo.py
 MONGO_URL = os.getenv("MONGO_URL", "")
 DB_NAME = os.getenv("DB_NAME", "pestilab")
-client: Optional[AsyncIOMotorClient] = AsyncIOMotorClient(MONGO_URL) if MONGO_URL else None
+client: Optional[AsyncIOMotorClient] = mongo.create_client(MONGO_URL, ISTANBUL_TZ) if MONGO_URL else None
 db = client[DB_NAME] if client else None
+REPORT_READ_PREFERENCE = mongo.report_read_preference()
+
+def report_db():
+    """Database handle for exports and search, which may read from secondaries."""
+    if REPORT_READ_PREFERENCE == mongo.READ_PREFERENCES["primary"]:
+        return db
+    return db.with_options(read_preference=REPORT_READ_PREFERENCE)
 
 # JWT
 SECRET_KEY = os.getenv("SECRET_KEY", "laboratory-secret-key-2025")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480
 
-# TZ
-ISTANBUL_TZ = pytz.timezone("Europe/Istanbul")
+# Lean responses: documents read from our own collections are already in API
+# shape, so list endpoints send them straight through orjson instead of
+# rebuilding a Pydantic model per document and re-validating via response_model.
+LEAN_RESPONSES = os.getenv("LEAN_RESPONSES", "true").lower() in ("1", "true", "yes")
 
 # FastAPI app + router
 app = FastAPI()
@@ -72,7 +112,7 @@ class User(BaseModel):
     username: str
     email: str
     role: str = "analyst"
-    created_at: str = Field(default_factory=lambda: datetime.now(ISTANBUL_TZ).isoformat())
+    created_at: IstanbulDatetime = Field(default_factory=now_istanbul)
 
 class UserCreate(BaseModel):
     username: str
@@ -99,10 +139,16 @@ class Compound(BaseModel):
     stock_unit: str = "mg"
     critical_value: float = 100.0
     critical_unit: str = "mg"
+    # canonical stock fields, kept in sync by every write (see units.py)
+    stock_mg: Optional[float] = None
+    critical_mg: Optional[float] = None
+    stock_ratio: Optional[float] = None
+    is_critical: bool = False
+    forecast: Optional[Dict[str, Any]] = None  # see forecast.py
     last_serial: int = 0
     notes: Optional[str] = None
-    created_at: str = Field(default_factory=lambda: datetime.now(ISTANBUL_TZ).isoformat())
-    updated_at: str = Field(default_factory=lambda: datetime.now(ISTANBUL_TZ).isoformat())
+    created_at: IstanbulDatetime = Field(default_factory=now_istanbul)
+    updated_at: IstanbulDatetime = Field(default_factory=now_istanbul)
 
 class CompoundCreate(BaseModel):
     name: str
@@ -124,13 +170,41 @@ class CompoundUpdate(BaseModel):
     critical_unit: Optional[str] = None
     notes: Optional[str] = None
 
+class StockMovementCreate(BaseModel):
+    kind: str  # "restock" (amount > 0) or "adjustment" (signed)
+    amount: float  # in the compound's stock_unit
+    note: Optional[str] = None
+
+class CompoundBulkDelete(BaseModel):
+    # Selection: explicit ids and/or filters; nothing set selects the whole catalogue
+    ids: Optional[List[str]] = None
+    solvent: Optional[str] = None
+    max_stock_value: Optional[float] = None
+    cascade: str = "none"  # "none", "delete" or "archive" related usages and labels
+    dry_run: bool = False
+    include_backup: bool = True
+
+class ExportParams(BaseModel):
+    compound_id: Optional[str] = None
+    search_query: Optional[str] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    profile: Optional[str] = None  # labels_pdf sheet profile
+    copies: int = Field(default=1, ge=1, le=100)  # labels_pdf
+
+class ExportJobCreate(ExportParams):
+    kind: str  # "weighings_xlsx", "labels_pdf", "labels_docx" or "labels_docx_zip"
+
+class LabelResolveRequest(BaseModel):
+    codes: List[str] = Field(..., max_length=500)  # scanned label codes or QR payloads
+
 class SolventDensity(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     solvent_name: str
     temperature_c: float
     density_g_per_ml: float
-    created_at: str = Field(default_factory=lambda: datetime.now(ISTANBUL_TZ).isoformat())
+    created_at: IstanbulDatetime = Field(default_factory=now_istanbul)
 
 class SolventDensityCreate(BaseModel):
     solvent_name: str
@@ -146,6 +220,7 @@ class WeighingInput(BaseModel):
     temperature_c: float = 25.0
     solvent: Optional[str] = None
     prepared_by: str
+    balance_id: Optional[str] = None  # balance used, for QC charts per balance
     mix_code: Optional[str] = None
     mix_code_show: bool = True
     label_code: Optional[str] = None
@@ -172,11 +247,12 @@ class Usage(BaseModel):
     remaining_stock: float
     remaining_stock_unit: str
     prepared_by: str
+    balance_id: Optional[str] = None
     mix_code: Optional[str] = None
     mix_code_show: bool = True
     label_code_used: Optional[str] = None
     label_code_source: str = "auto"
-    created_at: str = Field(default_factory=lambda: datetime.now(ISTANBUL_TZ).isoformat())
+    created_at: IstanbulDatetime = Field(default_factory=now_istanbul)
 
 class Label(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -190,7 +266,8 @@ class Label(BaseModel):
     prepared_by: str
     date: str
     qr_data: str
-    created_at: str = Field(default_factory=lambda: datetime.now(ISTANBUL_TZ).isoformat())
+    assets: Optional[Dict[str, str]] = None  # kind -> label_assets digest
+    created_at: IstanbulDatetime = Field(default_factory=now_istanbul)
 
 class ExcelImportPreview(BaseModel):
     to_insert: List[Dict[str, Any]]
@@ -206,6 +283,31 @@ class ExcelImportResponse(BaseModel):
     densities_added: int = 0
 
 # ==== HELPERS ====
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+def projection_for(model) -> Dict[str, int]:
+    """Only the model's fields, so lean responses have the same shape as validated ones."""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+def trusted_list(model, docs: List[Dict[str, Any]]):
+    """Pass trusted Mongo documents (read with ``projection_for(model)``) through untouched when lean responses are on."""
+    if LEAN_RESPONSES:
+        return FastJSONResponse(docs)
+    return [model(**d) for d in docs]
+
+async def not_modified(request: Request, resource: str, *collections: str) -> Optional[Response]:
+    """ETag the response from the collections' versions; a bare 304 if the client already has it."""
+    with phase("db"):
+        tag = await versions.etag(db, resource, collections)
+    request.state.etag = tag
+    if versions.matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers={"ETag": tag, "Cache-Control": "private, no-cache"})
+    return None
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -326,22 +428,61 @@ def interpolate_density(temperature: float, density_data: List[Dict[str, float]]
     density = d1 + (d2 - d1) * (temperature - t1) / (t2 - t1)
     return density, True
 
-def generate_qr_code(data: str) -> str:
-    qr = qrcode.QRCode(version=1, box_size=10, border=1)
-    qr.add_data(data)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    buffer.seek(0)
-    return base64.b64encode(buffer.getvalue()).decode()
-
-def generate_barcode(code: str) -> str:
-    buffer = BytesIO()
-    code128 = barcode.get("code128", code, writer=ImageWriter())
-    code128.write(buffer, {"write_text": False, "module_height": 8, "module_width": 0.2})
-    buffer.seek(0)
-    return base64.b64encode(buffer.getvalue()).decode()
+def date_range_query(date_from: Optional[date], date_to: Optional[date], field: str = "created_at") -> Dict[str, Any]:
+    """Inclusive calendar-day range (Istanbul time) as a BSON date filter."""
+    bounds: Dict[str, Any] = {}
+    if date_from:
+        bounds["$gte"] = datetime.combine(date_from, time.min, tzinfo=ISTANBUL_TZ)
+    if date_to:
+        bounds["$lt"] = datetime.combine(date_to + timedelta(days=1), time.min, tzinfo=ISTANBUL_TZ)
+    return {field: bounds} if bounds else {}
+
+def format_date(value: Any) -> str:
+    """YYYY-MM-DD for BSON dates and legacy ISO strings alike."""
+    if isinstance(value, datetime):
+        return to_istanbul(value).strftime("%Y-%m-%d")
+    return str(value)[:10] if value else ""
+
+def canonical_stock(compound: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonical stock fields for a compound; a legacy document with unusable units keeps its old fields."""
+    try:
+        return units.compound_stock_fields(compound)
+    except units.UnitError as e:
+        logger.warning(f"Compound {compound.get('id')}: {e}")
+        return {}
+
+def checked_stock_fields(compound: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return units.compound_stock_fields(compound)
+    except units.UnitError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def ensure_indexes():
+    await db.usages.create_index([("created_at", -1), ("id", -1)])
+    await db.usages.create_index([("compound_id", 1), ("created_at", -1)])
+    await db.usages.create_index([("prepared_by", 1), ("created_at", -1)])
+    await db.usages.create_index([("mix_code", 1), ("created_at", -1)])
+    try:
+        await db.usages.drop_index("usages_text")  # search is a substring match now; the text index went unused
+    except OperationFailure:
+        pass
+    await db.compounds.create_index([("is_critical", 1), ("stock_ratio", 1)])
+    await db.labels.create_index([("created_at", -1)])
+    try:
+        await db.labels.create_index("label_code", unique=True)
+    except OperationFailure as e:
+        # older data may hold duplicate codes; keep scans fast, resolve the duplicates by hand
+        logger.warning(f"labels.label_code has duplicates, unique index not created: {e}")
+        await db.labels.create_index("label_code")
+    await db.labels.create_index([("compound_id", 1), ("created_at", -1)])
+    await db.audit_logs.create_index([("timestamp", -1)])
+    await export_jobs.ensure_indexes(db)
+    await stock_ledger.ensure_indexes(db)
+    await analytics.ensure_indexes(db)
+    await forecast.ensure_indexes(db)
+    await qc.ensure_indexes(db)
+    await sync.ensure_indexes(db)
+    await idempotency.ensure_indexes(db)
 
 # ==== AUTH ====
 @api_router.post("/auth/register", response_model=User)
@@ -353,22 +494,44 @@ async def register(user_data: UserCreate, current_user: User = Depends(get_curre
     existing_user = await db.users.find_one({"username": user_data.username})
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
-    hashed_password = bcrypt.hashpw(user_data.password.encode("utf-8"), bcrypt.gensalt())
+    try:
+        hashed_password = await passwords.hash_password(user_data.password)
+    except passwords.Busy as e:
+        raise password_busy(e)
     user = User(username=user_data.username, email=user_data.email, role=user_data.role)
     doc = user.model_dump()
-    doc["password"] = hashed_password.decode("utf-8")
+    doc["password"] = hashed_password
     await db.users.insert_one(doc)
     return user
 
+def password_busy(e: passwords.Busy) -> HTTPException:
+    # per-user/IP limits: the client is retrying too eagerly; queue: the server is saturated
+    code = 503 if e.scope == "queue" else 429
+    return HTTPException(status_code=code, detail="Too many login attempts, try again shortly", headers={"Retry-After": "1"})
+
+async def rehash_password(username: str, password: str):
+    try:
+        hashed = await passwords.hash_password(password)
+    except passwords.Busy:
+        return  # retried on the next login
+    await db.users.update_one({"username": username}, {"$set": {"password": hashed}})
+
 @api_router.post("/auth/login", response_model=Token)
-async def login(login_data: UserLogin):
+async def login(login_data: UserLogin, request: Request, background_tasks: BackgroundTasks):
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
-    user = await db.users.find_one({"username": login_data.username})
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    if not bcrypt.checkpw(login_data.password.encode("utf-8"), user["password"].encode("utf-8")):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+    ip = request.client.host if request.client else None
+    try:
+        with passwords.login_slot(login_data.username, ip):
+            user = await db.users.find_one({"username": login_data.username})
+            if not user:
+                raise HTTPException(status_code=401, detail="Invalid credentials")
+            if not await passwords.check_password(login_data.password, user["password"]):
+                raise HTTPException(status_code=401, detail="Invalid credentials")
+    except passwords.Busy as e:
+        raise password_busy(e)
+    if passwords.needs_rehash(user["password"]):
+        background_tasks.add_task(rehash_password, user["username"], login_data.password)
     access_token = create_access_token(data={"sub": user["username"]})
     user_obj = User(**{k: v for k, v in user.items() if k != "password"})
     return Token(access_token=access_token, token_type="bearer", user=user_obj)
@@ -383,8 +546,8 @@ async def get_users(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Not authorized")
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
-    users = await db.users.find({}, {"_id": 0, "password": 0}).to_list(1000)
-    return [User(**u) for u in users]
+    users = await db.users.find({}, projection_for(User)).to_list(1000)
+    return trusted_list(User, users)
 
 # ==== SOLVENT DENSITY ====
 @api_router.post("/solvent-densities", response_model=SolventDensity)
@@ -394,15 +557,19 @@ async def create_solvent_density(data: SolventDensityCreate, current_user: User
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
     density = SolventDensity(**data.model_dump())
-    await db.solvent_densities.insert_one(density.model_dump())
+    await db.solvent_densities.insert_one({**density.model_dump(), **await sync.stamp(db, density.created_at)})
+    await versions.bump(db, "solvent_densities")
     return density
 
 @api_router.get("/solvent-densities", response_model=List[SolventDensity])
-async def get_solvent_densities(current_user: User = Depends(get_current_user)):
+async def get_solvent_densities(request: Request, current_user: User = Depends(get_current_user)):
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
-    densities = await db.solvent_densities.find({}, {"_id": 0}).to_list(1000)
-    return [SolventDensity(**d) for d in densities]
+    cached = await not_modified(request, "solvent-densities", "solvent_densities")
+    if cached:
+        return cached
+    densities = await db.solvent_densities.find({}, projection_for(SolventDensity)).to_list(1000)
+    return trusted_list(SolventDensity, densities)
 
 @api_router.get("/solvent-densities/{solvent_name}/at/{temperature}")
 async def get_density_at_temperature(solvent_name: str, temperature: float, current_user: User = Depends(get_current_user)):
@@ -427,24 +594,33 @@ async def create_compound(compound_data: CompoundCreate, current_user: User = De
         raise HTTPException(status_code=403, detail="Read-only users cannot create compounds")
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
-    compound = Compound(**compound_data.model_dump())
-    await db.compounds.insert_one(compound.model_dump())
+    data = compound_data.model_dump()
+    compound = Compound(**data, **checked_stock_fields(data))
+    await db.compounds.insert_one({**compound.model_dump(), **await sync.stamp(db, compound.created_at)})
+    await stock_ledger.record(db, compound.id, "opening", compound.stock_value, compound.stock_unit, compound.created_at, user=current_user.username)
+    await forecast.refresh(db, ISTANBUL_TZ, [compound.id])
+    await versions.bump(db, "compounds")
+    events.publish_local(events.compound_event(compound.model_dump()))
     await db.audit_logs.insert_one({
         "id": str(uuid.uuid4()),
         "user": current_user.username,
         "action": "create_compound",
         "compound_id": compound.id,
         "compound_name": compound.name,
-        "timestamp": datetime.now(ISTANBUL_TZ).isoformat()
+        "timestamp": now_istanbul()
     })
     return compound
 
 @api_router.get("/compounds", response_model=List[Compound])
-async def get_compounds(current_user: User = Depends(get_current_user)):
+async def get_compounds(request: Request, current_user: User = Depends(get_current_user)):
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
-    compounds = await db.compounds.find({}, {"_id": 0}).to_list(10000)
-    return [Compound(**c) for c in compounds]
+    cached = await not_modified(request, "compounds", "compounds")
+    if cached:
+        return cached
+    with phase("db"):
+        compounds = await db.compounds.find({}, projection_for(Compound)).to_list(10000)
+    return trusted_list(Compound, compounds)
 
 @api_router.get("/compounds/{compound_id}", response_model=Compound)
 async def get_compound(compound_id: str, current_user: User = Depends(get_current_user)):
@@ -465,17 +641,41 @@ async def update_compound(compound_id: str, update_data: CompoundUpdate, current
     if not compound:
         raise HTTPException(status_code=404, detail="Compound not found")
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
-    update_dict["updated_at"] = datetime.now(ISTANBUL_TZ).isoformat()
-    await db.compounds.update_one({"id": compound_id}, {"$set": update_dict})
+    if events.STOCK_FIELDS & update_dict.keys():
+        update_dict.update(checked_stock_fields({**compound, **update_dict}))
+    update_dict["updated_at"] = now_istanbul()
+    await db.compounds.update_one({"id": compound_id}, {"$set": {**update_dict, **await sync.stamp(db, update_dict["updated_at"])}})
+    new_value = update_dict.get("stock_value", compound["stock_value"])
+    new_unit = update_dict.get("stock_unit", compound["stock_unit"])
+    if new_unit != compound["stock_unit"]:
+        # ledger deltas are in the unit of their day: close the balance in the old unit, reopen it in the new one
+        await stock_ledger.record(
+            db, compound_id, "closing", -compound["stock_value"], compound["stock_unit"], update_dict["updated_at"],
+            user=current_user.username, note=f"unit change to {new_unit}"
+        )
+        await stock_ledger.record(
+            db, compound_id, "opening", new_value, new_unit, update_dict["updated_at"],
+            user=current_user.username, note=f"unit change from {compound['stock_unit']}"
+        )
+    elif new_value != compound["stock_value"]:
+        await stock_ledger.record(
+            db, compound_id, "adjustment", new_value - compound["stock_value"], new_unit, update_dict["updated_at"],
+            user=current_user.username, note="compound edit"
+        )
+    if events.STOCK_FIELDS & update_dict.keys():
+        await forecast.refresh(db, ISTANBUL_TZ, [compound_id])
+    await versions.bump(db, "compounds")
     await db.audit_logs.insert_one({
         "id": str(uuid.uuid4()),
         "user": current_user.username,
         "action": "update_compound",
         "compound_id": compound_id,
         "changes": update_dict,
-        "timestamp": datetime.now(ISTANBUL_TZ).isoformat()
+        "timestamp": now_istanbul()
     })
     updated_compound = await db.compounds.find_one({"id": compound_id}, {"_id": 0})
+    if events.STOCK_FIELDS & update_dict.keys():
+        events.publish_local(events.compound_event(updated_compound))
     return Compound(**updated_compound)
 
 @api_router.delete("/compounds/{compound_id}")
@@ -487,15 +687,206 @@ async def delete_compound(compound_id: str, current_user: User = Depends(get_cur
     result = await db.compounds.delete_one({"id": compound_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Compound not found")
+    await sync.tombstone(db, "compounds", [compound_id], now_istanbul())
+    await versions.bump(db, "compounds")
     await db.audit_logs.insert_one({
         "id": str(uuid.uuid4()),
         "user": current_user.username,
         "action": "delete_compound",
         "compound_id": compound_id,
-        "timestamp": datetime.now(ISTANBUL_TZ).isoformat()
+        "timestamp": now_istanbul()
     })
     return {"message": "Compound deleted successfully"}
 
+BULK_DELETE_CHUNK = 1000
+# collections cascaded by compound id -> whether "archive" copies them first; snapshots and
+# compound rollups are derived data and are only deleted (operator rollups keep the
+# weighings; rebuild-analytics drops them)
+CASCADE_COLLECTIONS = {
+    "usages": True,
+    "labels": True,
+    stock_ledger.MOVEMENTS_COLLECTION: True,
+    stock_ledger.SNAPSHOTS_COLLECTION: False,
+    analytics.ROLLUPS_COLLECTION: False,
+}
+
+def cascade_filter(name: str, compound_ids: List[str]) -> Dict[str, Any]:
+    if name == analytics.ROLLUPS_COLLECTION:
+        return {"dim": "compound", "key": {"$in": compound_ids}}
+    return {"compound_id": {"$in": compound_ids}}
+
+@api_router.post("/compounds/clear")
+async def bulk_delete_compounds(payload: Optional[CompoundBulkDelete] = None, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admin can delete compounds")
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    payload = payload or CompoundBulkDelete()
+    if payload.cascade not in ("none", "delete", "archive"):
+        raise HTTPException(status_code=400, detail="cascade must be one of: none, delete, archive")
+
+    selector: Dict[str, Any] = {}
+    if payload.ids is not None:
+        selector["id"] = {"$in": payload.ids}
+    if payload.solvent:
+        selector["solvent"] = payload.solvent
+    if payload.max_stock_value is not None:
+        selector["stock_value"] = {"$lte": payload.max_stock_value}
+
+    projection = {"_id": 0} if payload.include_backup and not payload.dry_run else {"_id": 0, "id": 1}
+    with phase("db"):
+        matched = await db.compounds.find(selector, projection).to_list(None)
+    ids = [c["id"] for c in matched]
+    chunks = [ids[i:i + BULK_DELETE_CHUNK] for i in range(0, len(ids), BULK_DELETE_CHUNK)]
+
+    related = {name: 0 for name in CASCADE_COLLECTIONS}
+    if payload.dry_run:
+        if payload.cascade != "none":
+            with phase("db"):
+                for chunk in chunks:
+                    for name in related:
+                        related[name] += await db[name].count_documents(cascade_filter(name, chunk))
+        return {"dry_run": True, "matched_count": len(ids), "cascade": payload.cascade, "related": related}
+
+    deleted = 0
+    related[label_assets.ASSETS_COLLECTION] = 0
+    with phase("db"):
+        for chunk in chunks:
+            if payload.cascade != "none":
+                labels = await db.labels.find(cascade_filter("labels", chunk), {"_id": 0, "id": 1, "assets": 1}).to_list(None)
+                for name, archived in CASCADE_COLLECTIONS.items():
+                    if payload.cascade == "archive" and archived:
+                        await db[name].aggregate([
+                            {"$match": cascade_filter(name, chunk)},
+                            {"$merge": {"into": f"{name}_archive", "whenMatched": "replace"}}
+                        ]).to_list(None)
+                    result = await db[name].delete_many(cascade_filter(name, chunk))
+                    related[name] += result.deleted_count
+                await sync.tombstone(db, "labels", [label["id"] for label in labels], now_istanbul())
+                if payload.cascade == "delete":
+                    digests = [ref for label in labels for ref in (label.get("assets") or {}).values()]
+                    related[label_assets.ASSETS_COLLECTION] += await label_assets.delete_unreferenced(db, digests)
+            result = await db.compounds.delete_many({"id": {"$in": chunk}})
+            deleted += result.deleted_count
+            await sync.tombstone(db, "compounds", chunk, now_istanbul())
+        await versions.bump(db, "compounds", *(("usages", "labels") if payload.cascade != "none" else ()))
+
+    with phase("audit"):
+        await db.audit_logs.insert_one({
+            "id": str(uuid.uuid4()),
+            "user": current_user.username,
+            "action": "bulk_delete_compounds",
+            "selector": {
+                "id_count": len(payload.ids) if payload.ids is not None else None,
+                "solvent": payload.solvent,
+                "max_stock_value": payload.max_stock_value
+            },
+            "cascade": payload.cascade,
+            "details": f"Compounds: {deleted}, " + ", ".join(f"{name}: {count}" for name, count in related.items()),
+            "timestamp": now_istanbul()
+        })
+    response = {"dry_run": False, "deleted_count": deleted, "cascade": payload.cascade, "related": related}
+    if payload.include_backup:
+        response["backup_data"] = matched
+    return FastJSONResponse(response)
+
+# ==== STOCK LEDGER ====
+@api_router.post("/compounds/{compound_id}/stock-movements")
+async def create_stock_movement(compound_id: str, movement: StockMovementCreate, current_user: User = Depends(get_current_user)):
+    """Record a restock or a manual adjustment and apply it to the compound's stock."""
+    if current_user.role == "readonly":
+        raise HTTPException(status_code=403, detail="Read-only users cannot change stock")
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    if movement.kind not in ("restock", "adjustment"):
+        raise HTTPException(status_code=400, detail="kind must be one of: restock, adjustment")
+    if movement.amount == 0 or (movement.kind == "restock" and movement.amount < 0):
+        raise HTTPException(status_code=400, detail="amount must be positive for a restock and non-zero for an adjustment")
+    now = now_istanbul()
+    compound = await db.compounds.find_one_and_update(
+        {"id": compound_id}, {"$inc": {"stock_value": movement.amount}, "$set": {"updated_at": now, **await sync.stamp(db, now)}},
+        projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+    if not compound:
+        raise HTTPException(status_code=404, detail="Compound not found")
+    fields = canonical_stock(compound)
+    if fields:
+        await db.compounds.update_one({"id": compound_id}, {"$set": fields})
+        compound.update(fields)
+    recorded = await stock_ledger.record(
+        db, compound_id, movement.kind, movement.amount, compound["stock_unit"], now,
+        user=current_user.username, note=movement.note
+    )
+    await forecast.refresh(db, ISTANBUL_TZ, [compound_id])
+    await versions.bump(db, "compounds")
+    events.publish_local(events.compound_event(compound))
+    await db.audit_logs.insert_one({
+        "id": str(uuid.uuid4()),
+        "user": current_user.username,
+        "action": f"stock_{movement.kind}",
+        "compound_id": compound_id,
+        "details": f"{movement.amount:+g} {compound['stock_unit']}",
+        "timestamp": now
+    })
+    return FastJSONResponse({"movement": recorded, "compound": Compound(**compound).model_dump()})
+
+@api_router.get("/compounds/{compound_id}/stock-movements")
+async def get_stock_movements(compound_id: str, limit: int = Query(100, ge=1, le=1000), before_seq: Optional[int] = None, current_user: User = Depends(get_current_user)):
+    """Newest first; pass the last ``seq`` as ``before_seq`` for the next page."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    query: Dict[str, Any] = {"compound_id": compound_id}
+    if before_seq is not None:
+        query["seq"] = {"$lt": before_seq}
+    with phase("db"):
+        movements = await db[stock_ledger.MOVEMENTS_COLLECTION].find(query, {"_id": 0}).sort("seq", -1).limit(limit).to_list(limit)
+    return FastJSONResponse({"items": movements, "next_before_seq": movements[-1]["seq"] if len(movements) == limit else None})
+
+@api_router.get("/compounds/{compound_id}/stock")
+async def get_stock_at(compound_id: str, at: Optional[datetime] = None, current_user: User = Depends(get_current_user)):
+    """Stock as of ``at`` (ISO 8601; naive values are Istanbul time), from the nearest ledger snapshot."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    compound = await db.compounds.find_one({"id": compound_id}, {"_id": 0, "stock_unit": 1})
+    if not compound:
+        raise HTTPException(status_code=404, detail="Compound not found")
+    at = (at.replace(tzinfo=ISTANBUL_TZ) if at.tzinfo is None else at) if at else now_istanbul()
+    with phase("db"):
+        totals = await stock_ledger.totals_at(db, compound_id, at, unit=compound["stock_unit"])
+    return FastJSONResponse({
+        "compound_id": compound_id,
+        "at": to_istanbul(at),
+        "stock_value": totals["balance"],
+        "stock_unit": totals["unit"],
+        "consumed_total": totals["consumed"],
+        "restocked_total": totals["restocked"],
+        "last_movement_seq": totals["seq"],
+    })
+
+@api_router.get("/compounds/{compound_id}/consumption")
+async def get_consumption(compound_id: str, date_from: date, date_to: date, current_user: User = Depends(get_current_user)):
+    """Consumed and restocked amounts over whole Istanbul days, date_to inclusive."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="date_to must not be before date_from")
+    compound = await db.compounds.find_one({"id": compound_id}, {"_id": 0, "stock_unit": 1})
+    if not compound:
+        raise HTTPException(status_code=404, detail="Compound not found")
+    bounds = date_range_query(date_from, date_to)["created_at"]
+    with phase("db"):
+        try:
+            report = await stock_ledger.consumption(db, compound_id, bounds["$gte"], bounds["$lt"], unit=compound["stock_unit"])
+        except units.UnitError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    return FastJSONResponse({
+        "compound_id": compound_id,
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "stock_unit": report.pop("unit"),
+        **report,
+    })
+
 # ==== EXCEL IMPORT ====
 @api_router.post("/compounds/import/preview", response_model=ExcelImportPreview)
 async def preview_excel_import(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
@@ -506,6 +897,8 @@ async def preview_excel_import(file: UploadFile = File(...), current_user: User
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
 
+    from openpyxl import load_workbook
+
     contents = await file.read()
     workbook = load_workbook(filename=io.BytesIO(contents), read_only=True)
 
@@ -575,15 +968,22 @@ async def preview_excel_import(file: UploadFile = File(...), current_user: User
     )
 
 @api_router.post("/compounds/import", response_model=ExcelImportResponse)
-async def import_compounds(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
+async def import_compounds(file: UploadFile = File(...), idempotency_key: Optional[str] = Header(None), current_user: User = Depends(get_current_user)):
     if current_user.role == "readonly":
         raise HTTPException(status_code=403, detail="Read-only users cannot import data")
     if not file.filename.endswith((".xlsx", ".xls")):
         raise HTTPException(status_code=400, detail="Only Excel files are supported")
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
-
     contents = await file.read()
+    return await idempotency.run(
+        db, idempotency_key, current_user.username, "compounds.import", idempotency.fingerprint(contents),
+        lambda: import_workbook(contents, current_user)
+    )
+
+async def import_workbook(contents: bytes, current_user: User) -> ExcelImportResponse:
+    from openpyxl import load_workbook
+
     workbook = load_workbook(filename=io.BytesIO(contents), read_only=True)
 
     added = updated = skipped = densities_added = 0
@@ -637,26 +1037,31 @@ async def import_compounds(file: UploadFile = File(...), current_user: User = De
 
         existing = await db.compounds.find_one({"cas_number": cas})
         if existing:
+            now = now_istanbul()
             await db.compounds.update_one(
                 {"cas_number": cas},
-                {"$set": {"name": name, "solvent": solvent, "updated_at": datetime.now(ISTANBUL_TZ).isoformat()}}
+                {"$set": {"name": name, "solvent": solvent, "updated_at": now, **await sync.stamp(db, now)}}
             )
             updated += 1
         else:
             compound = Compound(
                 name=name, cas_number=cas, solvent=solvent,
                 stock_value=1000.0, stock_unit="mg",
-                critical_value=100.0, critical_unit="mg"
+                critical_value=100.0, critical_unit="mg",
+                **units.stock_fields(1000.0, "mg", 100.0, "mg")
             )
-            await db.compounds.insert_one(compound.model_dump())
+            await db.compounds.insert_one({**compound.model_dump(), **await sync.stamp(db, compound.created_at)})
+            await stock_ledger.record(db, compound.id, "opening", compound.stock_value, compound.stock_unit, compound.created_at, user=current_user.username)
+            events.publish_local(events.compound_event(compound.model_dump()))
             added += 1
+    await versions.bump(db, "compounds")
 
     await db.audit_logs.insert_one({
         "id": str(uuid.uuid4()),
         "user": current_user.username,
         "action": "import_excel",
         "details": f"Added: {added}, Updated: {updated}, Skipped: {skipped}",
-        "timestamp": datetime.now(ISTANBUL_TZ).isoformat()
+        "timestamp": now_istanbul()
     })
 
     return ExcelImportResponse(
@@ -733,13 +1138,20 @@ async def validate_weighing_input(weighing_data: WeighingInput, current_user: Us
     }
 
 @api_router.post("/weighing", response_model=Dict[str, Any])
-async def create_weighing(weighing_data: WeighingInput, current_user: User = Depends(get_current_user)):
+async def create_weighing(weighing_data: WeighingInput, background_tasks: BackgroundTasks, idempotency_key: Optional[str] = Header(None), current_user: User = Depends(get_current_user)):
     if current_user.role == "readonly":
         raise HTTPException(status_code=403, detail="Read-only users cannot create weighing records")
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
+    return await idempotency.run(
+        db, idempotency_key, current_user.username, "weighing", idempotency.fingerprint(weighing_data.model_dump()),
+        lambda: record_weighing(weighing_data, background_tasks, current_user)
+    )
 
-    compound = await db.compounds.find_one({"id": weighing_data.compound_id}, {"_id": 0})
+async def record_weighing(weighing_data: WeighingInput, background_tasks: BackgroundTasks, current_user: User) -> Dict[str, Any]:
+
+    with phase("db"):
+        compound = await db.compounds.find_one({"id": weighing_data.compound_id}, {"_id": 0})
     if not compound:
         raise HTTPException(status_code=404, detail="Compound not found")
 
@@ -750,22 +1162,23 @@ async def create_weighing(weighing_data: WeighingInput, current_user: User = Dep
     temperature = weighing_data.temperature_c
     solvent_name = weighing_data.solvent or compound["solvent"]
 
-    actual_mass_mg = weighed_mg * (purity_percent / 100.0)
-    solvent_density = calculate_solvent_density(solvent_name, temperature)
+    with phase("density"):
+        actual_mass_mg = weighed_mg * (purity_percent / 100.0)
+        solvent_density = calculate_solvent_density(solvent_name, temperature)
 
-    if concentration_mode == "mg/L":
-        required_volume_mL = actual_mass_mg / (target_concentration / 1000.0)
-        required_solvent_mass_g = required_volume_mL * solvent_density
-        actual_concentration_ppm = (actual_mass_mg / required_volume_mL) * 1000.0
-    else:
-        actual_mass_g = actual_mass_mg / 1000.0
-        c_target_fraction = target_concentration / 1_000_000.0
-        total_mass_g = actual_mass_g / c_target_fraction
-        required_solvent_mass_g = total_mass_g - actual_mass_g
-        required_volume_mL = required_solvent_mass_g / solvent_density
-        actual_concentration_ppm = (actual_mass_g / total_mass_g) * 1_000_000.0
+        if concentration_mode == "mg/L":
+            required_volume_mL = actual_mass_mg / (target_concentration / 1000.0)
+            required_solvent_mass_g = required_volume_mL * solvent_density
+            actual_concentration_ppm = (actual_mass_mg / required_volume_mL) * 1000.0
+        else:
+            actual_mass_g = actual_mass_mg / 1000.0
+            c_target_fraction = target_concentration / 1_000_000.0
+            total_mass_g = actual_mass_g / c_target_fraction
+            required_solvent_mass_g = total_mass_g - actual_mass_g
+            required_volume_mL = required_solvent_mass_g / solvent_density
+            actual_concentration_ppm = (actual_mass_g / total_mass_g) * 1_000_000.0
 
-    deviation_percent = ((actual_concentration_ppm - target_concentration) / target_concentration) * 100.0
+        deviation_percent = ((actual_concentration_ppm - target_concentration) / target_concentration) * 100.0
 
     required_volume_mL = round(required_volume_mL, 3)
     required_solvent_mass_g = round(required_solvent_mass_g, 3)
@@ -773,21 +1186,87 @@ async def create_weighing(weighing_data: WeighingInput, current_user: User = Dep
     deviation_percent = round(deviation_percent, 2)
     solvent_density = round(solvent_density, 4)
 
-    new_stock = compound["stock_value"] - weighed_mg
-    await db.compounds.update_one({"id": weighing_data.compound_id}, {"$set": {"stock_value": new_stock, "updated_at": datetime.now(ISTANBUL_TZ).isoformat()}})
-
+    weighed_in_stock_unit = units.weighed_in_stock_unit(weighed_mg, compound["stock_unit"])
     new_serial = compound["last_serial"] + 1
-    await db.compounds.update_one({"id": weighing_data.compound_id}, {"$set": {"last_serial": new_serial}})
-
     if weighing_data.label_code and weighing_data.label_code_source == "manual":
         final_label_code = weighing_data.label_code
         label_code_source = "manual"
+        if await db.labels.find_one({"label_code": final_label_code}, {"_id": 1}):
+            raise HTTPException(status_code=409, detail=f"Label code already in use: {final_label_code}")
     else:
         prefix = normalize_compound_name(compound["name"])
         final_label_code = f"{prefix}-{new_serial:04d}"
+        # a re-created compound starts its serial again; skip codes taken by the old one
+        while await db.labels.find_one({"label_code": final_label_code}, {"_id": 1}):
+            new_serial += 1
+            final_label_code = f"{prefix}-{new_serial:04d}"
         label_code_source = "auto"
 
+    usage_id = str(uuid.uuid4())
+    date_str = datetime.now(ISTANBUL_TZ).strftime("%Y-%m-%d")
+    # label codes are unique (scanners resolve by code): the label is inserted first and
+    # reserves its code, so a concurrent weighing that takes the same code fails before
+    # stock is touched
+    while True:
+        qr_parts = [
+            f"LBL|code={final_label_code}",
+            f"name={compound['name']}",
+            f"cas={compound['cas_number']}",
+            f"c={actual_concentration_ppm} ppm",
+            f"dt={date_str}",
+            f"by={weighing_data.prepared_by}"
+        ]
+        if weighing_data.mix_code and weighing_data.mix_code_show:
+            qr_parts.insert(1, f"mix={weighing_data.mix_code}")
+        qr_data = "|".join(qr_parts)
+
+        with phase("render"):
+            assets = label_assets.render_label_assets(qr_data, final_label_code)
+
+        label = Label(
+            compound_id=weighing_data.compound_id,
+            usage_id=usage_id,
+            label_code=final_label_code,
+            compound_name=compound["name"],
+            cas_number=compound["cas_number"],
+            concentration=f"{actual_concentration_ppm} ppm",
+            prepared_by=weighing_data.prepared_by,
+            date=date_str,
+            qr_data=qr_data,
+            assets=label_assets.asset_refs(assets)
+        )
+        try:
+            with phase("db"):
+                await db.labels.insert_one({**label.model_dump(), **await sync.stamp(db, label.created_at)})
+            break
+        except DuplicateKeyError:
+            if label_code_source == "manual":
+                raise HTTPException(status_code=409, detail=f"Label code already in use: {final_label_code}")
+            new_serial += 1
+            final_label_code = f"{prefix}-{new_serial:04d}"
+
+    with phase("db"):
+        now = now_istanbul()
+        # $inc, not a $set from the compound read above: concurrent weighings must each take their amount off
+        compound = await db.compounds.find_one_and_update(
+            {"id": weighing_data.compound_id},
+            {
+                "$inc": {"stock_value": -weighed_in_stock_unit},
+                "$max": {"last_serial": new_serial},
+                "$set": {"updated_at": now, **await sync.stamp(db, now)},
+            },
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        if not compound:  # deleted while the label was being written
+            await db.labels.delete_one({"id": label.id})
+            raise HTTPException(status_code=404, detail="Compound not found")
+        new_stock = round(compound["stock_value"], 6)
+        stock_update = canonical_stock(compound)
+        if stock_update:
+            await db.compounds.update_one({"id": weighing_data.compound_id}, {"$set": stock_update})
+
     usage = Usage(
+        id=usage_id,
         compound_id=weighing_data.compound_id,
         compound_name=compound["name"],
         cas_number=compound["cas_number"],
@@ -806,339 +1285,641 @@ async def create_weighing(weighing_data: WeighingInput, current_user: User = Dep
         remaining_stock=new_stock,
         remaining_stock_unit=compound["stock_unit"],
         prepared_by=weighing_data.prepared_by,
+        balance_id=weighing_data.balance_id,
         mix_code=weighing_data.mix_code,
         mix_code_show=weighing_data.mix_code_show,
         label_code_used=final_label_code,
         label_code_source=label_code_source
     )
-    await db.usages.insert_one(usage.model_dump())
+    with phase("db"):
+        await db.usages.insert_one(usage.model_dump())
+        await stock_ledger.record(
+            db, weighing_data.compound_id, "weighing", -weighed_in_stock_unit, compound["stock_unit"], usage.created_at,
+            user=current_user.username, usage_id=usage.id
+        )
+        await analytics.record_usage(db, usage.model_dump(), ISTANBUL_TZ)
+        await forecast.refresh(db, ISTANBUL_TZ, [weighing_data.compound_id])
+        await versions.bump(db, "compounds", "usages", "labels")
+    events.publish_local(
+        events.compound_event({**compound, **stock_update}),
+        events.usage_event(usage.model_dump()),
+        events.label_event(label.model_dump()),
+    )
+    # blobs are written after the response; readers re-render anything not stored yet
+    background_tasks.add_task(label_assets.store_blobs, db, assets)
+
+    with phase("audit"):
+        await db.audit_logs.insert_one({
+            "id": str(uuid.uuid4()),
+            "user": current_user.username,
+            "action": "create_weighing",
+            "compound_id": weighing_data.compound_id,
+            "usage_id": usage.id,
+            "label_code": final_label_code,
+            "timestamp": now_istanbul()
+        })
 
-    date_str = datetime.now(ISTANBUL_TZ).strftime("%Y-%m-%d")
-    qr_parts = [
-        f"LBL|code={final_label_code}",
-        f"name={compound['name']}",
-        f"cas={compound['cas_number']}",
-        f"c={actual_concentration_ppm} ppm",
-        f"dt={date_str}",
-        f"by={weighing_data.prepared_by}"
-    ]
-    if weighing_data.mix_code and weighing_data.mix_code_show:
-        qr_parts.insert(1, f"mix={weighing_data.mix_code}")
-    qr_data = "|".join(qr_parts)
+    return {
+        "usage": usage.model_dump(),
+        "label": label.model_dump(),
+        "qr_code": base64.b64encode(assets["qr_png"]).decode(),
+        "barcode": base64.b64encode(assets["barcode_png"]).decode(),
+    }
 
-    qr_base64 = generate_qr_code(qr_data)
-    barcode_base64 = generate_barcode(final_label_code)
+# ==== WEIGHING RECORDS ====
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    payload = orjson.dumps({"t": doc["created_at"], "id": doc["id"]})
+    return base64.urlsafe_b64encode(payload).decode()
 
-    label = Label(
-        compound_id=weighing_data.compound_id,
-        usage_id=usage.id,
-        label_code=final_label_code,
-        compound_name=compound["name"],
-        cas_number=compound["cas_number"],
-        concentration=f"{actual_concentration_ppm} ppm",
-        prepared_by=weighing_data.prepared_by,
-        date=date_str,
-        qr_data=qr_data
-    )
-    await db.labels.insert_one(label.model_dump())
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        payload = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(payload["t"]), payload["id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@api_router.get("/weighings")
+async def get_weighings(
+    compound_id: Optional[str] = None,
+    operator: Optional[str] = None,
+    mix_code: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    min_deviation: Optional[float] = None,
+    max_deviation: Optional[float] = None,
+    min_abs_deviation: Optional[float] = Query(default=None, ge=0),
+    search_query: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    current_user: User = Depends(get_current_user)
+):
+    """Newest-first usage history, keyset-paginated on (created_at, id)."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    # same filter as the Excel export, so the page and the exported rows agree
+    query = build_weighing_query(compound_id, search_query, date_from, date_to)
+    if operator:
+        query["prepared_by"] = operator
+    if mix_code:
+        query["mix_code"] = mix_code
+    deviation: Dict[str, Any] = {}
+    if min_deviation is not None:
+        deviation["$gte"] = min_deviation
+    if max_deviation is not None:
+        deviation["$lte"] = max_deviation
+    if deviation:
+        query["deviation"] = deviation
+    if min_abs_deviation is not None:
+        query.setdefault("$and", []).append(
+            {"$or": [{"deviation": {"$gte": min_abs_deviation}}, {"deviation": {"$lte": -min_abs_deviation}}]}
+        )
 
-    await db.audit_logs.insert_one({
-        "id": str(uuid.uuid4()),
-        "user": current_user.username,
-        "action": "create_weighing",
-        "compound_id": weighing_data.compound_id,
-        "usage_id": usage.id,
-        "label_code": final_label_code,
-        "timestamp": datetime.now(ISTANBUL_TZ).isoformat()
+    # the page is its own find so the (created_at, id) index drives the sort and the limit
+    page_query = query
+    if cursor:
+        after_t, after_id = decode_cursor(cursor)
+        page_query = {**query, "$and": query.get("$and", []) + [{"$or": [
+            {"created_at": {"$lt": after_t}},
+            {"created_at": after_t, "id": {"$lt": after_id}}
+        ]}]}
+
+    with phase("db"):
+        data = await db.usages.find(page_query, {"_id": 0}).sort([("created_at", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+        total = await db.usages.count_documents(query)
+    has_more = len(data) > limit
+    data = data[:limit]
+    return FastJSONResponse({
+        "data": data,
+        "total": total,
+        "limit": limit,
+        "next_cursor": encode_cursor(data[-1]) if has_more else None
     })
 
-    return {"usage": usage.model_dump(), "label": label.model_dump(), "qr_code": qr_base64, "barcode": barcode_base64}
-
 # ==== EXPORTS ====
+def build_label_query(compound_id: Optional[str], search_query: Optional[str], date_from: Optional[date], date_to: Optional[date]) -> Dict[str, Any]:
+    query: Dict[str, Any] = date_range_query(date_from, date_to)
+    if compound_id:
+        query["compound_id"] = compound_id
+    if search_query:
+        query["$or"] = [
+            {"compound_name": {"$regex": search_query, "$options": "i"}},
+            {"cas_number": {"$regex": search_query, "$options": "i"}}
+        ]
+    return query
+
+def parse_scan(raw: str) -> Optional[str]:
+    """Label code from a scanned Code128 value or an ``LBL|code=...|...`` QR payload."""
+    value = raw.strip()
+    if not value.startswith("LBL|"):
+        return value or None
+    for part in value.split("|")[1:]:
+        key, _, field = part.partition("=")
+        if key == "code":
+            return field.strip() or None
+    return None
+
+def stock_view(compound: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": compound["id"],
+        "name": compound.get("name"),
+        "cas_number": compound.get("cas_number"),
+        "stock_value": compound.get("stock_value"),
+        "stock_unit": compound.get("stock_unit"),
+        "critical_value": compound.get("critical_value"),
+        "critical_unit": compound.get("critical_unit"),
+        "stock_mg": compound.get("stock_mg"),
+        "stock_ratio": compound.get("stock_ratio"),
+        "is_critical": compound.get("is_critical", False),
+    }
+
+async def resolve_label_codes(codes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """label_code -> {label, usage, compound}; three indexed $in queries for any number of codes."""
+    wanted = list(set(codes))
+    with phase("db"):
+        labels = await db.labels.find({"label_code": {"$in": wanted}}, {"_id": 0, "assets": 0}).to_list(None)
+        usage_ids = list({l["usage_id"] for l in labels})
+        compound_ids = list({l["compound_id"] for l in labels})
+        usages = await db.usages.find({"id": {"$in": usage_ids}}, {"_id": 0}).to_list(None)
+        compounds = await db.compounds.find({"id": {"$in": compound_ids}}, {"_id": 0}).to_list(None)
+    usages_by_id = {u["id"]: u for u in usages}
+    compounds_by_id = {c["id"]: c for c in compounds}
+    resolved = {}
+    for label in labels:
+        compound = compounds_by_id.get(label["compound_id"])
+        resolved[label["label_code"]] = {
+            "label": label,
+            "usage": usages_by_id.get(label["usage_id"]),
+            "compound": stock_view(compound) if compound else None,
+        }
+    return resolved
+
+def build_weighing_query(compound_id: Optional[str], search_query: Optional[str], date_from: Optional[date], date_to: Optional[date]) -> Dict[str, Any]:
+    query: Dict[str, Any] = date_range_query(date_from, date_to)
+    if compound_id:
+        query["compound_id"] = compound_id
+    if search_query:
+        # substring match, so partial names and CAS numbers find their records
+        pattern = {"$regex": re.escape(search_query), "$options": "i"}
+        query["$or"] = [
+            {"compound_name": pattern},
+            {"cas_number": pattern},
+            {"prepared_by": pattern}
+        ]
+    return query
+
+def weighing_row(usage: Dict[str, Any]) -> List[Any]:
+    return [
+        format_date(usage.get("created_at")),
+        usage.get("compound_name",""),
+        usage.get("cas_number",""),
+        usage.get("weighed_amount",0),
+        usage.get("purity",0),
+        usage.get("target_concentration",0),
+        usage.get("required_volume",0),
+        usage.get("actual_concentration",0),
+        usage.get("deviation",0),
+        usage.get("temperature_c",0),
+        usage.get("solvent_density",0),
+        usage.get("prepared_by",""),
+        usage.get("mix_code",""),
+        usage.get("label_code_used","")
+    ]
+
+def export_query(kind: str, params: ExportParams) -> Tuple[Any, Dict[str, Any]]:
+    """Source collection and filter of an export kind."""
+    if kind == "weighings_xlsx":
+        return report_db().usages, build_weighing_query(params.compound_id, params.search_query, params.date_from, params.date_to)
+    return report_db().labels, build_label_query(params.compound_id, params.search_query, params.date_from, params.date_to)
+
+async def load_export(kind: str, params: ExportParams, limit: Optional[int]) -> Tuple:
+    """Fetch the documents of an export and return the arguments of its exports.py builder."""
+    collection, query = export_query(kind, params)
+    with phase("db"):
+        docs = await collection.find(query, {"_id": 0}).sort("created_at", -1).to_list(limit)
+    if kind == "weighings_xlsx":
+        return ([weighing_row(u) for u in docs],)
+    if kind == "labels_pdf":
+        with phase("db"):
+            qr_matrices = await label_assets.qr_matrices(db, docs)
+        return (docs, params.profile, params.copies, qr_matrices)
+    with phase("db"):
+        usage_ids = list({label["usage_id"] for label in docs})
+        usages = await report_db().usages.find({"id": {"$in": usage_ids}}, {"_id": 0}).to_list(None)
+    return (docs, {u["id"]: u for u in usages})
+
+async def export_fingerprint(kind: str, params: ExportParams) -> Dict[str, Any]:
+    """Cheap summary of the matched documents, so cached export files go stale when the data changes."""
+    collection, query = export_query(kind, params)
+    result = await collection.aggregate([
+        {"$match": query},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "latest": {"$max": "$created_at"}}},
+    ]).to_list(1)
+    if not result:
+        return {"count": 0, "latest": None}
+    return {"count": result[0]["count"], "latest": result[0]["latest"]}
+
+def export_filename(kind: str) -> str:
+    spec = EXPORT_KINDS[kind]
+    timestamp = datetime.now(ISTANBUL_TZ).strftime("%Y%m%d_%H%M")
+    return f"{spec.filename_prefix}_{timestamp}.{spec.extension}"
+
+def export_response(kind: str, content: bytes) -> StreamingResponse:
+    return StreamingResponse(BytesIO(content), media_type=EXPORT_KINDS[kind].media_type, headers={"Content-Disposition": f"attachment; filename={export_filename(kind)}"})
+
 @api_router.get("/weighings/export.xlsx")
-async def export_weighings_excel(compound_id: Optional[str] = None, search_query: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def export_weighings_excel(compound_id: Optional[str] = None, search_query: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, current_user: User = Depends(get_current_user)):
     try:
         if not db:
             raise HTTPException(status_code=500, detail="DB not configured")
-        query: Dict[str, Any] = {}
-        if compound_id:
-            query["compound_id"] = compound_id
-        if search_query:
-            query["$or"] = [
-                {"compound_name": {"$regex": search_query, "$options": "i"}},
-                {"cas_number": {"$regex": search_query, "$options": "i"}},
-                {"prepared_by": {"$regex": search_query, "$options": "i"}}
-            ]
-        usages = await db.usages.find(query, {"_id": 0}).sort("created_at", -1).to_list(None)
-
-        wb = Workbook()
-        wb.remove(wb.active)
-        HEADERS = ["Date","Compound","CAS Number","Weighed (mg)","Purity (%)","Target (ppm)","Req. Volume (mL)","Actual (ppm)","Deviation (%)","Temperature (°C)","Density (g/mL)","Prepared By","Mix Code","Label Code"]
-
-        if not usages:
-            ws = wb.create_sheet("Weighing Records")
-            ws.append(HEADERS)
-            for cell in ws[1]:
-                cell.font = Font(bold=True)
-                cell.alignment = Alignment(horizontal="center")
-            ws.append(["No weighing records found matching the criteria."])
-        else:
-            ws = wb.create_sheet("Weighing Records 1")
-            ws.append(HEADERS)
-            for cell in ws[1]:
-                cell.font = Font(bold=True)
-                cell.alignment = Alignment(horizontal="center")
-            for usage in usages:
-                ws.append([
-                    usage.get("created_at","")[:10] if usage.get("created_at") else "",
-                    usage.get("compound_name",""),
-                    usage.get("cas_number",""),
-                    usage.get("weighed_amount",0),
-                    usage.get("purity",0),
-                    usage.get("target_concentration",0),
-                    usage.get("required_volume",0),
-                    usage.get("actual_concentration",0),
-                    usage.get("deviation",0),
-                    usage.get("temperature_c",0),
-                    usage.get("solvent_density",0),
-                    usage.get("prepared_by",""),
-                    usage.get("mix_code",""),
-                    usage.get("label_code_used","")
-                ])
-
-        excel_buffer = BytesIO()
-        wb.save(excel_buffer)
-        excel_buffer.seek(0)
-
-        timestamp = datetime.now(ISTANBUL_TZ).strftime("%Y%m%d_%H%M")
-        filename = f"WeighingRecords_{timestamp}.xlsx"
-        return StreamingResponse(
-            excel_buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        params = ExportParams(compound_id=compound_id, search_query=search_query, date_from=date_from, date_to=date_to)
+        args = await load_export("weighings_xlsx", params, limit=None)
+        with phase("assemble"):
+            content = build_weighings_xlsx(*args)
+        return export_response("weighings_xlsx", content)
     except Exception as e:
         logger.error(f"Excel export error: {str(e)}")
         raise HTTPException(status_code=500, detail={"error": "export_xlsx_failed", "detail": str(e)})
 
 @api_router.get("/labels", response_model=List[Label])
-async def get_labels(current_user: User = Depends(get_current_user)):
+async def get_labels(request: Request, current_user: User = Depends(get_current_user)):
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
-    labels = await db.labels.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return [Label(**label_data) for label_data in labels]
-
-@api_router.get("/labels/{label_id}")
-async def get_label_with_codes(label_id: str, current_user: User = Depends(get_current_user)):
-    if not db:
-        raise HTTPException(status_code=500, detail="DB not configured")
-    label = await db.labels.find_one({"id": label_id}, {"_id": 0})
-    if not label:
-        raise HTTPException(status_code=404, detail="Label not found")
-    qr_base64 = generate_qr_code(label["qr_data"])
-    barcode_base64 = generate_barcode(label["label_code"])
-    return {"label": label, "qr_code": qr_base64, "barcode": barcode_base64}
+    cached = await not_modified(request, "labels", "labels")
+    if cached:
+        return cached
+    with phase("db"):
+        labels = await db.labels.find({}, projection_for(Label)).sort("created_at", -1).to_list(1000)
+    return trusted_list(Label, labels)
 
 @api_router.get("/labels/export.pdf")
-async def export_labels_pdf(compound_id: Optional[str] = None, search_query: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def export_labels_pdf(profile: Optional[str] = None, copies: int = Query(1, ge=1, le=100), compound_id: Optional[str] = None, search_query: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, current_user: User = Depends(get_current_user)):
+    if not get_sheet_profile(profile):
+        raise HTTPException(status_code=404, detail=f"Unknown sheet profile: {profile}")
     try:
         if not db:
             raise HTTPException(status_code=500, detail="DB not configured")
-        query: Dict[str, Any] = {}
-        if compound_id:
-            query["compound_id"] = compound_id
-        if search_query:
-            query["$or"] = [
-                {"compound_name": {"$regex": search_query, "$options": "i"}},
-                {"cas_number": {"$regex": search_query, "$options": "i"}}
-            ]
-        labels = await db.labels.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-
-        pdf_buffer = BytesIO()
-        if not labels:
-            c = canvas.Canvas(pdf_buffer, pagesize=A4)
-            c.setFont("Helvetica", 12)
-            c.drawString(100, 750, "No labels found matching the criteria.")
-            c.save()
-        else:
-            c = canvas.Canvas(pdf_buffer, pagesize=(70*mm, 25*mm))
-            for label in labels:
-                qr_base64 = generate_qr_code(label["qr_data"])
-                barcode_base64 = generate_barcode(label["label_code"])
-                qr_img = ImageReader(BytesIO(base64.b64decode(qr_base64)))
-                barcode_img = ImageReader(BytesIO(base64.b64decode(barcode_base64)))
-
-                c.setFont("Helvetica-Bold", 8)
-                c.drawString(5, 20*mm, label["compound_name"][:30])
-                c.setFont("Helvetica", 6)
-                c.drawString(5, 17*mm, f"CAS: {label['cas_number']} • Conc.: {label['concentration']}")
-                c.drawString(5, 14*mm, f"Date: {label['date']} • By: {label['prepared_by']}")
-                c.setFont("Helvetica-Bold", 7)
-                c.drawString(5, 3*mm, f"Code: {label['label_code']}")
-                c.drawImage(qr_img, 50*mm, 3*mm, width=12*mm, height=12*mm)
-                c.drawImage(barcode_img, 50*mm, 16*mm, width=18*mm, height=8*mm)
-                c.showPage()
-            c.save()
-
-        pdf_buffer.seek(0)
-        timestamp = datetime.now(ISTANBUL_TZ).strftime("%Y%m%d_%H%M")
-        filename = f"Labels_{timestamp}.pdf"
-        return StreamingResponse(pdf_buffer, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename={filename}"})
+        params = ExportParams(compound_id=compound_id, search_query=search_query, date_from=date_from, date_to=date_to, profile=profile, copies=copies)
+        args = await load_export("labels_pdf", params, limit=1000)
+        with phase("assemble"):
+            content = build_labels_pdf(*args)
+        return export_response("labels_pdf", content)
     except Exception as e:
         logger.error(f"PDF export error: {str(e)}")
         raise HTTPException(status_code=500, detail={"error": "export_labels_pdf_failed", "detail": str(e)})
 
 @api_router.get("/labels/export.docx")
-async def export_labels_docx(compound_id: Optional[str] = None, search_query: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def export_labels_docx(compound_id: Optional[str] = None, search_query: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, current_user: User = Depends(get_current_user)):
     try:
         if not db:
             raise HTTPException(status_code=500, detail="DB not configured")
-        query: Dict[str, Any] = {}
-        if compound_id:
-            query["compound_id"] = compound_id
-        if search_query:
-            query["$or"] = [
-                {"compound_name": {"$regex": search_query, "$options": "i"}},
-                {"cas_number": {"$regex": search_query, "$options": "i"}}
-            ]
-        labels = await db.labels.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-
-        doc = DocxDocument()
-        if not labels:
-            title = doc.add_heading("PestiLab – Weighing Labels", 0)
-            title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            doc.add_paragraph("No labels found matching the criteria.")
-        else:
-            for idx, label in enumerate(labels):
-                title = doc.add_heading("PestiLab – Weighing Label", 0)
-                title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                usage = await db.usages.find_one({"id": label["usage_id"]}, {"_id": 0})
-
-                doc.add_paragraph(f"Compound: {label['compound_name']}")
-                doc.add_paragraph(f"CAS Number: {label['cas_number']}")
-                doc.add_paragraph(f"Concentration: {label['concentration']}")
-                doc.add_paragraph(f"Label Code: {label['label_code']}")
-                if usage:
-                    doc.add_paragraph(f"Weighed Amount: {usage.get('weighed_amount', 0):.3f} mg")
-                    doc.add_paragraph(f"Purity: {usage.get('purity', 0):.1f}%")
-                    doc.add_paragraph(f"Required Volume: {usage.get('required_volume', 0):.3f} mL")
-                    doc.add_paragraph(f"Temperature: {usage.get('temperature_c', 0):.1f}°C")
-                    doc.add_paragraph(f"Solvent Density: {usage.get('solvent_density', 0):.4f} g/mL")
-                    if usage.get("mix_code"):
-                        doc.add_paragraph(f"Mix Code: {usage['mix_code']}")
-                doc.add_paragraph(f"Prepared By: {label['prepared_by']}")
-                doc.add_paragraph(f"Date: {label['date']}")
-                if idx < len(labels) - 1:
-                    doc.add_page_break()
-
-        docx_buffer = BytesIO()
-        doc.save(docx_buffer)
-        docx_buffer.seek(0)
-        timestamp = datetime.now(ISTANBUL_TZ).strftime("%Y%m%d_%H%M")
-        filename = f"Labels_{timestamp}.docx"
-        return StreamingResponse(
-            docx_buffer,
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        params = ExportParams(compound_id=compound_id, search_query=search_query, date_from=date_from, date_to=date_to)
+        args = await load_export("labels_docx", params, limit=1000)
+        with phase("assemble"):
+            content = build_labels_docx(*args)
+        return export_response("labels_docx", content)
     except Exception as e:
         logger.error(f"DOCX export error: {str(e)}")
         raise HTTPException(status_code=500, detail={"error": "export_labels_docx_failed", "detail": str(e)})
 
 @api_router.get("/labels/export-docx.zip")
-async def export_labels_docx_zip(compound_id: Optional[str] = None, search_query: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def export_labels_docx_zip(compound_id: Optional[str] = None, search_query: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, current_user: User = Depends(get_current_user)):
     try:
         if not db:
             raise HTTPException(status_code=500, detail="DB not configured")
-        query: Dict[str, Any] = {}
-        if compound_id:
-            query["compound_id"] = compound_id
-        if search_query:
-            query["$or"] = [
-                {"compound_name": {"$regex": search_query, "$options": "i"}},
-                {"cas_number": {"$regex": search_query, "$options": "i"}}
-            ]
-        labels = await db.labels.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            if not labels:
-                zip_file.writestr("no_labels_found.txt", "No labels found matching the criteria.")
-            else:
-                for label in labels:
-                    usage = await db.usages.find_one({"id": label["usage_id"]}, {"_id": 0})
-                    doc = DocxDocument()
-                    title = doc.add_heading("PestiLab – Weighing Label", 0)
-                    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    doc.add_paragraph(f"Compound: {label['compound_name']}")
-                    doc.add_paragraph(f"CAS Number: {label['cas_number']}")
-                    doc.add_paragraph(f"Concentration: {label['concentration']}")
-                    doc.add_paragraph(f"Label Code: {label['label_code']}")
-                    if usage:
-                        doc.add_paragraph(f"Weighed Amount: {usage.get('weighed_amount', 0):.3f} mg")
-                        doc.add_paragraph(f"Purity: {usage.get('purity', 0):.1f}%")
-                        if usage.get("mix_code"):
-                            doc.add_paragraph(f"Mix Code: {usage['mix_code']}")
-                    doc.add_paragraph(f"Prepared By: {label['prepared_by']}")
-                    doc.add_paragraph(f"Date: {label['date']}")
-                    doc_buffer = BytesIO()
-                    doc.save(doc_buffer)
-                    doc_buffer.seek(0)
-                    filename = f"Label_{label['label_code'].replace('/', '_')}.docx"
-                    zip_file.writestr(filename, doc_buffer.getvalue())
-
-        zip_buffer.seek(0)
-        timestamp = datetime.now(ISTANBUL_TZ).strftime("%Y%m%d_%H%M")
-        filename = f"Labels_{timestamp}.zip"
-        return StreamingResponse(zip_buffer, media_type="application/zip", headers={"Content-Disposition": f"attachment; filename={filename}"})
+        params = ExportParams(compound_id=compound_id, search_query=search_query, date_from=date_from, date_to=date_to)
+        args = await load_export("labels_docx_zip", params, limit=1000)
+        with phase("assemble"):
+            content = build_labels_docx_zip(*args)
+        return export_response("labels_docx_zip", content)
     except Exception as e:
         logger.error(f"DOCX ZIP export error: {str(e)}")
         raise HTTPException(status_code=500, detail={"error": "export_labels_docx_zip_failed", "detail": str(e)})
 
+@api_router.get("/label-profiles")
+async def get_label_profiles(current_user: User = Depends(get_current_user)):
+    return {
+        "default": DEFAULT_THERMAL_PROFILE_ID,
+        "thermal": [p.model_dump() for p in THERMAL_PROFILES.values()],
+        "default_sheet": DEFAULT_SHEET_PROFILE_ID,
+        "sheet": [p.model_dump() for p in SHEET_PROFILES.values()],
+    }
+
+@api_router.get("/labels/export.thermal")
+async def export_labels_thermal(profile: str = DEFAULT_THERMAL_PROFILE_ID, language: Optional[str] = None, copies: int = Query(default=1, ge=1, le=100), compound_id: Optional[str] = None, search_query: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, current_user: User = Depends(get_current_user)):
+    """ZPL/TSPL job with printer-native QR and Code128 commands; no images are rendered."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    label_profile = get_thermal_profile(profile)
+    if not label_profile:
+        raise HTTPException(status_code=404, detail=f"Unknown label profile: {profile}")
+    language = (language or label_profile.language).lower()
+    if language not in THERMAL_RENDERERS:
+        raise HTTPException(status_code=400, detail="language must be one of: zpl, tspl")
+    query = build_label_query(compound_id, search_query, date_from, date_to)
+    with phase("db"):
+        labels = await report_db().labels.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    if not labels:
+        raise HTTPException(status_code=404, detail="No labels found matching the criteria")
+    timestamp = datetime.now(ISTANBUL_TZ).strftime("%Y%m%d_%H%M")
+    extension = "zpl" if language == "zpl" else "prn"
+    return StreamingResponse(
+        (chunk.encode("utf-8") for chunk in THERMAL_RENDERERS[language](labels, label_profile, copies)),
+        media_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename=Labels_{timestamp}.{extension}"}
+    )
+
+@api_router.get("/labels/by-code/{code:path}")
+async def get_label_by_code(code: str, current_user: User = Depends(get_current_user)):
+    """A scanned label code or QR payload -> label, usage and current compound stock."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    label_code = parse_scan(code)
+    resolved = await resolve_label_codes([label_code]) if label_code else {}
+    if label_code not in resolved:
+        raise HTTPException(status_code=404, detail="Label not found")
+    return FastJSONResponse(resolved[label_code])
+
+@api_router.post("/labels/resolve")
+async def resolve_labels(request: LabelResolveRequest, current_user: User = Depends(get_current_user)):
+    """Batch scan lookup; results keep the order of the submitted codes."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    parsed = [parse_scan(raw) for raw in request.codes]
+    resolved = await resolve_label_codes([c for c in parsed if c])
+    results = []
+    for raw, label_code in zip(request.codes, parsed):
+        match = resolved.get(label_code) if label_code else None
+        results.append({"input": raw, "label_code": label_code, "found": match is not None, **(match or {})})
+    return FastJSONResponse({"results": results, "found": sum(r["found"] for r in results), "total": len(results)})
+
+# Declared after the /labels/export.* routes so it does not shadow them
+@api_router.get("/labels/{label_id}")
+async def get_label_with_codes(label_id: str, current_user: User = Depends(get_current_user)):
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    with phase("db"):
+        label = await db.labels.find_one({"id": label_id}, {"_id": 0})
+    if not label:
+        raise HTTPException(status_code=404, detail="Label not found")
+    with phase("render"):
+        assets = await label_assets.label_assets(db, label)
+    return {
+        "label": label,
+        "qr_code": base64.b64encode(assets["qr_png"]).decode(),
+        "barcode": base64.b64encode(assets["barcode_png"]).decode(),
+    }
+
+@api_router.get("/label-assets/{digest}")
+async def get_label_asset(digest: str, current_user: User = Depends(get_current_user)):
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    with phase("db"):
+        blob = await label_assets.get_blob(db, digest)
+    if not blob:
+        raise HTTPException(status_code=404, detail="Label asset not found")
+    # content-addressed: the bytes behind a digest never change
+    return Response(content=bytes(blob["data"]), media_type=blob["content_type"], headers={"Cache-Control": "private, max-age=31536000, immutable"})
+
+# ==== EXPORT JOBS ====
+async def get_export_job(job_id: str, user: User) -> Dict[str, Any]:
+    """A job of ``user``; someone else's job is reported as missing rather than forbidden."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    job = await db[export_jobs.JOBS_COLLECTION].find_one({"id": job_id, "created_by": user.username}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job
+
+@api_router.post("/exports", status_code=202)
+async def create_export_job(request: ExportJobCreate, current_user: User = Depends(get_current_user)):
+    """Queue an export; poll GET /exports/{id} or stream /exports/{id}/events, then download."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    if request.kind not in EXPORT_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of: {', '.join(EXPORT_KINDS)}")
+    if request.kind == "labels_pdf" and not get_sheet_profile(request.profile):
+        raise HTTPException(status_code=404, detail=f"Unknown sheet profile: {request.profile}")
+    params = ExportParams(**request.model_dump(exclude={"kind"}))
+    with phase("db"):
+        fingerprint = await export_fingerprint(request.kind, params)
+        job = await export_jobs.enqueue(
+            db, request.kind, params.model_dump(mode="json"), fingerprint, current_user.username, export_filename(request.kind),
+            load=lambda: load_export(request.kind, params, limit=None)
+        )
+    return FastJSONResponse(export_jobs.job_view(job), status_code=202)
+
+@api_router.get("/exports/{job_id}")
+async def get_export_job_status(job_id: str, current_user: User = Depends(get_current_user)):
+    return FastJSONResponse(export_jobs.job_view(await get_export_job(job_id, current_user)))
+
+@api_router.get("/exports/{job_id}/events")
+async def stream_export_job(job_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Server-sent events with the job state on every change, until it is done or failed."""
+    await get_export_job(job_id, current_user)
+
+    async def events():
+        last = None
+        while not await request.is_disconnected():
+            job = await db[export_jobs.JOBS_COLLECTION].find_one({"id": job_id}, {"_id": 0})
+            if not job:
+                yield "event: error\ndata: {\"detail\": \"Export job not found\"}\n\n"
+                return
+            view = export_jobs.job_view(job)
+            if view != last:
+                yield f"event: {job['status']}\ndata: {orjson.dumps(view).decode()}\n\n"
+                last = view
+            if job["status"] in ("done", "failed"):
+                return
+            await asyncio.sleep(export_jobs.PROGRESS_INTERVAL)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@api_router.get("/exports/{job_id}/download")
+async def download_export_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await get_export_job(job_id, current_user)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Export job is {job['status']}")
+    path = export_jobs.cache_path(job)
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Export file has expired; queue the export again")
+    return FileResponse(path, media_type=job["media_type"], filename=job["filename"])
+
+# ==== LIVE EVENTS ====
+@api_router.get("/events")
+async def stream_events(request: Request, topics: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Server-sent events: compound stock changes, new usages and new labels."""
+    wanted = {t.strip() for t in topics.split(",")} if topics else set(events.WATCHED)
+    unknown = wanted - set(events.WATCHED)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown topics: {', '.join(sorted(unknown))}")
+
+    async def stream():
+        queue = events.bus.subscribe()
+        try:
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=events.HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event["topic"] in wanted:
+                    yield f"event: {event['type']}\ndata: {orjson.dumps(event).decode()}\n\n"
+        finally:
+            events.bus.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ==== ANALYTICS ====
+def analytics_range(date_from: Optional[date], date_to: Optional[date]) -> Tuple[date, date]:
+    """Whole Istanbul days; defaults to the last 30 days."""
+    date_to = date_to or now_istanbul().date()
+    date_from = date_from or date_to - timedelta(days=29)
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="date_to must not be before date_from")
+    return date_from, date_to
+
+async def analytics_totals(dim: str, date_from: Optional[date], date_to: Optional[date], sort: str, limit: int) -> Response:
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    if sort not in analytics.SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(analytics.SORT_FIELDS)}")
+    date_from, date_to = analytics_range(date_from, date_to)
+    with phase("db"):
+        items = await analytics.totals(report_db(), dim, date_from, date_to, sort, limit)
+    return FastJSONResponse({"date_from": date_from.isoformat(), "date_to": date_to.isoformat(), "items": items})
+
+@api_router.get("/analytics/compounds")
+async def get_compound_analytics(date_from: Optional[date] = None, date_to: Optional[date] = None, sort: str = "weighed_mg", limit: int = Query(100, ge=1, le=1000), current_user: User = Depends(get_current_user)):
+    """Consumption per compound (key: compound id) from the daily rollups."""
+    return await analytics_totals("compound", date_from, date_to, sort, limit)
+
+@api_router.get("/analytics/operators")
+async def get_operator_analytics(date_from: Optional[date] = None, date_to: Optional[date] = None, sort: str = "count", limit: int = Query(100, ge=1, le=1000), current_user: User = Depends(get_current_user)):
+    """Throughput and deviation per operator (key: prepared_by) from the daily rollups."""
+    return await analytics_totals("operator", date_from, date_to, sort, limit)
+
+@api_router.get("/analytics/timeseries")
+async def get_analytics_timeseries(dimension: str = "compound", key: Optional[str] = None, granularity: str = "day", date_from: Optional[date] = None, date_to: Optional[date] = None, current_user: User = Depends(get_current_user)):
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    if dimension not in analytics.DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"dimension must be one of: {', '.join(analytics.DIMENSIONS)}")
+    if granularity not in ("day", "week", "month"):
+        raise HTTPException(status_code=400, detail="granularity must be one of: day, week, month")
+    date_from, date_to = analytics_range(date_from, date_to)
+    with phase("db"):
+        series = await analytics.timeseries(report_db(), dimension, key, date_from, date_to, granularity)
+    return FastJSONResponse({
+        "dimension": dimension, "key": key, "granularity": granularity,
+        "date_from": date_from.isoformat(), "date_to": date_to.isoformat(), "series": series,
+    })
+
+# ==== FORECAST ====
+@api_router.get("/forecast/reorder")
+async def get_reorder_list(horizon_days: int = Query(forecast.REORDER_HORIZON_DAYS, ge=0, le=365), limit: int = Query(100, ge=1, le=1000), current_user: User = Depends(get_current_user)):
+    """Compounds critical now or forecast to reach critical within ``horizon_days``, soonest first."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    with phase("db"):
+        items = await forecast.reorder_list(db, ISTANBUL_TZ, horizon_days, limit)
+    return FastJSONResponse({"horizon_days": horizon_days, "items": items})
+
+# ==== QC ====
+def qc_params(dimension: str, window: int, min_points: int) -> None:
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    if dimension not in qc.DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"dimension must be one of: {', '.join(qc.DIMENSIONS)}")
+    if min_points > window:
+        raise HTTPException(status_code=400, detail="min_points must not exceed window")
+
+@api_router.get("/qc/deviation")
+async def get_deviation_chart(key: str, dimension: str = "compound", window: int = Query(20, ge=2, le=1000), min_points: int = Query(10, ge=2, le=1000), date_from: Optional[date] = None, date_to: Optional[date] = None, violations_only: bool = False, current_user: User = Depends(get_current_user)):
+    """Deviation control chart for one compound id, operator or balance, with Westgard rule violations."""
+    qc_params(dimension, window, min_points)
+    date_from, date_to = analytics_range(date_from, date_to)
+    with phase("db"):
+        result = await qc.chart(report_db(), dimension, key, date_range_query(date_from, date_to)["created_at"], window, min_points, violations_only)
+    return FastJSONResponse({
+        "dimension": dimension, "key": key, "window": window, "min_points": min_points,
+        "date_from": date_from.isoformat(), "date_to": date_to.isoformat(), **result,
+    })
+
+@api_router.get("/qc/summary")
+async def get_qc_summary(dimension: str = "compound", window: int = Query(20, ge=2, le=1000), min_points: int = Query(10, ge=2, le=1000), date_from: Optional[date] = None, date_to: Optional[date] = None, limit: int = Query(100, ge=1, le=1000), current_user: User = Depends(get_current_user)):
+    """Violation counts for every compound, operator or balance; most rejects first."""
+    qc_params(dimension, window, min_points)
+    date_from, date_to = analytics_range(date_from, date_to)
+    with phase("db"):
+        items = await qc.summary(report_db(), dimension, date_range_query(date_from, date_to)["created_at"], window, min_points, limit)
+    return FastJSONResponse({
+        "dimension": dimension, "window": window, "min_points": min_points,
+        "date_from": date_from.isoformat(), "date_to": date_to.isoformat(), "items": items,
+    })
+
+# ==== SYNC ====
+@api_router.get("/sync")
+async def get_sync(since: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=5000), current_user: User = Depends(get_current_user)):
+    """Compounds, densities and labels changed or deleted after the ``since`` token; see sync.py."""
+    if not db:
+        raise HTTPException(status_code=500, detail="DB not configured")
+    with phase("db"):
+        result = await sync.changes(db, since, limit, now_istanbul())
+    return FastJSONResponse(result)
+
 # ==== DASHBOARD & SEARCH ====
 @api_router.get("/dashboard")
-async def get_dashboard(current_user: User = Depends(get_current_user)):
+async def get_dashboard(request: Request, current_user: User = Depends(get_current_user)):
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
-    all_compounds = await db.compounds.find({}, {"_id": 0}).to_list(10000)
-    critical_stocks = [c for c in all_compounds if c["stock_value"] <= c["critical_value"]]
-    recent_usages = await db.usages.find({}, {"_id": 0}).sort("created_at", -1).limit(10).to_list(10)
-    total_compounds = len(all_compounds)
-    total_usages = await db.usages.count_documents({})
-    total_labels = await db.labels.count_documents({})
-    return {
+    cached = await not_modified(request, "dashboard", "compounds", "usages", "labels")
+    if cached:
+        return cached
+    with phase("db"):
+        # most depleted first, straight off the (is_critical, stock_ratio) index
+        critical_stocks = await db.compounds.find({"is_critical": True}, {"_id": 0}).sort("stock_ratio", 1).to_list(10000)
+        total_compounds = await db.compounds.count_documents({})
+        recent_usages = await db.usages.find({}, {"_id": 0}).sort("created_at", -1).limit(10).to_list(10)
+        total_usages = await db.usages.count_documents({})
+        total_labels = await db.labels.count_documents({})
+        reorder = await forecast.reorder_list(db, ISTANBUL_TZ, limit=20)
+    return FastJSONResponse({
         "total_compounds": total_compounds,
         "total_usages": total_usages,
         "total_labels": total_labels,
         "critical_stocks": critical_stocks,
+        "reorder": reorder,
         "recent_usages": recent_usages
-    }
+    })
 
 @api_router.get("/search")
 async def search(q: str = Query(..., min_length=1), current_user: User = Depends(get_current_user)):
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
-    compounds = await db.compounds.find({
+    compounds = await report_db().compounds.find({
         "$or": [{"name": {"$regex": q, "$options": "i"}}, {"cas_number": {"$regex": q, "$options": "i"}}]
     }, {"_id": 0}).to_list(100)
-    usages = await db.usages.find({
+    usages = await report_db().usages.find({
         "$or": [{"compound_name": {"$regex": q, "$options": "i"}}, {"cas_number": {"$regex": q, "$options": "i"}}]
     }, {"_id": 0}).to_list(100)
-    return {"compounds": compounds, "usages": usages}
+    return FastJSONResponse({"compounds": compounds, "usages": usages})
 
 @api_router.get("/search/fuzzy")
 async def fuzzy_search(q: str = Query(..., min_length=1), limit: int = Query(default=20, le=100), current_user: User = Depends(get_current_user)):
     if not db:
         raise HTTPException(status_code=500, detail="DB not configured")
-    all_compounds = await db.compounds.find({}, {"_id": 0}).to_list(10000)
-    scored_compounds = []
-    for compound in all_compounds:
-        score = calculate_search_score(q, compound["name"], compound["cas_number"])
-        if score > 0:
-            compound["search_score"] = score
-            scored_compounds.append(compound)
-    scored_compounds.sort(key=lambda x: x["search_score"], reverse=True)
-    return {"query": q, "total_matches": len(scored_compounds), "compounds": scored_compounds[:limit]}
+    with phase("db"):
+        all_compounds = await report_db().compounds.find({}, {"_id": 0}).to_list(10000)
+    with phase("score"):
+        scored_compounds = []
+        for compound in all_compounds:
+            score = calculate_search_score(q, compound["name"], compound["cas_number"])
+            if score > 0:
+                compound["search_score"] = score
+                scored_compounds.append(compound)
+        scored_compounds.sort(key=lambda x: x["search_score"], reverse=True)
+    return FastJSONResponse({"query": q, "total_matches": len(scored_compounds), "compounds": scored_compounds[:limit]})
 
 # ==== ROUTER + CORS ====
 app.include_router(api_router)
@@ -1155,9 +1936,49 @@ app.add_middleware(
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+# ==== METRICS ====
+# Requests slower than this are logged with their phase breakdown (0 disables)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    timings = start_request()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        elapsed = record_request(request.method, route_path, status_code, timings)
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            logger.warning(f"Slow request {request.method} {route_path} {status_code} {elapsed * 1000:.1f}ms {timings.summary()}")
+
+@app.middleware("http")
+async def attach_etag(request: Request, call_next):
+    # handlers that called not_modified() leave their ETag in request.state
+    response = await call_next(request)
+    tag = getattr(request.state, "etag", None)
+    if tag and response.status_code == 200:
+        response.headers["ETag"] = tag
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# outermost, so it sees the ETag set above and the final body
+app.add_middleware(compression.CompressionMiddleware)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 # ==== LIFECYCLE ====
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await events.stop()
+    await forecast.stop()
+    export_jobs.shutdown()
+    passwords.shutdown()
     if client:
         client.close()
 
@@ -1166,22 +1987,25 @@ async def initialize_defaults():
     if not db:
         logger.warning("DB not configured; skipping defaults")
         return
+    await ensure_indexes()
+    events.start(db)
+    forecast.start(db, ISTANBUL_TZ)
     # admin
     admin_exists = await db.users.find_one({"username": "admin"})
     if not admin_exists:
-        hashed_password = bcrypt.hashpw("admin123".encode("utf-8"), bcrypt.gensalt())
+        hashed_password = await passwords.hash_password("admin123")
         admin_user = User(username="admin", email="admin@pestilab.com", role="admin")
         doc = admin_user.model_dump()
-        doc["password"] = hashed_password.decode("utf-8")
+        doc["password"] = hashed_password
         await db.users.insert_one(doc)
         logger.info("Admin user created: username=admin, password=admin123")
     # test user
     test_user_exists = await db.users.find_one({"username": "pestical"})
     if not test_user_exists:
-        hashed_password = bcrypt.hashpw("aceta135410207".encode("utf-8"), bcrypt.gensalt())
+        hashed_password = await passwords.hash_password("aceta135410207")
         test_user = User(username="pestical", email="pestical@pestilab.com", role="analyst")
         doc = test_user.model_dump()
-        doc["password"] = hashed_password.decode("utf-8")
+        doc["password"] = hashed_password
         await db.users.insert_one(doc)
         logger.info("Test user created: username=pestical, password=aceta135410207")
     # densities
@@ -1207,7 +2031,8 @@ async def initialize_defaults():
         ]
         for density_data in default_densities:
             density = SolventDensity(**density_data)
-            await db.solvent_densities.insert_one(density.model_dump())
+            await db.solvent_densities.insert_one({**density.model_dump(), **await sync.stamp(db, density.created_at)})
+        await versions.bump(db, "solvent_densities")
         logger.info(f"Initialized {len(default_densities)} default solvent density values")
 
 # ==== HEALTH (root + api) ====
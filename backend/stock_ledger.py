@@ -0,0 +1,240 @@
+"""Append-only stock movements with periodic per-compound snapshots.
+
+Every stock change is recorded in ``stock_movements``: the opening balance of a
+new compound, weighings, restocks and manual adjustments. Each movement has a
+per-compound sequence number (``compounds.ledger_seq``). After every
+SNAPSHOT_EVERY movements, ``stock_snapshots`` gets the running totals (balance,
+consumed, restocked) up to that movement.
+
+To get stock at a point in time, find the nearest snapshot at or before it
+(one indexed lookup), then add the at most SNAPSHOT_EVERY movements after
+that snapshot. Consumption over a period is the difference between the
+consumed totals at its two ends. Nothing scans ``usages``.
+
+A movement's seq is reserved before the movement is inserted, so a snapshot
+is only written once every movement in its range is there. If a lower seq is
+still missing after SNAPSHOT_WAIT_SECONDS, the snapshot is skipped and the next
+one covers both ranges.
+
+Deltas are in the compound's ``stock_unit`` at the time of the movement, and
+each movement stores that unit. A unit change closes the balance in the old
+unit and reopens it in the new one. Totals carry the unit of their last
+movement: when a movement comes in another unit, the running totals are
+converted to it first. Readers pass the compound's current unit and get the
+totals converted to it.
+
+Mass and volume amounts cannot be converted into each other. A change between
+them restarts the totals (``unit_break_seq``), history before it is reported
+in its own unit, and a consumption report across it is rejected.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from units import UnitError, convert, weighed_in_stock_unit
+
+MOVEMENTS_COLLECTION = "stock_movements"
+SNAPSHOTS_COLLECTION = "stock_snapshots"
+SNAPSHOT_EVERY = int(os.getenv("LEDGER_SNAPSHOT_EVERY", "100"))
+SNAPSHOT_WAIT_SECONDS = 1.0
+SNAPSHOT_POLL_SECONDS = 0.05
+KINDS = ("opening", "closing", "weighing", "restock", "adjustment")
+COUNTERS = ("balance", "consumed", "restocked")
+
+logger = logging.getLogger(__name__)
+
+def empty_totals() -> Dict[str, Any]:
+    return {"seq": 0, "created_at": None, "unit": None, "unit_break_seq": 0, "balance": 0.0, "consumed": 0.0, "restocked": 0.0}
+
+def apply(totals: Dict[str, Any], movement: Dict[str, Any]) -> Dict[str, Any]:
+    unit = movement.get("unit")
+    if unit and totals.get("unit") and unit != totals["unit"]:
+        try:
+            for field in COUNTERS:
+                totals[field] = round(convert(totals[field], totals["unit"], unit), 6)
+        except UnitError:
+            totals.update({field: 0.0 for field in COUNTERS}, unit_break_seq=movement["seq"])
+    if unit:
+        totals["unit"] = unit
+    delta = movement["delta"]
+    totals["balance"] = round(totals["balance"] + delta, 6)
+    if movement["kind"] == "weighing":
+        totals["consumed"] = round(totals["consumed"] - delta, 6)
+    elif movement["kind"] == "restock":
+        totals["restocked"] = round(totals["restocked"] + delta, 6)
+    totals["seq"] = movement["seq"]
+    totals["created_at"] = movement["created_at"]
+    return totals
+
+def movement_doc(compound_id: str, seq: int, kind: str, delta: float, unit: str, at: datetime,
+                 user: Optional[str] = None, usage_id: Optional[str] = None, note: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "id": str(uuid.uuid4()),
+        "compound_id": compound_id,
+        "seq": seq,
+        "kind": kind,
+        "delta": round(delta, 6),
+        "unit": unit,
+        "usage_id": usage_id,
+        "user": user,
+        "note": note,
+        "created_at": at,
+    }
+
+async def ensure_indexes(db):
+    await db[MOVEMENTS_COLLECTION].create_index([("compound_id", 1), ("seq", 1)], unique=True)
+    await db[MOVEMENTS_COLLECTION].create_index([("compound_id", 1), ("created_at", 1)])
+    await db[SNAPSHOTS_COLLECTION].create_index([("compound_id", 1), ("seq", 1)], unique=True)
+    await db[SNAPSHOTS_COLLECTION].create_index([("compound_id", 1), ("created_at", -1)])
+
+async def record(db, compound_id: str, kind: str, delta: float, unit: str, at: datetime,
+                 user: Optional[str] = None, usage_id: Optional[str] = None, note: Optional[str] = None) -> Dict[str, Any]:
+    """Append a movement; the caller has already applied it to compounds.stock_value."""
+    compound = await db.compounds.find_one_and_update(
+        {"id": compound_id}, {"$inc": {"ledger_seq": 1}},
+        projection={"ledger_seq": 1}, return_document=ReturnDocument.AFTER
+    )
+    if compound is None:
+        raise LookupError(f"Compound not found: {compound_id}")
+    movement = movement_doc(compound_id, compound["ledger_seq"], kind, delta, unit, at, user, usage_id, note)
+    await db[MOVEMENTS_COLLECTION].insert_one(dict(movement))
+    if movement["seq"] % SNAPSHOT_EVERY == 0:
+        await snapshot(db, compound_id, movement["seq"])
+    return movement
+
+async def snapshot(db, compound_id: str, seq: int) -> bool:
+    """Store the totals after movement ``seq``, built from the previous snapshot.
+
+    Returns False (and stores nothing) if a movement in the range is still missing.
+    """
+    previous = await db[SNAPSHOTS_COLLECTION].find_one(
+        {"compound_id": compound_id, "seq": {"$lt": seq}}, {"_id": 0}, sort=[("seq", -1)]
+    )
+    totals = previous or empty_totals()
+    query = {"compound_id": compound_id, "seq": {"$gt": totals["seq"], "$lte": seq}}
+    deadline = asyncio.get_running_loop().time() + SNAPSHOT_WAIT_SECONDS
+    while True:
+        movements = await db[MOVEMENTS_COLLECTION].find(query, {"_id": 0}).sort("seq", 1).to_list(None)
+        if len(movements) == seq - totals["seq"]:
+            break
+        # a concurrent writer holds a lower seq and has not inserted its movement yet
+        if asyncio.get_running_loop().time() >= deadline:
+            logger.warning(
+                f"Ledger snapshot {compound_id}@{seq} skipped: {seq - totals['seq'] - len(movements)} movements missing; "
+                "if this persists, run manage.py rebuild-stock-ledger"
+            )
+            return False
+        await asyncio.sleep(SNAPSHOT_POLL_SECONDS)
+    for movement in movements:
+        apply(totals, movement)
+    totals.pop("compound_id", None)
+    await db[SNAPSHOTS_COLLECTION].update_one(
+        {"compound_id": compound_id, "seq": seq}, {"$set": totals}, upsert=True
+    )
+    return True
+
+def in_unit(totals: Dict[str, Any], unit: Optional[str]) -> Dict[str, Any]:
+    """Totals converted to ``unit`` if they can be; otherwise left in their own unit."""
+    if not unit or totals.get("unit") in (None, unit):
+        return {**totals, "unit": totals.get("unit") or unit}
+    try:
+        converted = {field: round(convert(totals[field], totals["unit"], unit), 6) for field in COUNTERS}
+    except UnitError:
+        return totals
+    return {**totals, **converted, "unit": unit}
+
+async def totals_at(db, compound_id: str, at: datetime, inclusive: bool = True, unit: Optional[str] = None) -> Dict[str, Any]:
+    """Balance, consumed and restocked totals as of ``at``, in ``unit`` where it can be converted to."""
+    bound = "$lte" if inclusive else "$lt"
+    base = await db[SNAPSHOTS_COLLECTION].find_one(
+        {"compound_id": compound_id, "created_at": {bound: at}}, {"_id": 0},
+        sort=[("created_at", -1), ("seq", -1)]
+    )
+    totals = base or empty_totals()
+    window: Dict[str, Any] = {bound: at}
+    if base:
+        window["$gte"] = base["created_at"]
+    cursor = db[MOVEMENTS_COLLECTION].find(
+        {"compound_id": compound_id, "created_at": window, "seq": {"$gt": totals["seq"]}}, {"_id": 0}
+    ).sort("seq", 1)
+    async for movement in cursor:
+        apply(totals, movement)
+    totals.pop("compound_id", None)
+    return in_unit(totals, unit)
+
+async def consumption(db, compound_id: str, start: datetime, end: datetime, unit: Optional[str] = None) -> Dict[str, Any]:
+    """Movements in [start, end): opening/closing balance and what was consumed and restocked.
+
+    Raises UnitError if the stock changed between mass and volume units in the period.
+    """
+    opening = await totals_at(db, compound_id, start, inclusive=False)
+    closing = await totals_at(db, compound_id, end, inclusive=False)
+    if closing["unit_break_seq"] > opening["seq"]:
+        raise UnitError("The period spans a change between mass and volume stock units")
+    closing = in_unit(closing, unit)
+    opening = in_unit(opening, closing["unit"])
+    return {
+        "unit": closing["unit"],
+        "opening_balance": opening["balance"],
+        "closing_balance": closing["balance"],
+        "consumed": round(closing["consumed"] - opening["consumed"], 6),
+        "restocked": round(closing["restocked"] - opening["restocked"], 6),
+        "net_change": round(closing["balance"] - opening["balance"], 6),
+    }
+
+def movements_from_usages(compound: Dict[str, Any], usages: List[Dict[str, Any]], unit: str) -> List[Dict[str, Any]]:
+    """Reconstruct a compound's ledger from its usages (oldest first).
+
+    Usages record the stock left after them. A gap between one usage's
+    remaining stock and the next one's opening stock is a change nobody
+    recorded, so it becomes an inferred adjustment.
+    """
+    movements: List[Dict[str, Any]] = []
+
+    def add(kind, delta, at, usage_id=None, note=None):
+        movements.append(movement_doc(compound["id"], len(movements) + 1, kind, delta, unit, at, usage_id=usage_id, note=note))
+
+    balance = None
+    for usage in usages:
+        weighed = weighed_in_stock_unit(usage["weighed_amount"], unit)
+        remaining = usage["remaining_stock"]
+        if usage.get("remaining_stock_unit", unit) != unit:
+            try:
+                remaining = convert(remaining, usage["remaining_stock_unit"], unit)
+            except UnitError:
+                pass  # the gap to the next usage becomes an inferred adjustment
+        before = remaining + weighed
+        if balance is None:
+            add("opening", before, min(compound.get("created_at") or usage["created_at"], usage["created_at"]))
+        elif abs(before - balance) > 1e-6:
+            add("adjustment", before - balance, usage["created_at"], note="inferred by ledger rebuild")
+        add("weighing", -weighed, usage["created_at"], usage_id=usage["id"])
+        balance = remaining
+    if balance is None:
+        add("opening", compound["stock_value"], compound.get("created_at"))
+    elif abs(compound["stock_value"] - balance) > 1e-6:
+        at = max(compound.get("updated_at") or movements[-1]["created_at"], movements[-1]["created_at"])
+        add("adjustment", compound["stock_value"] - balance, at, note="inferred by ledger rebuild")
+    return movements
+
+async def rebuild(db, compound: Dict[str, Any], dry_run: bool = False) -> int:
+    """Replace a compound's ledger and snapshots with one rebuilt from its usages."""
+    usages = await db.usages.find(
+        {"compound_id": compound["id"]}, {"_id": 0, "id": 1, "weighed_amount": 1, "remaining_stock": 1, "remaining_stock_unit": 1, "created_at": 1}
+    ).sort([("created_at", 1), ("id", 1)]).to_list(None)
+    movements = movements_from_usages(compound, usages, compound.get("stock_unit", "mg"))
+    if dry_run:
+        return len(movements)
+    await db[MOVEMENTS_COLLECTION].delete_many({"compound_id": compound["id"]})
+    await db[SNAPSHOTS_COLLECTION].delete_many({"compound_id": compound["id"]})
+    if movements:
+        await db[MOVEMENTS_COLLECTION].insert_many([dict(m) for m in movements])
+    await db.compounds.update_one({"id": compound["id"]}, {"$set": {"ledger_seq": len(movements)}})
+    for seq in range(SNAPSHOT_EVERY, len(movements) + 1, SNAPSHOT_EVERY):
+        await snapshot(db, compound["id"], seq)
+    return len(movements)
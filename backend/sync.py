@@ -0,0 +1,127 @@
+"""Delta sync for weighing stations.
+
+Every write to a synced collection (compounds, solvent_densities, labels)
+stamps the document with ``sync_seq``, taken from one global counter, and
+``sync_at``. A delete leaves a tombstone in ``sync_tombstones`` stamped the
+same way. A station keeps the highest token it has seen and asks for
+everything after it:
+
+    GET /sync?since=<token>   changed documents and tombstones with sync_seq > token, oldest first
+
+A sequence number is reserved before the write it stamps lands, so a write
+holding seq 5 can commit after one holding seq 6. The token handed back
+therefore stops just before the first change younger than SYNC_SETTLE_SECONDS,
+even if later changes in the page have settled. Those changes are still sent
+and come round again, which is harmless because stations upsert by id, and a
+late commit is never skipped. A page whose first change is unsettled returns
+the ``since`` token unchanged with ``has_more`` false, so the station backs
+off until its next poll.
+
+Tombstones are kept for SYNC_TOMBSTONE_DAYS. A token older than the newest
+pruned tombstone gets ``reset: true`` and the station has to reload everything
+(``since=0``).
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+STATE_COLLECTION = "sync_state"
+TOMBSTONES_COLLECTION = "sync_tombstones"
+COLLECTIONS = ("compounds", "solvent_densities", "labels")
+SYNC_SETTLE_SECONDS = float(os.getenv("SYNC_SETTLE_SECONDS", "5"))
+SYNC_TOMBSTONE_DAYS = int(os.getenv("SYNC_TOMBSTONE_DAYS", "90"))
+BATCH_SIZE = 1000
+# server-side fields stations have no use for; forecasts change on every refresh pass
+EXCLUDED_FIELDS = {"compounds": ("forecast", "ledger_seq"), "labels": ("assets",)}
+
+async def ensure_indexes(db):
+    for name in COLLECTIONS:
+        await db[name].create_index("sync_seq", sparse=True)
+    await db[TOMBSTONES_COLLECTION].create_index("sync_seq")
+    await db[TOMBSTONES_COLLECTION].create_index("deleted_at")
+
+async def reserve(db, count: int = 1) -> int:
+    """Reserve ``count`` consecutive sequence numbers; returns the first."""
+    state = await db[STATE_COLLECTION].find_one_and_update(
+        {"_id": "seq"}, {"$inc": {"value": count}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return state["value"] - count + 1
+
+async def stamp(db, now: datetime) -> Dict[str, Any]:
+    """Fields to ``$set`` on a document being written."""
+    return {"sync_seq": await reserve(db), "sync_at": now}
+
+async def stamp_many(db, count: int, now: datetime) -> List[Dict[str, Any]]:
+    first = await reserve(db, count) if count else 0
+    return [{"sync_seq": first + i, "sync_at": now} for i in range(count)]
+
+async def tombstone(db, collection: str, ids: Iterable[str], now: datetime):
+    """Record deletes, then prune tombstones past retention."""
+    ids = list(ids)
+    if ids:
+        stamps = await stamp_many(db, len(ids), now)
+        await db[TOMBSTONES_COLLECTION].insert_many([
+            {"collection": collection, "id": doc_id, "sync_seq": s["sync_seq"], "deleted_at": s["sync_at"]}
+            for doc_id, s in zip(ids, stamps)
+        ])
+    cutoff = now - timedelta(days=SYNC_TOMBSTONE_DAYS)
+    newest_expired = await db[TOMBSTONES_COLLECTION].find_one(
+        {"deleted_at": {"$lt": cutoff}}, {"sync_seq": 1}, sort=[("sync_seq", -1)]
+    )
+    if newest_expired:
+        await db[STATE_COLLECTION].update_one(
+            {"_id": "pruned"}, {"$max": {"value": newest_expired["sync_seq"]}}, upsert=True
+        )
+        await db[TOMBSTONES_COLLECTION].delete_many({"sync_seq": {"$lte": newest_expired["sync_seq"]}})
+
+async def changes(db, since: int, limit: int, now: datetime) -> Dict[str, Any]:
+    """Up to ``limit`` changes after ``since`` across every synced collection, in sequence order."""
+    pruned = await db[STATE_COLLECTION].find_one({"_id": "pruned"})
+    if since and pruned and since < pruned["value"]:
+        return {"reset": True, "token": 0, "has_more": True, "changes": {}, "deleted": {}}
+
+    # the limit+1 lowest seqs per source are enough to pick the limit+1 lowest overall
+    found: List[Tuple[int, str, Dict[str, Any]]] = []
+    for name in COLLECTIONS:
+        projection = {"_id": 0, **{field: 0 for field in EXCLUDED_FIELDS.get(name, ())}}
+        cursor = db[name].find({"sync_seq": {"$gt": since}}, projection).sort("sync_seq", 1).limit(limit + 1)
+        found.extend([(doc["sync_seq"], name, doc) async for doc in cursor])
+    cursor = db[TOMBSTONES_COLLECTION].find({"sync_seq": {"$gt": since}}, {"_id": 0}).sort("sync_seq", 1).limit(limit + 1)
+    found.extend([(doc["sync_seq"], TOMBSTONES_COLLECTION, doc) async for doc in cursor])
+    found.sort(key=lambda item: item[0])
+    has_more = len(found) > limit
+    found = found[:limit]
+
+    settled = now - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    token = since
+    waiting = False  # the token reached an unsettled change and stays before it
+    result: Dict[str, List[Dict[str, Any]]] = {name: [] for name in COLLECTIONS}
+    deleted: Dict[str, List[str]] = {name: [] for name in COLLECTIONS}
+    for seq, name, doc in found:
+        if name == TOMBSTONES_COLLECTION:
+            deleted[doc["collection"]].append(doc["id"])
+            written = doc["deleted_at"]
+        else:
+            result[name].append(doc)
+            written = doc.get("sync_at")
+        # a lower seq may still be missing below an unsettled one, so the token stops at the first
+        waiting = waiting or (written is not None and written > settled)
+        if not waiting:
+            token = seq
+    # while waiting, has_more is false: the station polls again later instead of straight away
+    return {"reset": False, "token": token, "has_more": has_more and not waiting, "changes": result, "deleted": deleted}
+
+async def backfill(db, now: datetime, dry_run: bool = False) -> Dict[str, int]:
+    """Stamp documents written before sync existed, so a full sync includes them."""
+    report = {}
+    for name in COLLECTIONS:
+        ids = [doc["id"] async for doc in db[name].find({"sync_seq": {"$exists": False}}, {"_id": 0, "id": 1})]
+        report[name] = len(ids)
+        if dry_run or not ids:
+            continue
+        ops = [UpdateOne({"id": doc_id}, {"$set": fields}) for doc_id, fields in zip(ids, await stamp_many(db, len(ids), now))]
+        for i in range(0, len(ops), BATCH_SIZE):
+            await db[name].bulk_write(ops[i:i + BATCH_SIZE], ordered=False)
+    return report
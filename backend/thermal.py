@@ -0,0 +1,162 @@
+"""Native ZPL / TSPL output for thermal label printers.
+
+The printer draws the QR code and Code128 barcode itself, so a label job is a
+short text stream and the server renders no images. Geometry follows the label
+profile: the layout of frontend/src/labels/LabelCard.jsx (three text lines, QR
+and barcode row, code line) scaled to the profile's printable area in dots.
+"""
+from typing import Dict, Iterator, List, NamedTuple
+
+from label_profiles import LabelProfile
+
+# QR byte-mode capacity at error correction level M, versions 1..40
+QR_CAPACITY_M = [
+    14, 26, 42, 62, 84, 106, 122, 152, 180, 213, 251, 287, 331, 362, 412, 450, 504, 560, 624, 666,
+    711, 779, 857, 911, 997, 1059, 1125, 1190, 1264, 1370, 1452, 1538, 1628, 1722, 1809, 1911, 1989, 2099, 2213, 2331,
+]
+
+# TSPL built-in bitmap fonts: name -> (width, height) in dots
+TSPL_FONTS = [("5", 32, 48), ("4", 24, 32), ("3", 16, 24), ("2", 12, 20), ("1", 8, 12)]
+
+def qr_modules(data: str) -> int:
+    size = len(data.encode("utf-8"))
+    for version, capacity in enumerate(QR_CAPACITY_M, start=1):
+        if size <= capacity:
+            return 17 + 4 * version
+    return 177
+
+def code128_modules(code: str) -> int:
+    # start + data + checksum symbols of 11 modules each, plus the 13-module stop
+    return (len(code) + 2) * 11 + 13
+
+class ThermalLayout(NamedTuple):
+    left: int
+    width: int
+    name_y: int
+    name_h: int
+    line2_y: int
+    line3_y: int
+    line_h: int
+    row_y: int
+    qr_magnification: int
+    barcode_x: int
+    barcode_height: int
+    barcode_module: int
+    code_y: int
+    code_h: int
+
+def compute_layout(profile: LabelProfile, labels: List[Dict]) -> ThermalLayout:
+    d = profile.dots
+    left, top = d(profile.margin.left), d(profile.margin.top)
+    width = d(profile.width - profile.margin.left - profile.margin.right)
+    height = d(profile.height - profile.margin.top - profile.margin.bottom)
+    gap = max(1, d(0.5))
+    name_h, line_h, code_h = d(3.3), d(2.7), d(2.4)
+
+    line2_y = top + name_h + gap
+    line3_y = line2_y + line_h + gap
+    row_y = line3_y + line_h + gap
+    code_y = top + height - code_h
+    row_h = max(1, code_y - gap - row_y)
+
+    modules = max((qr_modules(l.get("qr_data", "")) for l in labels), default=21)
+    qr_dots = min(d(profile.qr_size), row_h, width // 2)
+    qr_magnification = max(1, min(10, qr_dots // modules))
+
+    barcode_x = left + qr_magnification * modules + d(2)
+    longest_code = max((code128_modules(l.get("label_code", "")) for l in labels), default=90)
+    barcode_module = max(1, min(10, (left + width - barcode_x) // longest_code))
+    barcode_height = max(1, min(d(profile.barcode_height), row_h))
+
+    return ThermalLayout(
+        left=left, width=width, name_y=top, name_h=name_h, line2_y=line2_y, line3_y=line3_y, line_h=line_h,
+        row_y=row_y, qr_magnification=qr_magnification, barcode_x=barcode_x, barcode_height=barcode_height,
+        barcode_module=barcode_module, code_y=code_y, code_h=code_h,
+    )
+
+def label_lines(label: Dict) -> Dict[str, str]:
+    return {
+        "name": label.get("compound_name", ""),
+        "line2": f"CAS: {label.get('cas_number', '-')} • Conc.: {label.get('concentration', '-')}",
+        "line3": f"Date: {label.get('date', '-')} • By: {label.get('prepared_by', '-')}",
+        "code": f"Code: {label.get('label_code', '')}",
+    }
+
+# ==== ZPL ====
+def zpl_text(value: str) -> str:
+    # ^ and ~ start ZPL commands; they never occur in lab data, so drop them
+    return str(value).replace("^", " ").replace("~", " ")
+
+def render_zpl(labels: List[Dict], profile: LabelProfile, copies: int = 1) -> Iterator[str]:
+    """Store the layout once as a format (^DF) and recall it per label (^XF)."""
+    lay = compute_layout(profile, labels)
+    fmt = "R:PESTILAB.ZPL"
+
+    def text_field(n: int, y: int, h: int) -> str:
+        return f"^FO{lay.left},{y}^A0N,{h},{h}^FB{lay.width},1,0,L^FN{n}^FS"
+
+    yield (
+        f"^XA^DF{fmt}^FS^CI28^PW{profile.dots(profile.width)}^LL{profile.dots(profile.height)}^LH0,0"
+        + text_field(1, lay.name_y, lay.name_h)
+        + text_field(2, lay.line2_y, lay.line_h)
+        + text_field(3, lay.line3_y, lay.line_h)
+        + f"^FO{lay.left},{lay.row_y}^BQN,2,{lay.qr_magnification}^FN4^FS"
+        + f"^FO{lay.barcode_x},{lay.row_y}^BY{lay.barcode_module},3,{lay.barcode_height}"
+        + f"^BCN,{lay.barcode_height},N,N,N^FN5^FS"
+        + text_field(6, lay.code_y, lay.code_h)
+        + "^XZ\n"
+    )
+    for label in labels:
+        lines = label_lines(label)
+        yield (
+            f"^XA^XF{fmt}^FS^CI28"
+            f"^FN1^FD{zpl_text(lines['name'])}^FS"
+            f"^FN2^FD{zpl_text(lines['line2'])}^FS"
+            f"^FN3^FD{zpl_text(lines['line3'])}^FS"
+            f"^FN4^FDMA,{zpl_text(label.get('qr_data', ''))}^FS"
+            f"^FN5^FD{zpl_text(label.get('label_code', ''))}^FS"
+            f"^FN6^FD{zpl_text(lines['code'])}^FS"
+            f"^PQ{copies}^XZ\n"
+        )
+
+# ==== TSPL ====
+def tspl_text(value: str) -> str:
+    return str(value).replace('"', '\\["]')
+
+def tspl_font(height: int):
+    for name, w, h in TSPL_FONTS:
+        if h <= height:
+            return name, w
+    name, w, _ = TSPL_FONTS[-1]
+    return name, w
+
+def render_tspl(labels: List[Dict], profile: LabelProfile, copies: int = 1) -> Iterator[str]:
+    lay = compute_layout(profile, labels)
+    name_font, name_w = tspl_font(lay.name_h)
+    line_font, line_w = tspl_font(lay.line_h)
+    code_font, code_w = tspl_font(lay.code_h)
+
+    def text(y: int, font: str, char_w: int, value: str) -> str:
+        return f'TEXT {lay.left},{y},"{font}",0,1,1,"{tspl_text(value[:max(1, lay.width // char_w)])}"\n'
+
+    yield (
+        f"SIZE {profile.width:g} mm,{profile.height:g} mm\n"
+        f"GAP {profile.gap:g} mm,0 mm\n"
+        "DIRECTION 1\n"
+        "CODEPAGE UTF-8\n"
+    )
+    for label in labels:
+        lines = label_lines(label)
+        yield (
+            "CLS\n"
+            + text(lay.name_y, name_font, name_w, lines["name"])
+            + text(lay.line2_y, line_font, line_w, lines["line2"])
+            + text(lay.line3_y, line_font, line_w, lines["line3"])
+            + f'QRCODE {lay.left},{lay.row_y},M,{lay.qr_magnification},A,0,"{tspl_text(label.get("qr_data", ""))}"\n'
+            + f'BARCODE {lay.barcode_x},{lay.row_y},"128",{lay.barcode_height},0,0,{lay.barcode_module},{lay.barcode_module},'
+            + f'"{tspl_text(label.get("label_code", ""))}"\n'
+            + text(lay.code_y, code_font, code_w, lines["code"])
+            + f"PRINT 1,{copies}\n"
+        )
+
+RENDERERS = {"zpl": render_zpl, "tspl": render_tspl}
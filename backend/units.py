@@ -0,0 +1,90 @@
+"""Stock unit conversion and the canonical stock fields stored on compounds.
+
+Compounds keep the value/unit pairs users enter (``stock_value``/``stock_unit``,
+``critical_value``/``critical_unit``). Next to them every write stores:
+
+    stock_mg, critical_mg   the same amounts in mg (None for volume units)
+    stock_ratio             stock / critical level in a common unit
+    is_critical             stock <= critical level
+
+so "below critical" is an indexed query instead of a per-document comparison
+in Python. Volume stocks (mL) cannot be turned into mg without a density, so
+they are compared in mL; a mass stock with a volume critical level (or the
+other way round) cannot be compared at all and is rejected.
+"""
+from typing import Any, Dict, Optional, Tuple
+
+MASS_UNITS = {"µg": 0.001, "mg": 1.0, "g": 1000.0, "kg": 1_000_000.0}  # -> mg
+VOLUME_UNITS = {"µL": 0.001, "mL": 1.0, "L": 1000.0}  # -> mL
+ALIASES = {
+    "ug": "µg", "μg": "µg", "mcg": "µg", "µg": "µg", "mg": "mg", "g": "g", "kg": "kg",
+    "ul": "µL", "μl": "µL", "µl": "µL", "ml": "mL", "l": "L",
+}
+
+class UnitError(ValueError):
+    pass
+
+def normalize_unit(unit: Optional[str]) -> str:
+    name = (unit or "").strip()
+    if name in MASS_UNITS or name in VOLUME_UNITS:
+        return name
+    if name.lower() in ALIASES:
+        return ALIASES[name.lower()]
+    raise UnitError(f"Unknown unit: {unit!r}")
+
+def to_base(value: float, unit: str) -> Tuple[float, str]:
+    """(amount in mg or mL, "mass" or "volume")."""
+    name = normalize_unit(unit)
+    if name in MASS_UNITS:
+        return value * MASS_UNITS[name], "mass"
+    return value * VOLUME_UNITS[name], "volume"
+
+def to_mg(value: float, unit: str) -> float:
+    amount, dimension = to_base(value, unit)
+    if dimension != "mass":
+        raise UnitError(f"{unit} is not a mass unit")
+    return amount
+
+def from_mg(mg: float, unit: str) -> float:
+    name = normalize_unit(unit)
+    if name not in MASS_UNITS:
+        raise UnitError(f"{unit} is not a mass unit")
+    return mg / MASS_UNITS[name]
+
+def convert(value: float, from_unit: str, to_unit: str) -> float:
+    """An amount in another unit of the same kind; raises UnitError between mass and volume."""
+    amount, dimension = to_base(value, from_unit)
+    per_unit, target_dimension = to_base(1.0, to_unit)
+    if dimension != target_dimension:
+        raise UnitError(f"{from_unit} cannot be converted to {to_unit}")
+    return amount / per_unit
+
+def weighed_in_stock_unit(weighed_mg: float, stock_unit: str) -> float:
+    """A weighed amount (mg) in the compound's stock unit; volume stocks take the mg figure unconverted."""
+    return from_mg(weighed_mg, stock_unit) if is_mass(stock_unit) else weighed_mg
+
+def is_mass(unit: str) -> bool:
+    try:
+        return normalize_unit(unit) in MASS_UNITS
+    except UnitError:
+        return False
+
+def stock_fields(stock_value: float, stock_unit: str, critical_value: float, critical_unit: str) -> Dict[str, Any]:
+    """Canonical fields for a compound; raises UnitError for unknown or incomparable units."""
+    stock, stock_dimension = to_base(stock_value, stock_unit)
+    critical, critical_dimension = to_base(critical_value, critical_unit)
+    if stock_dimension != critical_dimension:
+        raise UnitError(f"Stock in {stock_unit} cannot be compared with a critical level in {critical_unit}")
+    mass = stock_dimension == "mass"
+    return {
+        "stock_mg": round(stock, 6) if mass else None,
+        "critical_mg": round(critical, 6) if mass else None,
+        "stock_ratio": round(stock / critical, 6) if critical > 0 else None,
+        "is_critical": stock <= critical,
+    }
+
+def compound_stock_fields(compound: Dict[str, Any]) -> Dict[str, Any]:
+    return stock_fields(
+        compound["stock_value"], compound.get("stock_unit", "mg"),
+        compound.get("critical_value", 100.0), compound.get("critical_unit", "mg"),
+    )
@@ -0,0 +1,30 @@
+"""Per-collection version counters for ETags and conditional GETs.
+
+Every write endpoint bumps the counters of the collections it changed; read
+endpoints derive a strong ETag from the counters they depend on and answer
+``If-None-Match`` with 304 before touching the data. The counters live in
+``collection_versions`` rather than process memory so that every API worker
+sees every write.
+"""
+from typing import Dict, Iterable, Optional
+
+VERSIONS_COLLECTION = "collection_versions"
+
+async def bump(db, *collections: str):
+    for name in collections:
+        await db[VERSIONS_COLLECTION].update_one({"_id": name}, {"$inc": {"v": 1}}, upsert=True)
+
+async def current(db, collections: Iterable[str]) -> Dict[str, int]:
+    names = list(collections)
+    found = {doc["_id"]: doc["v"] async for doc in db[VERSIONS_COLLECTION].find({"_id": {"$in": names}})}
+    return {name: found.get(name, 0) for name in names}
+
+async def etag(db, resource: str, collections: Iterable[str]) -> str:
+    versions = await current(db, collections)
+    return '"' + "-".join([resource] + [f"{name}.{v}" for name, v in versions.items()]) + '"'
+
+def matches(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or tag in candidates or f"W/{tag}" in candidates
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { Button } from '@/components/ui/button';
@@ -11,76 +11,84 @@ import { toast } from 'sonner';
 import { toFixedSafe, pctSafe } from '@/utils/number';
 import ReprintMenu from '@/components/ReprintMenu';
 
+const PAGE_SIZE = 100;
+
 export default function RecordsPage() {
   const [usages, setUsages] = useState([]);
+  const [usagesTotal, setUsagesTotal] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [labels, setLabels] = useState([]);
   const [compounds, setCompounds] = useState([]);
-  const [filteredUsages, setFilteredUsages] = useState([]);
   const [searchQuery, setSearchQuery] = useState('');
   const [filterCompound, setFilterCompound] = useState('all');
   const [loading, setLoading] = useState(true);
+  // Id of the latest /weighings request; replies to older ones (previous filters, a superseded page) are dropped
+  const usagesRequest = useRef(0);
 
   useEffect(() => {
     fetchData();
   }, []);
 
+  // Filtering and search run server-side; debounce typing before refetching page 1
   useEffect(() => {
-    applyFilters();
-  }, [searchQuery, filterCompound, usages]);
+    const timer = setTimeout(() => { fetchUsages(); }, 300);
+    return () => clearTimeout(timer);
+  }, [searchQuery, filterCompound]);
+
+  const fetchUsages = async (cursor = null) => {
+    const params = { limit: PAGE_SIZE };
+    if (filterCompound !== 'all') params.compound_id = filterCompound;
+    if (searchQuery) params.search_query = searchQuery;
+    if (cursor) params.cursor = cursor;
+    const requestId = ++usagesRequest.current;
+    try {
+      const response = await axios.get(`${API}/weighings`, { params });
+      if (requestId !== usagesRequest.current) return;
+      const page = Array.isArray(response.data?.data) ? response.data.data : [];
+      setUsages(prev => (cursor ? [...prev, ...page] : page));
+      setUsagesTotal(response.data?.total ?? page.length);
+      setNextCursor(response.data?.next_cursor || null);
+    } catch (error) {
+      if (requestId !== usagesRequest.current) return;
+      console.error('Failed to load weighing records:', error);
+      toast.error('Failed to load weighing records.');
+      if (!cursor) {
+        setUsages([]);
+        setUsagesTotal(0);
+        setNextCursor(null);
+      }
+    }
+  };
+
+  const handleLoadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    await fetchUsages(nextCursor);
+    setLoadingMore(false);
+  };
 
   const fetchData = async () => {
     try {
-      // Use the new weighings endpoint that returns envelope format
-      const weighingsResponse = await axios.get(`${API}/weighings`);
       const labelsResponse = await axios.get(`${API}/labels`);
       const compoundsResponse = await axios.get(`${API}/compounds`);
       
-      // Handle envelope format from weighings endpoint
-      const usagesData = weighingsResponse.data?.data || [];
       const labelsData = labelsResponse.data?.data || labelsResponse.data || [];
       const compoundsData = compoundsResponse.data?.data || compoundsResponse.data || [];
       
-      setUsages(Array.isArray(usagesData) ? usagesData : []);
       setLabels(Array.isArray(labelsData) ? labelsData : []);
       setCompounds(Array.isArray(compoundsData) ? compoundsData : []);
-      setFilteredUsages(Array.isArray(usagesData) ? usagesData : []);
-      
-      console.log('Records loaded:', {
-        usages: usagesData.length,
-        labels: labelsData.length,
-        compounds: compoundsData.length
-      });
     } catch (error) {
       console.error('Failed to load records:', error);
       toast.error('Failed to load records. Please refresh the page.');
       // Set empty arrays to prevent crashes
-      setUsages([]);
       setLabels([]);
       setCompounds([]);
-      setFilteredUsages([]);
     } finally {
       setLoading(false);
     }
   };
 
-  const applyFilters = () => {
-    let filtered = Array.isArray(usages) ? [...usages] : [];
-
-    if (searchQuery) {
-      filtered = filtered.filter(u => 
-        (u.compound_name && u.compound_name.toLowerCase().includes(searchQuery.toLowerCase())) ||
-        (u.cas_number && u.cas_number.includes(searchQuery)) ||
-        (u.prepared_by && u.prepared_by.toLowerCase().includes(searchQuery.toLowerCase()))
-      );
-    }
-
-    if (filterCompound !== 'all') {
-      filtered = filtered.filter(u => u.compound_id === filterCompound);
-    }
-
-    setFilteredUsages(filtered);
-  };
-
   const handleExportUsages = () => {
     const params = new URLSearchParams();
     if (filterCompound !== 'all') params.append('compound_id', filterCompound);
@@ -173,7 +181,7 @@ export default function RecordsPage() {
             {/* Records Table */}
             <Card className="shadow-soft">
               <CardHeader className="flex flex-row items-center justify-between">
-                <CardTitle>Weighing Records ({filteredUsages.length})</CardTitle>
+                <CardTitle>Weighing Records ({usagesTotal})</CardTitle>
                 <Button
                   onClick={handleExportUsages}
                   className="bg-green-600 hover:bg-green-700"
@@ -203,8 +211,8 @@ export default function RecordsPage() {
                       </tr>
                     </thead>
                     <tbody>
-                      {filteredUsages.length > 0 ? (
-                        filteredUsages.map((usage) => (
+                      {usages.length > 0 ? (
+                        usages.map((usage) => (
                           <tr key={usage.id} data-testid={`usage-row-${usage.id}`}>
                             <td className="text-sm">
                               {new Date(usage.created_at).toLocaleDateString()}
@@ -236,6 +244,18 @@ export default function RecordsPage() {
                     </tbody>
                   </table>
                 </div>
+                {nextCursor && (
+                  <div className="flex justify-center pt-4">
+                    <Button
+                      variant="outline"
+                      onClick={handleLoadMore}
+                      disabled={loadingMore}
+                      data-testid="records-load-more"
+                    >
+                      {loadingMore ? 'Loading...' : `Load more (${usages.length} of ${usagesTotal})`}
+                    </Button>
+                  </div>
+                )}
               </CardContent>
             </Card>
           </TabsContent>
@@ -0,0 +1,57 @@
+"""Shared fixtures: the backend on sys.path and the app against an in-memory mongomock database."""
+import sys
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def db():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    pytest.importorskip("httpx")
+    from benchmarks.load import patch_mongomock_bulk
+
+    patch_mongomock_bulk()
+    return mongomock_motor.AsyncMongoMockClient(tz_aware=True, tzinfo=ZoneInfo("Europe/Istanbul"))["pestilab"]
+
+@pytest.fixture
+def client(db, monkeypatch):
+    """A logged-in TestClient for the admin user."""
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    import server
+
+    monkeypatch.setattr(server, "client", db.client)
+    monkeypatch.setattr(server, "db", db)
+    with TestClient(server.app) as test_client:
+        response = test_client.post("/api/auth/login", json={"username": "admin", "password": "admin123"})
+        assert response.status_code == 200, response.text
+        test_client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+        yield test_client
+
+@pytest.fixture
+def compound_id(client):
+    """A compound with 500 mg in stock."""
+    response = client.post("/api/compounds", json={
+        "name": "Tetramethrin", "cas_number": "7696-12-0", "solvent": "Methanol",
+        "stock_value": 500, "stock_unit": "mg", "critical_value": 100, "critical_unit": "mg",
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+@pytest.fixture
+def weigh(client):
+    """POST /api/weighing for a compound; extra keyword arguments go into the body."""
+    def weigh(compound_id, weighed_amount=10.2, headers=None, **fields):
+        body = {"compound_id": compound_id, "weighed_amount": weighed_amount, "target_concentration": 1000,
+                "prepared_by": "admin", **fields}
+        return client.post("/api/weighing", json=body, headers=headers)
+    return weigh
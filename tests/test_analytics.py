@@ -0,0 +1,70 @@
+"""Daily usage rollups against the raw usages they summarize (analytics.py)."""
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import analytics
+
+pytestmark = pytest.mark.anyio
+
+ISTANBUL = ZoneInfo("Europe/Istanbul")
+
+def usage(i, at, compound="c1", operator="admin", weighed=10.0, deviation=1.0):
+    return {"id": f"u{i}", "compound_id": compound, "compound_name": compound.upper(), "prepared_by": operator,
+            "weighed_amount": weighed, "actual_mass": weighed * 0.98, "deviation": deviation, "created_at": at}
+
+# 20:59 and 21:01 UTC fall on either side of midnight in Istanbul (UTC+3)
+USAGES = [
+    usage(1, datetime(2025, 3, 1, 8, 0, tzinfo=timezone.utc), weighed=5.0, deviation=-0.5),
+    usage(2, datetime(2025, 3, 1, 20, 59, tzinfo=timezone.utc), weighed=7.0, deviation=2.5),
+    usage(3, datetime(2025, 3, 1, 21, 1, tzinfo=timezone.utc), weighed=11.0, deviation=-3.0),
+    usage(4, datetime(2025, 3, 1, 21, 30, tzinfo=timezone.utc), compound="c2", operator="ayse", weighed=2.0),
+    usage(5, datetime(2025, 3, 3, 0, 30, tzinfo=ISTANBUL), weighed=4.0, deviation=0.0),
+]
+
+def raw_days(usages, field):
+    days = defaultdict(list)
+    for u in usages:
+        days[(u[field], u["created_at"].astimezone(ISTANBUL).date().isoformat())].append(u)
+    return days
+
+@pytest.fixture
+async def rolled_up(db):
+    for u in USAGES:
+        await analytics.record_usage(db, u, ISTANBUL)
+    return db
+
+async def test_rollups_follow_istanbul_days(rolled_up):
+    for dim, field in analytics.DIMENSIONS.items():
+        rows = await rolled_up[analytics.ROLLUPS_COLLECTION].find({"dim": dim}, {"_id": 0}).to_list(None)
+        expected = raw_days(USAGES, field)
+        assert {(r["key"], r["day"]) for r in rows} == set(expected)
+        for row in rows:
+            group = expected[(row["key"], row["day"])]
+            assert row["count"] == len(group)
+            assert row["weighed_mg"] == pytest.approx(sum(u["weighed_amount"] for u in group))
+            assert row["deviation_sum"] == pytest.approx(sum(u["deviation"] for u in group))
+            assert row["max_abs_deviation"] == max(abs(u["deviation"]) for u in group)
+
+async def test_day_boundary_splits_the_evening(rolled_up):
+    rows = await rolled_up[analytics.ROLLUPS_COLLECTION].find(
+        {"dim": "compound", "key": "c1"}, {"_id": 0, "day": 1, "count": 1}
+    ).sort("day", 1).to_list(None)
+    assert [(r["day"], r["count"]) for r in rows] == [("2025-03-01", 2), ("2025-03-02", 1), ("2025-03-03", 1)]
+
+async def test_totals_match_the_raw_usages_of_the_range(rolled_up):
+    items = await analytics.totals(rolled_up, "compound", date(2025, 3, 2), date(2025, 3, 3))
+    in_range = [u for u in USAGES if "2025-03-02" <= u["created_at"].astimezone(ISTANBUL).date().isoformat() <= "2025-03-03"]
+    by_key = {item["key"]: item for item in items}
+    for key in {u["compound_id"] for u in in_range}:
+        group = [u for u in in_range if u["compound_id"] == key]
+        assert by_key[key]["count"] == len(group)
+        assert by_key[key]["weighed_mg"] == pytest.approx(sum(u["weighed_amount"] for u in group))
+    assert [item["key"] for item in items] == ["c1", "c2"]  # largest weighed_mg first
+
+async def test_timeseries_weeks_start_on_monday(rolled_up):
+    series = await analytics.timeseries(rolled_up, "compound", "c1", date(2025, 2, 24), date(2025, 3, 9), "week")
+    # 1 and 2 March are a Saturday and Sunday, 3 March a Monday
+    assert [(p["period"], p["count"]) for p in series] == [("2025-02-24", 3), ("2025-03-03", 1)]
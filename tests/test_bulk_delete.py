@@ -0,0 +1,76 @@
+"""POST /api/compounds/clear with cascades (bulk_delete_compounds)."""
+import pytest
+
+import analytics
+import label_assets
+import stock_ledger
+import sync
+
+DEPENDENTS = ["usages", "labels", stock_ledger.MOVEMENTS_COLLECTION]
+
+@pytest.fixture
+def catalogue(client, compound_id, weigh):
+    """Two compounds with weighings: (the one to delete, the one to keep)."""
+    response = client.post("/api/compounds", json={
+        "name": "Deltamethrin", "cas_number": "52918-63-5", "solvent": "Methanol", "stock_value": 500,
+    })
+    assert response.status_code == 200, response.text
+    kept = response.json()["id"]
+    for compound in (compound_id, compound_id, kept):
+        assert weigh(compound).status_code == 200
+    return compound_id, kept
+
+def count(client, db, collection, query):
+    return client.portal.call(db[collection].count_documents, query)
+
+def digests(client, db, compound):
+    labels = client.portal.call(db.labels.find({"compound_id": compound}, {"assets": 1}).to_list, None)
+    return [ref for label in labels for ref in label["assets"].values()]
+
+def test_dry_run_counts_without_deleting(client, db, catalogue):
+    gone, _ = catalogue
+    response = client.post("/api/compounds/clear", json={"ids": [gone], "cascade": "delete", "dry_run": True})
+    assert response.json()["related"] == {
+        "usages": 2, "labels": 2, stock_ledger.MOVEMENTS_COLLECTION: 3, stock_ledger.SNAPSHOTS_COLLECTION: 0,
+        analytics.ROLLUPS_COLLECTION: count(client, db, analytics.ROLLUPS_COLLECTION, {"dim": "compound", "key": gone}),
+    }
+    assert count(client, db, "usages", {"compound_id": gone}) == 2
+
+def test_cascade_delete_removes_dependents(client, db, catalogue):
+    gone, kept = catalogue
+    gone_labels = [l["id"] for l in client.portal.call(db.labels.find({"compound_id": gone}).to_list, None)]
+    gone_blobs, kept_blobs = digests(client, db, gone), digests(client, db, kept)
+    assert count(client, db, label_assets.ASSETS_COLLECTION, {"_id": {"$in": gone_blobs}}) == len(gone_blobs)
+    tags = {path: client.get(path).headers["etag"] for path in ("/api/compounds", "/api/labels")}
+
+    response = client.post("/api/compounds/clear", json={"ids": [gone], "cascade": "delete"})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["deleted_count"] == 1
+    assert body["related"]["usages"] == 2 and body["related"]["labels"] == 2
+    assert body["related"][label_assets.ASSETS_COLLECTION] == len(gone_blobs)
+
+    for collection in DEPENDENTS + [stock_ledger.SNAPSHOTS_COLLECTION]:
+        assert count(client, db, collection, {"compound_id": gone}) == 0, collection
+    assert count(client, db, analytics.ROLLUPS_COLLECTION, {"dim": "compound", "key": gone}) == 0
+    assert count(client, db, label_assets.ASSETS_COLLECTION, {"_id": {"$in": gone_blobs}}) == 0
+    # the other compound keeps everything
+    for collection in DEPENDENTS:
+        assert count(client, db, collection, {"compound_id": kept}) > 0, collection
+    assert count(client, db, analytics.ROLLUPS_COLLECTION, {"dim": "compound", "key": kept}) > 0
+    assert count(client, db, label_assets.ASSETS_COLLECTION, {"_id": {"$in": kept_blobs}}) == len(kept_blobs)
+
+    tombstones = client.portal.call(db[sync.TOMBSTONES_COLLECTION].find({}, {"_id": 0}).to_list, None)
+    assert {(t["collection"], t["id"]) for t in tombstones} == {("compounds", gone)} | {("labels", i) for i in gone_labels}
+    for path, tag in tags.items():
+        response = client.get(path, headers={"If-None-Match": tag})
+        assert response.status_code == 200 and response.headers["etag"] != tag, path
+
+def test_without_cascade_dependents_stay(client, db, catalogue):
+    gone, _ = catalogue
+    labels_tag = client.get("/api/labels").headers["etag"]
+    response = client.post("/api/compounds/clear", json={"ids": [gone]})
+    assert response.json()["deleted_count"] == 1
+    assert count(client, db, "usages", {"compound_id": gone}) == 2
+    assert count(client, db, "labels", {"compound_id": gone}) == 2
+    assert client.get("/api/labels", headers={"If-None-Match": labels_tag}).status_code == 304
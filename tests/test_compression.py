@@ -0,0 +1,76 @@
+"""Accept-Encoding negotiation and the compression middleware."""
+import gzip
+
+import pytest
+
+from compression import CompressionMiddleware, negotiate
+
+@pytest.mark.parametrize("accept, expected", [
+    ("gzip, deflate, br", "br"),          # equal q: server preference
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("*", "br"),
+    ("*;q=0.5, gzip;q=0.8", "gzip"),
+    ("gzip;q=0, *", "br"),
+    ("identity", None),
+    ("", None),
+    ("gzip;q=oops", None),
+])
+def test_negotiate(accept, expected):
+    assert negotiate(accept, ["br", "gzip"]) == expected
+
+def test_negotiate_only_offers_server_encodings():
+    assert negotiate("br", ["gzip"]) is None
+    assert negotiate("br, gzip;q=0.1", ["gzip"]) == "gzip"
+
+@pytest.fixture
+def client():
+    pytest.importorskip("httpx")
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+    from starlette.routing import Route
+    from starlette.testclient import TestClient
+
+    big = {"rows": [{"id": i, "name": "Tetramethrin"} for i in range(200)]}
+
+    async def chunks():
+        for i in range(3):
+            yield f"line {i}\n" * 100
+
+    routes = [
+        Route("/big", lambda request: JSONResponse(big, headers={"ETag": '"v1"'})),
+        Route("/small", lambda request: JSONResponse({"ok": True})),
+        Route("/png", lambda request: PlainTextResponse("x" * 5000, media_type="image/png")),
+        Route("/stream", lambda request: StreamingResponse(chunks(), media_type="text/plain")),
+        Route("/events", lambda request: StreamingResponse(chunks(), media_type="text/event-stream")),
+    ]
+    return TestClient(CompressionMiddleware(Starlette(routes=routes), encodings=["gzip"]))
+
+def test_large_json_is_gzipped_with_a_weak_etag(client):
+    response = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == 'W/"v1"'
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json()["rows"][199]["id"] == 199
+
+def test_identity_keeps_the_strong_etag(client):
+    response = client.get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["etag"] == '"v1"'
+
+def test_small_and_binary_bodies_pass_through(client):
+    for path in ("/small", "/png"):
+        response = client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers, path
+
+def test_streamed_text_is_compressed_chunk_by_chunk(client):
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        raw = b"".join(response.iter_raw())
+    assert gzip.decompress(raw).decode().count("line") == 300
+
+def test_event_stream_is_never_compressed(client):
+    response = client.get("/events", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text.count("line") == 300
@@ -0,0 +1,33 @@
+"""ETags from collection versions and conditional GETs."""
+
+def test_matching_etag_gets_304(client, compound_id):
+    first = client.get("/api/compounds")
+    tag = first.headers["etag"]
+    again = client.get("/api/compounds", headers={"If-None-Match": tag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["etag"].removeprefix("W/") == tag.removeprefix("W/")
+
+def test_strong_tag_matches_weak_one_from_compression(client, compound_id):
+    tag = client.get("/api/compounds", headers={"Accept-Encoding": "identity"}).headers["etag"]
+    assert not tag.startswith("W/")
+    assert client.get("/api/compounds", headers={"If-None-Match": f"W/{tag}"}).status_code == 304
+
+def test_write_changes_the_etag(client, compound_id):
+    tag = client.get("/api/compounds").headers["etag"]
+    assert client.put(f"/api/compounds/{compound_id}", json={"notes": "opened"}).status_code == 200
+    response = client.get("/api/compounds", headers={"If-None-Match": tag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != tag
+
+def test_lazy_label_asset_render_changes_labels_etag(client, db, compound_id, weigh):
+    label_id = weigh(compound_id).json()["label"]["id"]
+    client.portal.call(db.labels.update_one, {"id": label_id}, {"$unset": {"assets": ""}})
+    tag = client.get("/api/labels").headers["etag"]
+
+    assert client.get(f"/api/labels/{label_id}").status_code == 200
+    assert client.portal.call(db.labels.find_one, {"id": label_id})["assets"]
+    response = client.get("/api/labels", headers={"If-None-Match": tag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != tag
+    assert response.json()[0]["assets"]
@@ -0,0 +1,45 @@
+"""Background export jobs belong to the user who queued them."""
+import time
+
+import pytest
+
+import export_jobs
+
+@pytest.fixture
+def analyst(client):
+    """Authorization headers for a second, non-admin user."""
+    response = client.post("/api/auth/register", json={
+        "username": "analyst", "email": "analyst@example.com", "password": "analyst123", "role": "analyst",
+    })
+    assert response.status_code == 200, response.text
+    response = client.post("/api/auth/login", json={"username": "analyst", "password": "analyst123"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+@pytest.fixture
+def finished_job(client, compound_id, weigh, tmp_path, monkeypatch):
+    monkeypatch.setattr(export_jobs, "EXPORT_CACHE_DIR", tmp_path)
+    weigh(compound_id)
+    job = client.post("/api/exports", json={"kind": "weighings_xlsx"}).json()
+    deadline = time.monotonic() + 60
+    while job["status"] not in ("done", "failed") and time.monotonic() < deadline:
+        time.sleep(0.2)
+        job = client.get(f"/api/exports/{job['id']}").json()
+    assert job["status"] == "done", job
+    yield job
+    export_jobs.shutdown()
+
+def test_owner_downloads_the_file(client, finished_job):
+    response = client.get(finished_job["download_url"])
+    assert response.status_code == 200
+    assert response.content[:2] == b"PK"  # xlsx is a zip
+
+def test_other_users_get_404(client, finished_job, analyst):
+    job_id = finished_job["id"]
+    for path in (f"/api/exports/{job_id}", f"/api/exports/{job_id}/events", f"/api/exports/{job_id}/download"):
+        assert client.get(path, headers=analyst).status_code == 404, path
+
+def test_same_query_from_another_user_reuses_the_file(client, finished_job, analyst):
+    job = client.post("/api/exports", json={"kind": "weighings_xlsx"}, headers=analyst).json()
+    assert job["id"] != finished_job["id"]
+    assert job["status"] == "done" and job["cached"] is True and job["created_by"] == "analyst"
+    assert client.get(job["download_url"], headers=analyst).content == client.get(finished_job["download_url"]).content
@@ -0,0 +1,83 @@
+"""Depletion forecasts from the compound rollups (forecast.py)."""
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import analytics
+import forecast
+import versions
+
+pytestmark = pytest.mark.anyio
+
+ISTANBUL = ZoneInfo("Europe/Istanbul")
+
+async def add_compound(db, days_old=10, stock=100.0, critical=50.0):
+    now = datetime.now(ISTANBUL)
+    await db.compounds.insert_one({
+        "id": "c1", "name": "Tetramethrin", "stock_value": stock, "stock_unit": "mg",
+        "critical_value": critical, "critical_unit": "mg", "created_at": now - timedelta(days=days_old - 1),
+    })
+
+async def weigh_daily(db, days, mg):
+    """One weighing of ``mg`` on each of the last ``days`` days, folded into the rollups."""
+    now = datetime.now(ISTANBUL)
+    for age in range(days):
+        usage = {"id": f"u{age}", "compound_id": "c1", "compound_name": "Tetramethrin", "prepared_by": "admin",
+                 "weighed_amount": mg, "actual_mass": mg, "deviation": 0.0, "created_at": now - timedelta(days=age)}
+        await analytics.record_usage(db, usage, ISTANBUL)
+
+async def stored(db):
+    return (await db.compounds.find_one({"id": "c1"}))["forecast"]
+
+async def test_steady_use_gives_its_daily_rate(db):
+    await add_compound(db)
+    await weigh_daily(db, 10, 10.0)
+    assert await forecast.refresh(db, ISTANBUL) == 1
+    result = await stored(db)
+    today = datetime.now(ISTANBUL).date()
+    assert result["rate_per_day"] == pytest.approx(10.0)
+    assert (result["days_to_critical"], result["days_to_empty"]) == (5.0, 10.0)
+    assert result["critical_on"] == (today + timedelta(days=5)).isoformat()
+
+async def test_refresh_after_new_rollups_changes_the_forecast(db):
+    await add_compound(db)
+    await weigh_daily(db, 10, 10.0)
+    await forecast.refresh(db, ISTANBUL)
+    before = await stored(db)
+
+    await analytics.record_usage(db, {
+        "id": "extra", "compound_id": "c1", "compound_name": "Tetramethrin", "prepared_by": "admin",
+        "weighed_amount": 30.0, "actual_mass": 30.0, "deviation": 0.0, "created_at": datetime.now(ISTANBUL),
+    }, ISTANBUL)
+    assert await forecast.refresh(db, ISTANBUL, ["c1"]) == 1
+    after = await stored(db)
+    assert after["rate_per_day"] > before["rate_per_day"]
+    assert after["days_to_critical"] < before["days_to_critical"]
+
+async def test_unchanged_pass_writes_nothing_and_keeps_the_etag(db):
+    await add_compound(db)
+    await weigh_daily(db, 3, 10.0)
+    assert await forecast.refresh_all(db, ISTANBUL) == 1
+    version = (await versions.current(db, ["compounds"]))["compounds"]
+    assert await forecast.refresh_all(db, ISTANBUL) == 0
+    assert (await versions.current(db, ["compounds"]))["compounds"] == version
+
+async def test_no_use_means_no_depletion_date(db):
+    await add_compound(db)
+    await forecast.refresh(db, ISTANBUL)
+    result = await stored(db)
+    assert result["rate_per_day"] == 0 and result["critical_on"] is None and result["empty_on"] is None
+
+async def test_reorder_list_holds_compounds_due_within_the_horizon(db):
+    await add_compound(db)
+    await weigh_daily(db, 10, 10.0)
+    await forecast.refresh(db, ISTANBUL)
+    assert [c["id"] for c in await forecast.reorder_list(db, ISTANBUL, horizon_days=7)] == ["c1"]
+    assert await forecast.reorder_list(db, ISTANBUL, horizon_days=2) == []
+
+async def test_one_worker_claims_each_pass(db):
+    now = datetime.now(ISTANBUL)
+    assert await forecast.claim(db, now) is True
+    assert await forecast.claim(db, now + timedelta(minutes=10)) is False
+    assert await forecast.claim(db, now + timedelta(hours=forecast.FORECAST_REFRESH_HOURS)) is True
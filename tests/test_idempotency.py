@@ -0,0 +1,60 @@
+"""Idempotency-Key replay on POST /weighing (idempotency.py)."""
+import pytest
+from fastapi import HTTPException
+
+import idempotency
+
+def test_retry_replays_the_first_response(client, db, compound_id, weigh):
+    headers = {"Idempotency-Key": "w-1"}
+    first = weigh(compound_id, headers=headers)
+    assert first.status_code == 200, first.text
+    assert "idempotent-replayed" not in first.headers
+
+    retry = weigh(compound_id, headers=headers)
+    assert retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert client.portal.call(db.usages.count_documents, {}) == 1
+
+def test_same_key_with_another_body_is_rejected(client, db, compound_id, weigh):
+    headers = {"Idempotency-Key": "w-2"}
+    assert weigh(compound_id, headers=headers).status_code == 200
+    conflict = weigh(compound_id, 12.0, headers=headers)
+    assert conflict.status_code == 422
+    assert client.portal.call(db.usages.count_documents, {}) == 1
+
+def test_without_a_key_every_request_runs(client, db, compound_id, weigh):
+    for _ in range(2):
+        assert weigh(compound_id).status_code == 200
+    assert client.portal.call(db.usages.count_documents, {}) == 2
+
+@pytest.mark.anyio
+async def test_failed_request_releases_the_key(db):
+    calls = []
+
+    async def failing():
+        calls.append("failing")
+        raise HTTPException(status_code=404, detail="Compound not found")
+
+    async def succeeding():
+        calls.append("succeeding")
+        return {"ok": True}
+
+    with pytest.raises(HTTPException):
+        await idempotency.run(db, "k", "admin", "weighing", "fp", failing)
+    assert await db[idempotency.KEYS_COLLECTION].count_documents({}) == 0
+
+    response = await idempotency.run(db, "k", "admin", "weighing", "fp", succeeding)
+    assert response.body == b'{"ok":true}'
+    replayed = await idempotency.run(db, "k", "admin", "weighing", "fp", succeeding)
+    assert replayed.headers["idempotent-replayed"] == "true"
+    assert calls == ["failing", "succeeding"]
+
+@pytest.mark.anyio
+async def test_keys_are_scoped_to_the_user(db):
+    async def handler():
+        return {"ok": True}
+
+    await idempotency.run(db, "k", "alice", "weighing", "fp", handler)
+    response = await idempotency.run(db, "k", "bob", "weighing", "other-fp", handler)
+    assert "idempotent-replayed" not in response.headers
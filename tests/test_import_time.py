@@ -0,0 +1,43 @@
+"""Cold-start budget for the serverless entry point (backend/api/index.py -> server)."""
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# Loaded on first use by the import/export/render paths only
+LAZY_MODULES = ["openpyxl", "reportlab", "qrcode", "barcode", "PIL", "docx", "PyPDF2"]
+
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+
+def _importtime(module: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+        env={**os.environ, "MONGO_URL": ""},
+    )
+    assert result.returncode == 0, result.stderr
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)", line)
+        if match:
+            cumulative[match.group(3)] = int(match.group(1))
+    return cumulative
+
+@pytest.fixture(scope="module")
+def server_imports():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("motor")
+    return _importtime("server")
+
+def test_heavy_dependencies_are_not_imported_eagerly(server_imports):
+    eager = [m for m in LAZY_MODULES if m in server_imports]
+    assert not eager, f"imported at startup: {eager}"
+
+def test_server_import_within_budget(server_imports):
+    total_ms = server_imports["server"] / 1000
+    assert total_ms < IMPORT_BUDGET_MS, f"import server took {total_ms:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)"
@@ -0,0 +1,37 @@
+"""Scan-to-record lookups: GET /labels/by-code and POST /labels/resolve."""
+import pytest
+
+@pytest.fixture
+def scanned(compound_id, weigh):
+    """Two weighings of the compound: their labels, oldest first."""
+    return [weigh(compound_id, amount).json()["label"] for amount in (10.2, 12.5)]
+
+def test_by_code_returns_label_usage_and_stock(client, scanned):
+    label = scanned[0]
+    body = client.get(f"/api/labels/by-code/{label['label_code']}").json()
+    assert body["label"]["id"] == label["id"]
+    assert "assets" not in body["label"]
+    assert body["usage"]["id"] == label["usage_id"] and body["usage"]["weighed_amount"] == 10.2
+    assert body["compound"]["stock_value"] == pytest.approx(500 - 10.2 - 12.5)
+
+def test_by_code_accepts_the_qr_payload(client, scanned):
+    label = scanned[1]
+    body = client.get(f"/api/labels/by-code/{label['qr_data']}").json()
+    assert body["label"]["label_code"] == label["label_code"]
+
+def test_unknown_code_is_404(client, scanned):
+    assert client.get("/api/labels/by-code/NOPE-0001").status_code == 404
+
+def test_batch_resolve_keeps_the_scan_order(client, scanned):
+    first, second = scanned
+    codes = [second["qr_data"], "NOPE-0001", f"  {first['label_code']}  ", second["label_code"]]
+    body = client.post("/api/labels/resolve", json={"codes": codes}).json()
+    assert (body["found"], body["total"]) == (3, 4)
+    results = body["results"]
+    assert [r["input"] for r in results] == codes
+    assert [r["found"] for r in results] == [True, False, True, True]
+    assert [r.get("label", {}).get("id") for r in results] == [second["id"], None, first["id"], second["id"]]
+    assert results[0]["usage"]["id"] == second["usage_id"]
+
+def test_batch_is_capped(client, scanned):
+    assert client.post("/api/labels/resolve", json={"codes": ["X"] * 501}).status_code == 422
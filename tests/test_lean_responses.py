@@ -0,0 +1,41 @@
+"""Lean list responses (raw documents through orjson) must match the response_model path."""
+from datetime import datetime
+
+import pytest
+
+LIST_ENDPOINTS = ["/api/compounds", "/api/labels", "/api/solvent-densities", "/api/users"]
+
+def instants(value):
+    """Datetimes as instants: mongomock hands dates back in UTC, where Motor localizes them to Istanbul."""
+    if isinstance(value, dict):
+        return {key: instants(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [instants(item) for item in value]
+    if isinstance(value, str) and len(value) >= 25 and value[10:11] == "T":
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return value
+
+@pytest.fixture
+def catalogue(compound_id, weigh):
+    response = weigh(compound_id)
+    assert response.status_code == 200, response.text
+    return compound_id
+
+@pytest.mark.parametrize("path", LIST_ENDPOINTS)
+def test_lean_and_validated_responses_match(client, catalogue, monkeypatch, path):
+    import server
+
+    monkeypatch.setattr(server, "LEAN_RESPONSES", True)
+    lean = client.get(path)
+    monkeypatch.setattr(server, "LEAN_RESPONSES", False)
+    validated = client.get(path)
+    assert lean.status_code == validated.status_code == 200
+    assert lean.json() and instants(lean.json()) == instants(validated.json())
+
+def test_internal_fields_are_not_sent(client, catalogue):
+    compound = client.get("/api/compounds").json()[0]
+    assert not {"ledger_seq", "sync_seq", "sync_at", "_id"} & compound.keys()
+    assert not {"password", "_id"} & client.get("/api/users").json()[0].keys()
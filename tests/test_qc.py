@@ -0,0 +1,114 @@
+"""Westgard rules in qc.ControlChart, and the /qc endpoints over stored weighings."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import qc
+
+def in_control(window: int = 100, points: int = 50) -> qc.ControlChart:
+    """A chart fed ``points`` values alternating around 0 with an SD of about 1, ending below the mean."""
+    chart = qc.ControlChart(window=window, min_points=10)
+    for i in range(points):
+        chart.add(-1.0 if i % 2 else 1.0)
+    return chart
+
+def feed(chart, values):
+    return [chart.add(value) for value in values]
+
+def test_no_limits_before_min_points():
+    chart = qc.ControlChart(window=20, min_points=10)
+    points = feed(chart, [5.0, -5.0] * 5)
+    assert all(p["z"] is None and p["status"] == "ok" for p in points)
+    assert chart.add(0.0)["z"] is not None
+
+def test_in_control_points_pass():
+    points = feed(in_control(), [0.5, -0.5, 0.8, -0.3])
+    assert [p["status"] for p in points] == ["ok"] * 4
+
+def test_1_2s_is_a_warning():
+    point = in_control().add(2.5)
+    assert point["violations"] == ["1_2s"]
+    assert point["status"] == "warning"
+
+def test_1_3s_rejects():
+    point = in_control().add(3.5)
+    assert "1_3s" in point["violations"]
+    assert point["status"] == "reject"
+
+def test_2_2s_two_consecutive_beyond_2sd_same_side():
+    first, second = feed(in_control(), [2.3, 2.3])
+    assert "2_2s" not in first["violations"]
+    assert "2_2s" in second["violations"]
+
+def test_2_2s_needs_the_same_side():
+    _, second = feed(in_control(), [2.3, -2.3])
+    assert "2_2s" not in second["violations"]
+
+def test_r_4s_range_across_the_mean():
+    first, second = feed(in_control(), [2.5, -2.5])
+    assert "R_4s" not in first["violations"]
+    assert "R_4s" in second["violations"]
+
+def test_4_1s_four_beyond_1sd_same_side():
+    points = feed(in_control(), [1.5] * 4)
+    assert ["4_1s" in p["violations"] for p in points] == [False, False, False, True]
+    assert all("1_2s" not in p["violations"] for p in points)
+
+def test_10_x_ten_on_the_same_side():
+    points = feed(in_control(), [0.5] * 10)
+    assert ["10_x" in p["violations"] for p in points] == [False] * 9 + [True]
+    assert points[-1]["status"] == "reject"
+
+def test_window_drops_old_points():
+    chart = qc.ControlChart(window=10, min_points=10)
+    feed(chart, [100.0] * 10 + [-1.0, 1.0] * 5)
+    point = chart.add(0.0)
+    assert point["mean"] == pytest.approx(0.0)
+    assert point["sd"] == pytest.approx(1.054, abs=1e-3)
+
+START = datetime(2025, 3, 3, 9, 0, tzinfo=timezone.utc)
+
+@pytest.fixture
+def charted(client, db):
+    """c1: 20 in-control weighings then a 3.5 SD outlier; c2: in control throughout."""
+    docs = []
+    for key, outlier in (("c1", 3.5), ("c2", None)):
+        values = [-1.0 if i % 2 else 1.0 for i in range(20)] + ([outlier] if outlier else [0.5])
+        docs += [
+            {"id": f"{key}-{i:02d}", "compound_id": key, "compound_name": key.upper(), "prepared_by": "admin",
+             "balance_id": "B1", "deviation": value, "label_code_used": f"{key.upper()}-{i + 1:04d}",
+             "created_at": START + timedelta(hours=i)}
+            for i, value in enumerate(values)
+        ]
+    client.portal.call(db.usages.insert_many, docs)
+    return docs
+
+def deviation_chart(client, key, **params):
+    response = client.get("/api/qc/deviation", params={
+        "key": key, "date_from": "2025-03-01", "date_to": "2025-03-31", "min_points": 10, **params,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_chart_flags_the_outlying_weighing(client, charted):
+    body = deviation_chart(client, "c1")
+    assert body["count"] == 21 and len(body["points"]) == 21
+    assert body["violations"]["1_3s"] == 1
+    flagged = [p for p in body["points"] if p["status"] != "ok"]
+    assert [(p["id"], p["label_code"], p["status"]) for p in flagged] == [("c1-20", "C1-0021", "reject")]
+
+def test_violations_only_returns_just_the_flagged_points(client, charted):
+    body = deviation_chart(client, "c1", violations_only=True)
+    assert body["count"] == 21
+    assert [p["id"] for p in body["points"]] == ["c1-20"]
+
+def test_summary_lists_rejects_first(client, charted):
+    response = client.get("/api/qc/summary", params={"date_from": "2025-03-01", "date_to": "2025-03-31", "min_points": 10})
+    items = response.json()["items"]
+    assert [(item["key"], item["rejects"]) for item in items] == [("c1", 1), ("c2", 0)]
+    assert items[0]["last_violation_at"] is not None and items[1]["last_violation_at"] is None
+
+def test_balance_dimension_and_bad_parameters(client, charted):
+    assert deviation_chart(client, "B1", dimension="balance")["count"] == 42
+    assert client.get("/api/qc/deviation", params={"key": "c1", "dimension": "shift"}).status_code == 400
+    assert client.get("/api/qc/deviation", params={"key": "c1", "window": 5, "min_points": 10}).status_code == 400
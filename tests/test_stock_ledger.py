@@ -0,0 +1,82 @@
+"""Stock ledger balances: concurrent weighings and unit changes (stock_ledger.py)."""
+import asyncio
+import time
+from datetime import date, datetime, timezone
+
+import pytest
+
+def stock(client, compound_id, **params):
+    response = client.get(f"/api/compounds/{compound_id}/stock", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def consumption_today(client, compound_id):
+    today = date.today().isoformat()
+    return client.get(f"/api/compounds/{compound_id}/consumption", params={"date_from": today, "date_to": today})
+
+def change_unit(client, compound_id, stock_value, unit):
+    time.sleep(0.01)  # keep the change after the instants the test reads at
+    response = client.put(f"/api/compounds/{compound_id}", json={
+        "stock_value": stock_value, "stock_unit": unit, "critical_value": 0.1, "critical_unit": unit,
+    })
+    assert response.status_code == 200, response.text
+
+def test_concurrent_weighings_both_take_stock(client, db, compound_id, monkeypatch):
+    import httpx
+
+    import server
+    import sync
+
+    reserve = sync.reserve
+
+    async def slow_reserve(*args, **kwargs):
+        await asyncio.sleep(0.01)  # mongomock never yields: let the other weighing read the compound too
+        return await reserve(*args, **kwargs)
+
+    monkeypatch.setattr(sync, "reserve", slow_reserve)
+
+    async def weigh_together():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=client.headers) as http:
+            return await asyncio.gather(*[
+                http.post("/api/weighing", json={
+                    "compound_id": compound_id, "weighed_amount": amount, "target_concentration": 1000,
+                    "prepared_by": "admin",
+                })
+                for amount in (10.0, 20.0)
+            ])
+
+    responses = client.portal.call(weigh_together)
+    assert [r.status_code for r in responses] == [200, 200]
+    compound = client.get(f"/api/compounds/{compound_id}").json()
+    assert compound["stock_value"] == pytest.approx(470.0)
+    assert stock(client, compound_id)["stock_value"] == pytest.approx(470.0)
+    codes = {r.json()["label"]["label_code"] for r in responses}
+    assert len(codes) == 2
+
+def test_stock_before_a_unit_change_is_in_the_current_unit(client, compound_id, weigh):
+    weigh(compound_id)
+    before = datetime.now(timezone.utc).isoformat()
+    change_unit(client, compound_id, 0.4898, "g")
+    past = stock(client, compound_id, at=before)
+    assert past["stock_unit"] == "g"
+    assert past["stock_value"] == pytest.approx(0.4898)
+    assert past["consumed_total"] == pytest.approx(0.0102)
+
+def test_consumption_across_a_unit_change(client, compound_id, weigh):
+    weigh(compound_id)
+    change_unit(client, compound_id, 0.4898, "g")
+    weigh(compound_id)
+    report = consumption_today(client, compound_id).json()
+    assert report["stock_unit"] == "g"
+    assert report["consumed"] == pytest.approx(0.0204)
+    assert report["closing_balance"] == pytest.approx(0.4796)
+
+def test_mass_to_volume_history_keeps_its_unit(client, compound_id, weigh):
+    weigh(compound_id)
+    before = datetime.now(timezone.utc).isoformat()
+    change_unit(client, compound_id, 5, "mL")
+    past = stock(client, compound_id, at=before)
+    assert (past["stock_value"], past["stock_unit"]) == (pytest.approx(489.8), "mg")
+    assert stock(client, compound_id)["stock_unit"] == "mL"
+    assert consumption_today(client, compound_id).status_code == 409
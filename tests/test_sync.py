@@ -0,0 +1,88 @@
+"""Delta sync tokens and tombstones (sync.py)."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import sync
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2025, 6, 1, 12, 0, tzinfo=timezone.utc)
+SETTLED = NOW - timedelta(seconds=sync.SYNC_SETTLE_SECONDS + 1)
+
+async def write(db, collection, doc_id, at=SETTLED):
+    await db[collection].update_one({"id": doc_id}, {"$set": {"id": doc_id, **await sync.stamp(db, at)}}, upsert=True)
+
+async def test_changes_after_token_in_sequence_order(db):
+    await write(db, "compounds", "c1")
+    await write(db, "labels", "l1")
+    await write(db, "solvent_densities", "d1")
+    first = await sync.changes(db, 0, 100, NOW)
+    assert [d["id"] for d in first["changes"]["compounds"]] == ["c1"]
+    assert first["token"] == 3 and not first["has_more"]
+
+    await write(db, "compounds", "c1")  # rewritten: comes round again with a new seq
+    second = await sync.changes(db, first["token"], 100, NOW)
+    assert [d["id"] for d in second["changes"]["compounds"]] == ["c1"]
+    assert second["changes"]["labels"] == [] and second["token"] == 4
+
+async def test_limit_pages_through_everything(db):
+    for i in range(5):
+        await write(db, "compounds", f"c{i}")
+    seen, token = [], 0
+    while True:
+        page = await sync.changes(db, token, 2, NOW)
+        seen += [d["id"] for d in page["changes"]["compounds"]]
+        token = page["token"]
+        if not page["has_more"]:
+            break
+    assert seen == [f"c{i}" for i in range(5)]
+
+async def test_token_stops_before_unsettled_changes(db):
+    await write(db, "compounds", "old")
+    await write(db, "compounds", "fresh", at=NOW)
+    page = await sync.changes(db, 0, 100, NOW)
+    assert {d["id"] for d in page["changes"]["compounds"]} == {"old", "fresh"}
+    assert page["token"] == 1  # "fresh" is sent again next time
+
+async def test_tombstones_report_deletes(db):
+    await write(db, "labels", "l1")
+    await sync.tombstone(db, "labels", ["l1"], SETTLED)
+    page = await sync.changes(db, 1, 100, NOW)
+    assert page["deleted"]["labels"] == ["l1"]
+    assert page["token"] == 2
+
+async def test_token_older_than_pruned_tombstones_resets(db):
+    expired = NOW - timedelta(days=sync.SYNC_TOMBSTONE_DAYS + 1)
+    await sync.tombstone(db, "compounds", ["gone-1", "gone-2"], expired)  # seqs 1 and 2
+    await write(db, "compounds", "c1")
+    await sync.tombstone(db, "compounds", ["later"], SETTLED)  # prunes the expired ones
+
+    assert await db[sync.TOMBSTONES_COLLECTION].count_documents({"id": {"$in": ["gone-1", "gone-2"]}}) == 0
+    assert (await sync.changes(db, 1, 100, NOW))["reset"] is True  # may have missed "gone-2"
+    current = await sync.changes(db, 2, 100, NOW)
+    assert current["reset"] is False and current["deleted"]["compounds"] == ["later"]
+    full = await sync.changes(db, 0, 100, NOW)  # a full reload never needs a reset
+    assert full["reset"] is False and [d["id"] for d in full["changes"]["compounds"]] == ["c1"]
+
+async def test_token_stops_at_the_first_unsettled_seq(db):
+    await write(db, "compounds", "c1")
+    await write(db, "compounds", "c2", at=NOW)  # seq 2 still settling
+    await write(db, "labels", "l1")
+    await sync.tombstone(db, "labels", ["l0"], SETTLED)
+    page = await sync.changes(db, 0, 100, NOW)
+    assert page["token"] == 1  # not 4: seq 2 may still have a lower neighbour landing
+    assert [d["id"] for d in page["changes"]["compounds"]] == ["c1", "c2"]
+    assert page["changes"]["labels"][0]["id"] == "l1" and page["deleted"]["labels"] == ["l0"]
+
+    later = await sync.changes(db, page["token"], 100, NOW + timedelta(seconds=sync.SYNC_SETTLE_SECONDS + 1))
+    assert later["token"] == 4
+    assert [d["id"] for d in later["changes"]["compounds"]] == ["c2"]
+
+async def test_full_page_of_unsettled_changes_keeps_the_token(db):
+    await write(db, "compounds", "c1")
+    for i in range(3):
+        await write(db, "compounds", f"fresh{i}", at=NOW)
+    page = await sync.changes(db, 1, 2, NOW)
+    assert page["token"] == 1 and page["has_more"] is False
+    assert [d["id"] for d in page["changes"]["compounds"]] == ["fresh0", "fresh1"]
@@ -0,0 +1,96 @@
+"""Native ZPL / TSPL label jobs (thermal.py)."""
+import re
+
+import pytest
+
+import thermal
+from label_profiles import THERMAL_PROFILES, get_thermal_profile
+
+def label(name: str, cas: str, code: str) -> dict:
+    """A label as record_weighing stores it, with its ``LBL|...`` QR payload."""
+    qr_data = "|".join([f"LBL|code={code}", f"name={name}", f"cas={cas}", "c=1000.0 ppm", "dt=2025-06-01", "by=admin"])
+    return {"compound_name": name, "cas_number": cas, "concentration": "1000.0 ppm", "date": "2025-06-01",
+            "prepared_by": "admin", "label_code": code, "qr_data": qr_data}
+
+LABELS = [label("Tetramethrin", "7696-12-0", "TETRAMETHRIN-0001"), label("Deltamethrin", "52918-63-5", "DELTAMETHRIN-0001")]
+AWKWARD = label('Tetra"meth^rin~X', "7696-12-0", "TETRAMETHRIN-0002")
+
+def test_qr_modules_grow_with_the_data():
+    assert thermal.qr_modules("x" * 14) == 21
+    assert thermal.qr_modules("x" * 15) == 25
+    assert thermal.qr_modules("x" * 5000) == 177
+
+def test_code128_modules():
+    assert thermal.code128_modules("ABC") == 68
+
+@pytest.mark.parametrize("profile", THERMAL_PROFILES.values(), ids=lambda p: p.id)
+def test_layout_fits_the_printable_area(profile):
+    lay = thermal.compute_layout(profile, LABELS)
+    right = profile.dots(profile.width - profile.margin.right)
+    bottom = profile.dots(profile.height - profile.margin.bottom)
+    longest = max(thermal.code128_modules(label["label_code"]) for label in LABELS)
+    assert lay.name_y < lay.line2_y < lay.line3_y < lay.row_y < lay.code_y
+    assert lay.code_y + lay.code_h <= bottom + 1
+    assert lay.row_y + lay.barcode_height <= lay.code_y
+    # the module never drops below one dot, so on the narrowest labels a long code may still run over
+    assert lay.barcode_module == 1 or lay.barcode_x + lay.barcode_module * longest <= right + 1
+
+def test_zpl_stores_the_format_once_and_recalls_it_per_label():
+    jobs = list(thermal.render_zpl(LABELS, get_thermal_profile("Zebra_50x25_203"), copies=2))
+    assert len(jobs) == 1 + len(LABELS)
+    assert jobs[0].startswith("^XA^DFR:PESTILAB.ZPL^FS") and jobs[0].endswith("^XZ\n")
+    assert "^PW400^LL200" in jobs[0]  # 50 x 25 mm at 203 dpi
+    first = jobs[1]
+    assert first.startswith("^XA^XFR:PESTILAB.ZPL^FS")
+    assert "^FN1^FDTetramethrin^FS" in first
+    assert f"^FN4^FDMA,{LABELS[0]['qr_data']}^FS" in first
+    assert "^FN5^FDTETRAMETHRIN-0001^FS" in first
+    assert first.endswith("^PQ2^XZ\n")
+
+def test_zpl_drops_command_characters():
+    job = list(thermal.render_zpl([AWKWARD], get_thermal_profile(None)))[1]
+    assert '^FN1^FDTetra"meth rin X^FS' in job
+    assert '^FN4^FDMA,LBL|code=TETRAMETHRIN-0002|name=Tetra"meth rin X|cas=7696-12-0|' in job
+    fields = re.findall(r"\^FD(.*?)\^FS", job)
+    assert len(fields) == 6 and not any("~" in f or "^" in f for f in fields)
+
+def test_tspl_job():
+    profile = get_thermal_profile("TSC_40x30_203")
+    header, *labels = thermal.render_tspl(LABELS, profile, copies=3)
+    assert header.startswith("SIZE 40 mm,30 mm\nGAP 2 mm,0 mm\n")
+    assert len(labels) == len(LABELS)
+    first = labels[0]
+    assert first.startswith("CLS\n") and first.endswith("PRINT 1,3\n")
+    qr = re.escape(LABELS[0]["qr_data"])
+    assert re.search(rf'^QRCODE \d+,\d+,M,\d+,A,0,"{qr}"$', first, re.M)
+    assert re.search(r'^BARCODE \d+,\d+,"128",\d+,0,0,\d+,\d+,"TETRAMETHRIN-0001"$', first, re.M)
+
+def test_tspl_escapes_quotes():
+    job = list(thermal.render_tspl([AWKWARD], get_thermal_profile("TSC_40x30_203")))[1]
+    lines = job.splitlines()
+    assert lines[1].endswith(',"Tetra\\["]meth^rin~X"')  # ^ and ~ mean nothing to TSPL
+    qr = AWKWARD["qr_data"].replace('"', '\\["]')
+    assert any(line.startswith("QRCODE") and line.endswith(f',"{qr}"') for line in lines)
+    # every quote left in a command is an argument delimiter
+    assert all(line.replace('\\["]', "").count('"') % 2 == 0 for line in lines)
+
+def test_tspl_truncates_text_to_the_width():
+    job = list(thermal.render_tspl([label("x" * 200, "7696-12-0", "X-0001")], get_thermal_profile("TSC_40x30_203")))[1]
+    assert len(job.splitlines()[1]) < 200
+
+def test_payload_of_a_recorded_weighing(client, weigh):
+    response = client.post("/api/compounds", json={
+        "name": 'Tetra"meth^rin~X', "cas_number": "7696-12-0", "solvent": "Methanol", "stock_value": 500,
+    })
+    assert response.status_code == 200, response.text
+    stored = weigh(response.json()["id"]).json()["label"]
+    assert stored["qr_data"].startswith(f'LBL|code={stored["label_code"]}|name=Tetra"meth^rin~X|cas=7696-12-0|')
+
+    zpl = list(thermal.render_zpl([stored], get_thermal_profile(None)))[1]
+    assert f"^FN4^FDMA,{thermal.zpl_text(stored['qr_data'])}^FS" in zpl
+    assert len(re.findall(r"\^FD(.*?)\^FS", zpl)) == 6
+    tspl = list(thermal.render_tspl([stored], get_thermal_profile("TSC_40x30_203")))[1]
+    assert f'A,0,"{thermal.tspl_text(stored["qr_data"])}"\n' in tspl
+
+def test_renderers_cover_every_profile_language():
+    assert {p.language for p in THERMAL_PROFILES.values()} <= set(thermal.RENDERERS)
@@ -0,0 +1,58 @@
+"""Stock unit conversion and the canonical stock fields."""
+import pytest
+
+import units
+
+@pytest.mark.parametrize("value, unit, expected", [
+    (1, "g", 1000.0),
+    (2.5, "kg", 2_500_000.0),
+    (500, "µg", 0.5),
+    (500, "ug", 0.5),
+    (500, "mcg", 0.5),
+    (3, "mg", 3.0),
+])
+def test_to_mg(value, unit, expected):
+    assert units.to_mg(value, unit) == pytest.approx(expected)
+
+def test_volume_units_stay_in_ml():
+    assert units.to_base(2, "L") == (2000.0, "volume")
+    assert units.to_base(250, "µl") == (0.25, "volume")
+    with pytest.raises(units.UnitError):
+        units.to_mg(1, "mL")
+
+def test_unknown_unit():
+    with pytest.raises(units.UnitError):
+        units.normalize_unit("pound")
+
+def test_from_mg_round_trip():
+    assert units.from_mg(units.to_mg(1.25, "g"), "g") == pytest.approx(1.25)
+
+def test_weighed_in_stock_unit():
+    assert units.weighed_in_stock_unit(250, "g") == pytest.approx(0.25)
+    assert units.weighed_in_stock_unit(250, "mL") == 250  # no density: the mg figure as is
+
+@pytest.mark.parametrize("stock, stock_unit, critical, critical_unit, is_critical", [
+    (1, "g", 500, "mg", False),
+    (0.5, "g", 500, "mg", True),   # equal counts as critical
+    (400, "mg", 0.5, "g", True),
+    (2, "L", 500, "mL", False),
+    (0.2, "L", 500, "mL", True),
+])
+def test_is_critical_across_units(stock, stock_unit, critical, critical_unit, is_critical):
+    assert units.stock_fields(stock, stock_unit, critical, critical_unit)["is_critical"] is is_critical
+
+def test_stock_fields():
+    fields = units.stock_fields(2, "g", 500, "mg")
+    assert fields == {"stock_mg": 2000.0, "critical_mg": 500.0, "stock_ratio": 4.0, "is_critical": False}
+
+def test_volume_stock_has_no_mg_fields():
+    fields = units.stock_fields(1, "L", 250, "mL")
+    assert fields["stock_mg"] is None and fields["critical_mg"] is None
+    assert fields["stock_ratio"] == 4.0
+
+def test_mass_and_volume_cannot_be_compared():
+    with pytest.raises(units.UnitError):
+        units.stock_fields(1, "g", 10, "mL")
+
+def test_compound_defaults_to_mg():
+    assert units.compound_stock_fields({"stock_value": 50})["is_critical"] is True  # default critical: 100 mg
@@ -0,0 +1,64 @@
+"""GET /api/weighings keyset pagination on (created_at, id)."""
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+START = datetime(2025, 3, 1, 9, 0, tzinfo=timezone.utc)
+
+@pytest.fixture
+def usages(client, db):
+    # pairs share a timestamp, so the id tie-break decides the order within a pair
+    docs = [
+        {"id": f"u{i:02d}", "compound_id": "c1" if i % 3 else "c2", "prepared_by": "admin",
+         "compound_name": "Tetramethrin" if i % 3 else "Deltamethrin", "cas_number": "7696-12-0" if i % 3 else "52918-63-5",
+         "deviation": float(i % 5 - 2), "created_at": START + timedelta(minutes=i // 2)}
+        for i in range(11)
+    ]
+    client.portal.call(db.usages.insert_many, docs)
+    return docs
+
+def walk(client, **params):
+    ids, cursor, totals = [], None, set()
+    while True:
+        query = {**params, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/weighings", params=query)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        ids += [row["id"] for row in body["data"]]
+        totals.add(body["total"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids, totals
+
+def newest_first(docs):
+    return [d["id"] for d in sorted(docs, key=lambda d: (d["created_at"], d["id"]), reverse=True)]
+
+def test_pages_cover_every_record_once_in_order(client, usages):
+    ids, totals = walk(client, limit=2)
+    assert ids == newest_first(usages)
+    assert totals == {len(usages)}
+
+def test_cursor_combines_with_filters(client, usages):
+    expected = [d for d in usages if d["compound_id"] == "c1" and abs(d["deviation"]) >= 1]
+    ids, totals = walk(client, limit=3, compound_id="c1", min_abs_deviation=1)
+    assert ids == newest_first(expected)
+    assert totals == {len(expected)}
+
+def test_invalid_cursor_is_rejected(client, usages):
+    assert client.get("/api/weighings", params={"cursor": "not-a-cursor"}).status_code == 400
+
+@pytest.mark.parametrize("search", ["tetra", "7696-12", "METHRIN", "(("])
+def test_search_matches_substrings_like_the_export(client, usages, search):
+    from openpyxl import load_workbook
+
+    ids, totals = walk(client, limit=4, search_query=search)
+    expected = [d for d in usages if search.lower() in (d["compound_name"] + d["cas_number"]).lower()]
+    assert ids == newest_first(expected)
+    assert totals == {len(expected)}
+
+    export = client.get("/api/weighings/export.xlsx", params={"search_query": search})
+    assert export.status_code == 200, export.text
+    sheet = load_workbook(io.BytesIO(export.content), read_only=True).active
+    names = [row[1] for row in sheet.iter_rows(min_row=2, values_only=True) if len(row) > 1 and row[1]]
+    assert names == [d["compound_name"] for d in sorted(expected, key=lambda d: d["created_at"], reverse=True)]